@@ -0,0 +1,147 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import tifffile
+
+from nuclearSegQualityMetrics.SegmentationQualityMetrics import labelCentroidRadius, segQualErrors, \
+    saveResultsTestList
+from nuclearSegQualityMetrics.farsight_bindings import readNucleiSegCountSingle
+from nuclearSegQualityMetrics.featureCache import setDefaultFeatureCache
+from nuclearSegQualityMetrics.syntheticNuclei import writeSyntheticLabelPair
+
+# each entry is one point of a scaling sweep of volume size and nucleus count
+sweeps = {
+    'quick': [{'shape': (32, 128, 128), 'nNuclei': 40},
+              {'shape': (64, 256, 256), 'nNuclei': 500}],
+    'full': [{'shape': (32, 128, 128), 'nNuclei': 40},
+             {'shape': (64, 256, 256), 'nNuclei': 500},
+             {'shape': (128, 512, 512), 'nNuclei': 5000},
+             {'shape': (256, 1024, 1024), 'nNuclei': 40000}],
+}
+# import times of the entry points, in fresh interpreters
+importedModules = ['nuclearSegQualityMetrics.SegmentationQualityMetrics', 'nuclearSegQualityMetrics.farsight_bindings']
+syntheticPars = {'radiusMean': 3.0, 'radiusStd': 0.3, 'missedRate': 0.1, 'spuriousRate': 0.1,
+                 'displacedRate': 0.05, 'seed': 0}
+
+
+def timeCall(func, *args, nRepeats=3, **kwargs) -> float:
+
+    times = []
+    for repeat in range(nRepeats):
+        startTime = time.perf_counter()
+        func(*args, **kwargs)
+        times.append(time.perf_counter() - startTime)
+    return min(times)
+
+
+def getVersionInfo() -> dict:
+
+    try:
+        gitDescribe = subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                                              stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        gitDescribe = None
+
+    return {'gitDescribe': gitDescribe, 'python': platform.python_version(), 'numpy': np.__version__,
+            'platform': platform.platform(), 'timestamp': datetime.datetime.now().isoformat()}
+
+
+def runBenchmarks(sweep: list, workDir: str, nRepeats: int = 3, nTestFiles: int = 3) -> list:
+
+    # benchmarks measure computations, not cache hits
+    setDefaultFeatureCache(None)
+
+    results = []
+    for sweepPoint in sweep:
+        shape, nNuclei = tuple(sweepPoint['shape']), sweepPoint['nNuclei']
+        pointDir = os.path.join(workDir, '{}_{}'.format('x'.join(map(str, shape)), nNuclei))
+        os.makedirs(pointDir)
+
+        gtLabelImageFile, testLabelImageFile, expected = \
+            writeSyntheticLabelPair(pointDir, shape=shape, nNuclei=nNuclei, **syntheticPars)
+        testLabelImage = tifffile.imread(testLabelImageFile)
+
+        # readNucleiSegCountSingle expects the farsight output layout <dir>/<dir>.tif
+        countDir = os.path.join(pointDir, 'countTest')
+        os.makedirs(countDir)
+        shutil.copy(testLabelImageFile, os.path.join(countDir, 'countTest.tif'))
+
+        outputDir = os.path.join(pointDir, 'output')
+        os.makedirs(outputDir)
+
+        timings = {
+            'labelCentroidRadius': timeCall(labelCentroidRadius, testLabelImage, nRepeats=nRepeats),
+            'segQualErrors': timeCall(segQualErrors, testLabelImageFile, gtLabelImageFile, nRepeats=nRepeats),
+            'saveResultsTestList': timeCall(saveResultsTestList, [testLabelImageFile] * nTestFiles,
+                                            gtLabelImageFile, outputDir,
+                                            ['test{}'.format(x) for x in range(nTestFiles)], resume=False,
+                                            nRepeats=nRepeats),
+            'readNucleiSegCountSingle': timeCall(readNucleiSegCountSingle, countDir, nRepeats=nRepeats),
+        }
+
+        for function, seconds in timings.items():
+            results.append({'function': function, 'shape': list(shape), 'nNuclei': nNuclei,
+                            'nVoxels': int(np.prod(shape)), 'seconds': seconds})
+            print('{:<26} shape={:<18} nNuclei={:<6} {:9.4f}s'.format(function, str(shape), nNuclei, seconds))
+
+    return results
+
+
+def timeImports(modules: list, nRepeats: int = 3) -> list:
+
+    results = []
+    for module in modules:
+        times = []
+        for repeat in range(nRepeats):
+            startTime = time.perf_counter()
+            subprocess.check_call([sys.executable, '-c', 'import {}'.format(module)])
+            times.append(time.perf_counter() - startTime)
+        results.append({'function': 'import {}'.format(module), 'shape': [], 'nNuclei': 0, 'nVoxels': 0,
+                        'seconds': min(times)})
+        print('{:<60} {:9.4f}s'.format('import {}'.format(module), min(times)))
+    return results
+
+
+def compareResults(results: list, baselineResults: list):
+
+    baseline = {(x['function'], tuple(x['shape']), x['nNuclei']): x['seconds'] for x in baselineResults}
+    for result in results:
+        key = (result['function'], tuple(result['shape']), result['nNuclei'])
+        if key in baseline:
+            print('{:<26} shape={:<18} nNuclei={:<6} {:6.2f}x of baseline'.format(
+                key[0], str(key[1]), key[2], result['seconds'] / baseline[key]))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Time the metrics pipeline on synthetic label stacks')
+    parser.add_argument('--sweep', choices=sorted(sweeps), default='quick')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--output', default='benchmarkResults.json', help='JSON file to record results to')
+    parser.add_argument('--compare', default=None, help='JSON file of an earlier run to compare against')
+    args = parser.parse_args()
+
+    workDir = tempfile.mkdtemp(prefix='segQualBenchmark')
+    try:
+        results = timeImports(importedModules, nRepeats=args.repeats)
+        results += runBenchmarks(sweeps[args.sweep], workDir, nRepeats=args.repeats)
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+
+    with open(args.output, 'w') as fle:
+        json.dump({'version': getVersionInfo(), 'sweep': args.sweep, 'syntheticPars': syntheticPars,
+                   'results': results}, fle, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as fle:
+            compareResults(results, json.load(fle)['results'])
@@ -1,19 +1,27 @@
+import argparse
+import collections
+import json
+import multiprocessing
 import os
+import shutil
 import sys
+import tempfile
 from math import pi as PI
 
 import tifffile
-from skimage import measure
 import numpy as np
-import pandas as pd
-import seaborn as sns
 import typing
-from matplotlib import pyplot as plt
 from scipy.spatial import cKDTree
 
-from nuclearSegQualityMetrics.matplotlibRCParams import mplPars
-
-sns.set(rc=mplPars, style='darkgrid')
+from nuclearSegQualityMetrics.instrumentation import StageRecorder, JSONLinesLog, addInstrumentationHook, \
+    clearInstrumentationHooks, collectedRecords, emitRecord, runProfiled
+from nuclearSegQualityMetrics.featureCache import getDefaultFeatureCache, openFeatureCache, setDefaultFeatureCache
+from nuclearSegQualityMetrics.labelStatistics import LabelStats, labelStatistics, labelStatisticsChunked, \
+    labelImageShapeDtype, readLabelImageStrided
+from nuclearSegQualityMetrics.overlapMatching import assignmentMethods, classifyOverlaps, labelContingencyTable, \
+    overlapSweepCounts, labelPairCounts
+from nuclearSegQualityMetrics.runManifest import RunManifest
+from nuclearSegQualityMetrics.spatialMetrics import normalizeTileGrid, tileCounts, tileMetricsFromCounts
 
 
 def getSphereRadius(volume: float) -> float:
@@ -25,17 +33,70 @@ def getSphereRadius(volume: float) -> float:
     return temp ** (1/3.0)
 
 
-def labelCentroidRadius(labelImage: np.ndarray) -> tuple:
+def getSphereRadii(volumes: np.ndarray) -> np.ndarray:
+
+    return np.cbrt(3 * np.asarray(volumes, dtype=np.float64) / (4 * PI))
+
+
+def labelCentroidRadius(labelImage: np.ndarray, fillHoles: bool = True) -> LabelStats:
+
+    labels, voxelCounts, centroids, bboxes, filledVolumes = \
+        labelStatistics(labelImage, computeFilledVolumes=fillHoles)
 
-    regionProps = measure.regionprops(labelImage)
+    # volumes, and the radii derived from them, include enclosed holes, as regionprops' filled_area did
+    volumes = filledVolumes if fillHoles else voxelCounts
 
-    labels = [x.label for x in regionProps]
+    return LabelStats(labels, centroids, getSphereRadii(volumes), volumes, bboxes)
 
-    centroids = [x.centroid for x in regionProps]
-    volumes = [x.filled_area for x in regionProps]
-    radii = [getSphereRadius(x) for x in volumes]
 
-    return labels, centroids, radii, volumes
+def labelImageFileFeatures(labelImageFile: str, slabSize: typing.Union[None, int] = None,
+                           nSlabWorkers: int = 1, recorder: typing.Union[None, StageRecorder] = None,
+                           fillHoles: bool = True) -> tuple:
+
+    if recorder is None:
+        recorder = StageRecorder('labelImageFileFeatures')
+
+    # features with and without filled holes are cached apart, as their volumes and radii differ
+    cacheKind = 'features' if fillHoles else 'voxelCountFeatures'
+
+    featureCache = getDefaultFeatureCache()
+    if featureCache is not None:
+        with recorder.stage('featureCacheLookup'):
+            cached = featureCache.get(labelImageFile, kind=cacheKind)
+        if cached is not None:
+            recorder.count('featureCacheHits', 1)
+            return tuple(cached['shape']), np.dtype(str(cached['dtype'])), LabelStats.fromArrays(cached)
+
+    # with a slabSize, the stack is never loaded whole: peak memory is bounded by the slab size
+    if slabSize is None:
+        with recorder.stage('tiffRead'):
+            labelImage = tifffile.imread(labelImageFile)
+        shape, dtype = labelImage.shape, labelImage.dtype
+        with recorder.stage('labelStatistics'):
+            labelStats = labelCentroidRadius(labelImage, fillHoles=fillHoles)
+    else:
+        shape, dtype = labelImageShapeDtype(labelImageFile)
+        # reading and measuring are interleaved slab by slab here
+        with recorder.stage('labelStatisticsChunked'):
+            labels, voxelCounts, centroids, bboxes, filledVolumes = \
+                labelStatisticsChunked(labelImageFile, slabSize=slabSize, nWorkers=nSlabWorkers,
+                                       computeFilledVolumes=fillHoles)
+        volumes = filledVolumes if fillHoles else voxelCounts
+        labelStats = LabelStats(labels, centroids, getSphereRadii(volumes), volumes, bboxes)
+
+    recorder.count('bytesRead', os.path.getsize(labelImageFile))
+    recorder.count('voxelsProcessed', np.prod(shape))
+    recorder.count('labelsFound', len(labelStats))
+
+    if featureCache is not None:
+        cacheArrays = labelStats.toArrays()
+        cacheArrays.update({'shape': np.array(shape), 'dtype': np.array(np.dtype(dtype).str)})
+        featureCache.put(labelImageFile, cacheArrays, kind=cacheKind)
+
+    return shape, dtype, labelStats
+
+
+metricNames = ('Recall', 'Precision', 'fMeasure', 'Accuracy')
 
 
 def getMetricsFromCounts(nFP: float, nTP: float, nFN: float) -> typing.List[float]:
@@ -51,129 +112,648 @@ def getMetricsFromCounts(nFP: float, nTP: float, nFN: float) -> typing.List[floa
     return recall, precision, fMeasure, accuracy
 
 
-def segQualErrors(testLabelImageFile: str,
-                  groundTruthLabeImageFile: str, saveDebugInfoTo: typing.Union[None, str] = None) -> tuple:
+def bootstrapMetricIntervals(nFP: int, nTP: int, nFN: int, nResamples: int = 2000, confidenceLevel: float = 0.95,
+                             seed: int = 0) -> dict:
 
-    testLabelImage = tifffile.imread(testLabelImageFile)
-    assert testLabelImage.dtype == np.uint16, "The test image, {}, is not of type 16bit grayscale. " \
-                                                          "Farsight output label image is usually 16bit " \
-                                              "grayscale, please check!".format(testLabelImageFile)
+    # the units classified by segQualErrors are matched pairs (TP), unmatched test nuclei (FP) and unmatched gt
+    # nuclei (FN). Resampling them with replacement only changes how many of each kind there are, so each
+    # resample is a multinomial draw of the three counts, and all of them are drawn and evaluated at once
+    counts = np.array([nFP, nTP, nFN], dtype=np.float64)
+    nUnits = int(counts.sum())
+    if nUnits == 0:
+        return {x: (np.nan, np.nan) for x in metricNames}
 
-    gtLabelImage = tifffile.imread(groundTruthLabeImageFile)
+    draws = np.random.RandomState(seed).multinomial(nUnits, counts / nUnits, size=nResamples).astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        resampledMetrics = np.stack(getMetricsFromCounts(draws[:, 0], draws[:, 1], draws[:, 2]), axis=1)
 
-    testShape = testLabelImage.shape
-    gtShape = gtLabelImage.shape
+    tail = 100 * (1 - confidenceLevel) / 2
+    lows, highs = np.nanpercentile(resampledMetrics, [tail, 100 - tail], axis=0)
 
-    assert len(testShape) == 3, 'testLabelImage is not 3D'
-    assert len(gtShape) == 3, 'groundTruthLabelImage is not 3D'
+    return {x: (float(low), float(high)) for x, low, high in zip(metricNames, lows, highs)}
 
-    assert testShape == gtShape, 'testLabelImage {} and groundTruthLabelImage {} ' \
-                                 'do not have the same shape'.format(testLabelImageFile, groundTruthLabeImageFile)
 
-    testLabels, testCentroids, testRadii, testVolumes = labelCentroidRadius(testLabelImage)
-    gtLabels, gtCentroids, gtRadii, gtVolumes = labelCentroidRadius(gtLabelImage)
+def classifyCentroids(testCentroids: np.ndarray, gtCentroids: np.ndarray, gtRadii: np.ndarray,
+                      gtCentroidKDTree: typing.Union[None, cKDTree] = None,
+                      recorder: typing.Union[None, StageRecorder] = None) -> tuple:
 
-    testCentroidKDTree = cKDTree(testCentroids, leafsize=100)
-    nnDists, nnInds = testCentroidKDTree.query(gtCentroids)
+    if recorder is None:
+        recorder = StageRecorder('classifyCentroids')
+
+    testCentroids = np.asarray(testCentroids, dtype=np.float64).reshape(-1, 3)
+    gtCentroids = np.asarray(gtCentroids, dtype=np.float64).reshape(-1, 3)
+    gtRadii = np.asarray(gtRadii, dtype=np.float64)
+
+    testTPMask = np.zeros(len(testCentroids), dtype=bool)
+    testNoiseFPMask = np.zeros(len(testCentroids), dtype=bool)
+
+    if len(testCentroids) == 0 or len(gtCentroids) == 0:
+        testNoiseFPMask[:] = True
+        return np.zeros(len(gtCentroids), dtype=bool), testTPMask, testNoiseFPMask
+
+    # no neighbour farther than the largest gt radius can be a match, which bounds the tree searches
+    maxRadius = np.nextafter(gtRadii.max(), np.inf)
+
+    with recorder.stage('kdTree'):
+        testCentroidKDTree = cKDTree(testCentroids, leafsize=100)
+        nnDists, nnInds = testCentroidKDTree.query(gtCentroids, distance_upper_bound=maxRadius)
+
+    # a gt nucleus is a TP if the nearest test centroid lies within its equivalent sphere
+    gtTPMask = np.less_equal(nnDists, gtRadii)
+    testTPMask[nnInds[gtTPMask]] = True
+
+    testFPInds = np.flatnonzero(~testTPMask)
+
+    if len(testFPInds):
 
-    # mask for nnInds
-    truePositiveMask = np.less_equal(nnDists, gtRadii)
-    testTPInds = nnInds[truePositiveMask]
-    testTPInds = list(set(testTPInds))
-    testTPLabels = [testLabels[x] for x in testTPInds]
+        # looking for nearest neighbours among gtCentroids for each testFP. FPs whose centroids
+        # are not in any gt sphere are noise
+        with recorder.stage('kdTree'):
+            if gtCentroidKDTree is None:
+                gtCentroidKDTree = cKDTree(gtCentroids, leafsize=100)
+            gtNNDists, gtNNInds = gtCentroidKDTree.query(testCentroids[testFPInds], distance_upper_bound=maxRadius)
+        gtNNFound = np.isfinite(gtNNDists)
+        testNoiseFPMask[testFPInds] = True
+        testNoiseFPMask[testFPInds[gtNNFound]] = gtNNDists[gtNNFound] > gtRadii[gtNNInds[gtNNFound]]
 
-    testFPLabels = [x for x in testLabels if x not in testTPLabels]
-    testFPCentroids = [y for x, y in zip(testLabels, testCentroids) if x not in testTPLabels]
+    return gtTPMask, testTPMask, testNoiseFPMask
 
-    if len(testFPLabels):
 
+def centroidSweepCounts(testCentroids: np.ndarray, gtCentroids: np.ndarray, gtRadii: np.ndarray,
+                        radiusScales: typing.Iterable[float],
+                        gtCentroidKDTree: typing.Union[None, cKDTree] = None) -> tuple:
+
+    radiusScales = np.asarray(radiusScales, dtype=np.float64)
+    testCentroids = np.asarray(testCentroids, dtype=np.float64).reshape(-1, 3)
+    gtCentroids = np.asarray(gtCentroids, dtype=np.float64).reshape(-1, 3)
+    gtRadii = np.asarray(gtRadii, dtype=np.float64)
+
+    if len(testCentroids) == 0 or len(gtCentroids) == 0:
+        return np.zeros(len(radiusScales), dtype=np.int64), np.full(len(radiusScales), len(testCentroids))
+
+    # one query each way, bounded by the largest scaled radius. A distance over a radius is then the smallest
+    # scale at which a pair matches, and the counts at all scales follow from sorted distance ratios
+    maxRadius = np.nextafter(gtRadii.max() * radiusScales.max(), np.inf)
+
+    testCentroidKDTree = cKDTree(testCentroids, leafsize=100)
+    nnDists, nnInds = testCentroidKDTree.query(gtCentroids, distance_upper_bound=maxRadius)
+    if gtCentroidKDTree is None:
         gtCentroidKDTree = cKDTree(gtCentroids, leafsize=100)
-        # looking for nearest neighbours for among gtCentroids for each testFP
-        gtNNDists, gtNNInds = gtCentroidKDTree.query(testFPCentroids)
-        # looking for those FPs whose centroids are not in any gt sphere
-        # In the sentence below, x in an index along testFPLabels, gtNNInds[x] is the index of the correspoding
-        # NN among gtLabels
-        noiseFPIndsAmongTestFPs = [x for x, y in enumerate(gtNNDists) if y > gtRadii[gtNNInds[x]]]
-        noiseFPLabels = [testFPLabels[x] for x in noiseFPIndsAmongTestFPs]
+    gtNNDists, gtNNInds = gtCentroidKDTree.query(testCentroids, distance_upper_bound=maxRadius)
 
-        nonNoiseFPLabels = [x for x in testFPLabels if x not in noiseFPLabels]
+    gtFound = np.isfinite(nnDists)
+    testTPScales = np.full(len(testCentroids), np.inf)
+    np.minimum.at(testTPScales, nnInds[gtFound], nnDists[gtFound] / gtRadii[gtFound])
 
-    else:
-        noiseFPLabels = []
-        nonNoiseFPLabels = []
+    testFound = np.isfinite(gtNNDists)
+    testInGTScales = np.full(len(testCentroids), np.inf)
+    testInGTScales[testFound] = gtNNDists[testFound] / gtRadii[gtNNInds[testFound]]
 
-    gtClassification = ["TP" if x else "FN" for x in truePositiveMask]
-    testClassification = []
+    # a test nucleus is a TP from testTPScales on, and noise as long as it is neither a TP nor in a gt sphere
+    nTP = np.searchsorted(np.sort(testTPScales), radiusScales, side='right')
+    nNoiseFP = len(testCentroids) - np.searchsorted(np.sort(np.minimum(testTPScales, testInGTScales)),
+                                                    radiusScales, side='right')
 
-    for testLabel in testLabels:
+    return nTP, nNoiseFP
+
+
+# 'centroid' matches a test nucleus to a gt nucleus if its centroid lies in the equivalent sphere of the gt nucleus,
+# 'overlap' matches them one to one by the IoU of their voxels
+matchingModes = ('centroid', 'overlap')
 
-        if testLabel in testTPLabels:
-            testClassification.append("TP")
-        elif testLabel in noiseFPLabels:
-            testClassification.append("FP-Noise")
-        else:
-            testClassification.append("FP-NonNoise")
+
+class GroundTruthFeatures(object):
+
+    def __init__(self, groundTruthLabelImageFile: str, slabSize: typing.Union[None, int] = None,
+                 nSlabWorkers: int = 1, fillHoles: bool = True):
+
+        recorder = StageRecorder('groundTruthFeatures', groundTruthLabelImageFile=groundTruthLabelImageFile)
+
+        gtShape, gtDtype, self.stats = \
+            labelImageFileFeatures(groundTruthLabelImageFile, slabSize=slabSize, nSlabWorkers=nSlabWorkers,
+                                   recorder=recorder, fillHoles=fillHoles)
+
+        assert len(gtShape) == 3, 'groundTruthLabelImage is not 3D'
+
+        self.labelImageFile = groundTruthLabelImageFile
+        self.shape = gtShape
+        self.fillHoles = fillHoles
+
+        with recorder.stage('kdTree'):
+            self.centroidKDTree = cKDTree(self.stats.centroids, leafsize=100)
+
+        recorder.emit()
+
+    def saveShared(self, sharedDir: str):
+
+        with open(os.path.join(sharedDir, 'gtFeatures.json'), 'w') as fle:
+            json.dump({'labelImageFile': self.labelImageFile, 'shape': list(self.shape),
+                       'fillHoles': self.fillHoles}, fle)
+
+        self.stats.save(sharedDir)
+
+    @classmethod
+    def loadShared(cls, sharedDir: str):
+
+        # memory-mapped, so that processes loading the same sharedDir share the pages of the arrays
+        gtFeatures = cls.__new__(cls)
+
+        with open(os.path.join(sharedDir, 'gtFeatures.json')) as fle:
+            meta = json.load(fle)
+        gtFeatures.labelImageFile = meta['labelImageFile']
+        gtFeatures.shape = tuple(meta['shape'])
+        gtFeatures.fillHoles = meta['fillHoles']
+
+        gtFeatures.stats = LabelStats.load(sharedDir, mmapMode='r')
+        gtFeatures.centroidKDTree = cKDTree(gtFeatures.stats.centroids, leafsize=100)
+
+        return gtFeatures
+
+
+def debugInfoDirName(testLabelImageFile: str, groundTruthLabelImageFile: str) -> str:
 
     testLabelImageStub = os.path.split(testLabelImageFile)[1].split(".")[0]
-    gTLabelImageFileStub = os.path.split(groundTruthLabeImageFile)[1].split(".")[0]
+    gTLabelImageFileStub = os.path.split(groundTruthLabelImageFile)[1].split(".")[0]
 
-    outdirStub = "{}_{}".format(testLabelImageStub, gTLabelImageFileStub)
-    localOutputDir = os.path.join(saveDebugInfoTo, outdirStub)
+    return "{}_{}".format(testLabelImageStub, gTLabelImageFileStub)
 
-    if not os.path.isdir(localOutputDir):
-        os.mkdir(localOutputDir)
+
+def segQualErrors(testLabelImageFile: str,
+                  groundTruthLabeImageFile: typing.Union[str, GroundTruthFeatures],
+                  saveDebugInfoTo: typing.Union[None, str] = None,
+                  slabSize: typing.Union[None, int] = None, tableFormat: str = 'csv',
+                  matching: str = 'centroid', iouThreshold: float = 0.5, assignment: str = 'greedy',
+                  fillHoles: bool = True) -> tuple:
+
+    errors, tileMetrics = _segQualErrors(testLabelImageFile, groundTruthLabeImageFile,
+                                         saveDebugInfoTo=saveDebugInfoTo, slabSize=slabSize, tableFormat=tableFormat,
+                                         matching=matching, iouThreshold=iouThreshold, assignment=assignment,
+                                         fillHoles=fillHoles)
+
+    return errors
+
+
+def segQualErrorsTiles(testLabelImageFile: str,
+                       groundTruthLabeImageFile: typing.Union[str, GroundTruthFeatures],
+                       tileGrid: typing.Union[int, typing.Iterable[int]],
+                       saveDebugInfoTo: typing.Union[None, str] = None,
+                       slabSize: typing.Union[None, int] = None, tableFormat: str = 'csv',
+                       matching: str = 'centroid', iouThreshold: float = 0.5, assignment: str = 'greedy',
+                       fillHoles: bool = True) -> tuple:
+
+    # the errors of segQualErrors, and the per-tile counts and metrics, arrays of the shape of the grid
+    return _segQualErrors(testLabelImageFile, groundTruthLabeImageFile, saveDebugInfoTo=saveDebugInfoTo,
+                          slabSize=slabSize, tableFormat=tableFormat, matching=matching, iouThreshold=iouThreshold,
+                          assignment=assignment, tileGrid=tileGrid, fillHoles=fillHoles)
+
+
+def _segQualErrors(testLabelImageFile: str,
+                   groundTruthLabeImageFile: typing.Union[str, GroundTruthFeatures],
+                   saveDebugInfoTo: typing.Union[None, str] = None,
+                   slabSize: typing.Union[None, int] = None, tableFormat: str = 'csv',
+                   matching: str = 'centroid', iouThreshold: float = 0.5, assignment: str = 'greedy',
+                   tileGrid: typing.Union[None, int, typing.Iterable[int]] = None, fillHoles: bool = True) -> tuple:
+
+    assert matching in matchingModes, 'Unknown matching {}, must be one of {}'.format(matching, matchingModes)
+
+    if isinstance(groundTruthLabeImageFile, GroundTruthFeatures):
+        gtFeatures = groundTruthLabeImageFile
+        assert gtFeatures.fillHoles == fillHoles, \
+            'The features of {} were computed with fillHoles={}, not {}'.format(gtFeatures.labelImageFile,
+                                                                                gtFeatures.fillHoles, fillHoles)
+    else:
+        gtFeatures = GroundTruthFeatures(groundTruthLabeImageFile, slabSize=slabSize, fillHoles=fillHoles)
+    groundTruthLabeImageFile = gtFeatures.labelImageFile
+
+    recorder = StageRecorder('segQualErrors', testLabelImageFile=testLabelImageFile,
+                             groundTruthLabelImageFile=groundTruthLabeImageFile)
+
+    testShape, testDtype, testStats = labelImageFileFeatures(testLabelImageFile, slabSize=slabSize,
+                                                             recorder=recorder, fillHoles=fillHoles)
+    assert testDtype == np.uint16, "The test image, {}, is not of type 16bit grayscale. " \
+                                                          "Farsight output label image is usually 16bit " \
+                                              "grayscale, please check!".format(testLabelImageFile)
+
+    assert len(testShape) == 3, 'testLabelImage is not 3D'
+
+    assert testShape == gtFeatures.shape, 'testLabelImage {} and groundTruthLabelImage {} ' \
+                                          'do not have the same shape'.format(testLabelImageFile,
+                                                                              groundTruthLabeImageFile)
+
+    gtStats = gtFeatures.stats
+
+    if matching == 'centroid':
+        gtTPMask, testTPMask, testNoiseFPMask = classifyCentroids(testStats.centroids, gtStats.centroids,
+                                                                  gtStats.radii,
+                                                                  gtCentroidKDTree=gtFeatures.centroidKDTree,
+                                                                  recorder=recorder)
+    else:
+        with recorder.stage('contingencyTable'):
+            gtPairLabels, testPairLabels, pairCounts = labelContingencyTable(groundTruthLabeImageFile,
+                                                                             testLabelImageFile, slabSize=slabSize)
+        with recorder.stage('overlapMatching'):
+            gtTPMask, testTPMask, testNoiseFPMask = classifyOverlaps(gtStats.labels, testStats.labels, gtPairLabels,
+                                                                    testPairLabels, pairCounts,
+                                                                    iouThreshold=iouThreshold,
+                                                                    assignment=assignment)
+
+    # the counts, tiles and debug tables below take the masks and classifications of all nuclei at once, so the
+    # label features are not copied per class here. LabelStats.splitBy gives the classes as views, when needed
+    with recorder.stage('classification'):
+        gtClassification = np.where(gtTPMask, "TP", "FN")
+        testClassification = np.where(testTPMask, "TP", np.where(testNoiseFPMask, "FP-Noise", "FP-NonNoise"))
+
+    # per-tile counts and metrics, from the centroids of the nuclei classified above
+    tileMetrics = None
+    if tileGrid is not None:
+        with recorder.stage('tiles'):
+            tileMetrics = tileCounts(gtStats.centroids, gtTPMask, testStats.centroids, testTPMask, testNoiseFPMask,
+                                     gtFeatures.shape, tileGrid)
+
+    outdirStub = debugInfoDirName(testLabelImageFile, groundTruthLabeImageFile)
 
     if saveDebugInfoTo:
-        writeDebugInfoTo(gtCentroids, gtLabels, gtRadii, gtVolumes,
-                         gtClassification,
-                         os.path.join(localOutputDir, "gtData.xlsx"))
-        writeDebugInfoTo(testCentroids, testLabels, testRadii, testVolumes,
-                         testClassification,
-                         os.path.join(localOutputDir, "testData.xlsx"))
+        localOutputDir = os.path.join(saveDebugInfoTo, outdirStub)
+
+        # several workers may get here at the same time
+        os.makedirs(localOutputDir, exist_ok=True)
+
+        with recorder.stage('debugOutput'):
+            writeDebugInfoTo(gtStats, gtClassification,
+                             os.path.join(localOutputDir, "gtData"), tableFormat=tableFormat)
+            writeDebugInfoTo(testStats, testClassification,
+                             os.path.join(localOutputDir, "testData"), tableFormat=tableFormat)
+            if tileGrid is not None:
+                from nuclearSegQualityMetrics.resultsIO import tileMetricsDataFrame, writeTable
+                writeTable(tileMetricsDataFrame(tileMetrics), os.path.join(localOutputDir, "tileMetrics"),
+                           tableFormat=tableFormat, index=False)
 
-    nTP = len(testTPLabels)
+    nTP = int(testTPMask.sum())
 
-    nGT = len(gtLabels)
+    nGT = len(gtStats)
 
-    nTest = len(testLabels)
+    nTest = len(testStats)
 
     nFP = nTest - nTP
 
     nFN = nGT - nTP
 
-    nNoiseFP = len(noiseFPLabels)
-    nNonNoiseFP = len(nonNoiseFPLabels)
+    nNoiseFP = int(testNoiseFPMask.sum())
+    nNonNoiseFP = int(np.count_nonzero(~testTPMask & ~testNoiseFPMask))
 
     assert nNoiseFP + nNonNoiseFP == nFP, "NoiseFPs and NonNoiseFPs don't union up to FalsePositives"
 
-    return nFP, nTP, nFN, nNoiseFP, nNonNoiseFP
+    recorder.emit()
+
+    return (nFP, nTP, nFN, nNoiseFP, nNonNoiseFP), tileMetrics
+
+
+def segQualErrorsSweep(testLabelImageFile: str,
+                       groundTruthLabeImageFile: typing.Union[str, GroundTruthFeatures],
+                       thresholds: typing.Iterable[float], matching: str = 'centroid',
+                       slabSize: typing.Union[None, int] = None, assignment: str = 'greedy') -> np.ndarray:
+
+    assert matching in matchingModes, 'Unknown matching {}, must be one of {}'.format(matching, matchingModes)
 
-def writeDebugInfoTo(centroids, labels, radii, volumes, classification, outputFile):
+    # thresholds are scale factors of the gt radii with 'centroid' matching and IoU thresholds with 'overlap'
+    if isinstance(groundTruthLabeImageFile, GroundTruthFeatures):
+        gtFeatures = groundTruthLabeImageFile
+    else:
+        gtFeatures = GroundTruthFeatures(groundTruthLabeImageFile, slabSize=slabSize)
+
+    recorder = StageRecorder('segQualErrorsSweep', testLabelImageFile=testLabelImageFile,
+                             groundTruthLabelImageFile=gtFeatures.labelImageFile)
+
+    testShape, testDtype, testStats = labelImageFileFeatures(testLabelImageFile, slabSize=slabSize,
+                                                             recorder=recorder)
+    assert testShape == gtFeatures.shape, 'testLabelImage {} and groundTruthLabelImage {} ' \
+                                          'do not have the same shape'.format(testLabelImageFile,
+                                                                              gtFeatures.labelImageFile)
+
+    if matching == 'centroid':
+        with recorder.stage('kdTree'):
+            nTP, nNoiseFP = centroidSweepCounts(testStats.centroids, gtFeatures.stats.centroids,
+                                                gtFeatures.stats.radii, thresholds,
+                                                gtCentroidKDTree=gtFeatures.centroidKDTree)
+    else:
+        with recorder.stage('contingencyTable'):
+            gtPairLabels, testPairLabels, pairCounts = labelContingencyTable(gtFeatures.labelImageFile,
+                                                                             testLabelImageFile, slabSize=slabSize)
+        with recorder.stage('overlapMatching'):
+            nTP, nNoiseFP = overlapSweepCounts(gtPairLabels, testPairLabels, pairCounts, thresholds,
+                                               assignment=assignment)
+
+    recorder.emit()
+
+    nFP = len(testStats) - nTP
+    nFN = len(gtFeatures.stats) - nTP
+
+    # one row of (nFP, nTP, nFN, nNoiseFP, nNonNoiseFP) per threshold
+    return np.stack([nFP, nTP, nFN, nNoiseFP, nFP - nNoiseFP], axis=1).astype(np.int64)
+
+
+def labelImageStridedFeatures(labelImage: np.ndarray, stride: tuple, offset: tuple = (0, 0, 0)) -> LabelStats:
+
+    labels, voxelCounts, centroids, bboxes, filledVolumes = labelStatistics(labelImage)
+
+    # a voxel sampled at index i along an axis lies at offset + i * stride in full resolution, and stands for
+    # a block of prod(stride) voxels
+    stride = np.asarray(stride, dtype=np.int64)
+    offset = np.asarray(offset, dtype=np.int64)
+    volumes = voxelCounts * int(np.prod(stride))
+    bboxes = np.concatenate([bboxes[:, :3] * stride + offset, (bboxes[:, 3:] - 1) * stride + offset + 1], axis=1)
+
+    return LabelStats(labels, centroids * stride + offset, getSphereRadii(volumes), volumes, bboxes)
+
+
+def previewSegQualErrors(testLabelImageFile: str, groundTruthLabeImageFile: str, stride: tuple = (2, 2, 2),
+                         nPhases: int = 2, matching: str = 'centroid', iouThreshold: float = 0.5,
+                         assignment: str = 'greedy') -> dict:
+
+    assert matching in matchingModes, 'Unknown matching {}, must be one of {}'.format(matching, matchingModes)
+    assert len(stride) == 3 and min(stride) >= 1, 'stride must be 3 positive integers, got {}'.format(stride)
+    assert nPhases >= 1, 'nPhases must be at least 1, got {}'.format(nPhases)
+
+    recorder = StageRecorder('previewSegQualErrors', testLabelImageFile=testLabelImageFile,
+                             groundTruthLabelImageFile=groundTruthLabeImageFile, stride=list(stride))
+
+    # the stacks are sampled nPhases times, at offsets spread over the stride. How much the metrics of the phases
+    # differ estimates how far they are from the full resolution metrics
+    phaseErrors = []
+    for phase in range(nPhases):
+        offset = tuple(x * phase // nPhases for x in stride)
+
+        with recorder.stage('stridedRead'):
+            gtLabelImage = readLabelImageStrided(groundTruthLabeImageFile, stride, offset)
+            testLabelImage = readLabelImageStrided(testLabelImageFile, stride, offset)
+        assert gtLabelImage.shape == testLabelImage.shape, \
+            'testLabelImage {} and groundTruthLabelImage {} do not have the same shape'.format(
+                testLabelImageFile, groundTruthLabeImageFile)
+        recorder.count('voxelsProcessed', gtLabelImage.size + testLabelImage.size)
+
+        with recorder.stage('labelStatistics'):
+            gtStats = labelImageStridedFeatures(gtLabelImage, stride, offset)
+            testStats = labelImageStridedFeatures(testLabelImage, stride, offset)
+
+        if matching == 'centroid':
+            gtTPMask, testTPMask, testNoiseFPMask = classifyCentroids(testStats.centroids, gtStats.centroids,
+                                                                      gtStats.radii, recorder=recorder)
+        else:
+            with recorder.stage('overlapMatching'):
+                gtPairLabels, testPairLabels, pairCounts = labelPairCounts(gtLabelImage, testLabelImage,
+                                                                           int(testLabelImage.max()) + 1)
+                gtTPMask, testTPMask, testNoiseFPMask = classifyOverlaps(gtStats.labels, testStats.labels,
+                                                                        gtPairLabels, testPairLabels, pairCounts,
+                                                                        iouThreshold=iouThreshold,
+                                                                        assignment=assignment)
+
+        nTP = int(testTPMask.sum())
+        nNoiseFP = int(testNoiseFPMask.sum())
+        phaseErrors.append((len(testStats) - nTP, nTP, len(gtStats) - nTP, nNoiseFP,
+                            len(testStats) - nTP - nNoiseFP))
+
+    recorder.emit()
+
+    phaseMetrics = np.array([getMetricsFromCounts(*x[:3]) for x in phaseErrors])
+
+    return {'phaseErrors': phaseErrors,
+            'metrics': dict(zip(metricNames, phaseMetrics.mean(axis=0).tolist())),
+            'metricSpreads': dict(zip(metricNames, (phaseMetrics.max(axis=0) - phaseMetrics.min(axis=0)).tolist()))}
+
+
+def writeDebugInfoTo(labelStats: LabelStats, classification: np.ndarray, outputFileStem: str,
+                     tableFormat: str = 'csv') -> str:
+
+    from nuclearSegQualityMetrics.resultsIO import debugInfoDataFrame, writeTable
+
+    df = debugInfoDataFrame(labelStats, classification)
+    return writeTable(df, outputFileStem, tableFormat=tableFormat)
+
+
+_workerGTFeatures = None
+
+
+def _initSegQualErrorsWorker(sharedDir: str, featureCache):
+
+    global _workerGTFeatures
+    # hooks are not used in workers, records are handed back to the parent instead
+    clearInstrumentationHooks()
+    _workerGTFeatures = GroundTruthFeatures.loadShared(sharedDir)
+    setDefaultFeatureCache(featureCache)
+
+
+def _segQualErrorsWorker(args: tuple) -> tuple:
+
+    testLabelImageFile, segQualErrorsKwargs = args
+
+    with collectedRecords() as records:
+        errors, tileMetrics = _segQualErrors(testLabelImageFile, _workerGTFeatures, **segQualErrorsKwargs)
+
+    return errors, tileMetrics, records
 
-    df = pd.DataFrame(index=pd.Index(data=labels, name="Label Value"))
-    df["Centroids"] = list(map(str, map(lambda x: np.around(x, 2), centroids)))
-    df["Classification"] = classification
-    df["Equivalent Sperical Radius (pixels)"] = radii
-    df["Volume (pixels)"] = volumes
-    df.to_excel(outputFile)
+
+def segQualErrorsTestList(testLabelImageFiles: typing.Iterable[str],
+                          groundTruthLabelImagFile: typing.Union[str, GroundTruthFeatures],
+                          saveDebugInfoTo: typing.Union[None, str] = None,
+                          nWorkers: int = 1, slabSize: typing.Union[None, int] = None,
+                          tableFormat: str = 'csv', matching: str = 'centroid', iouThreshold: float = 0.5,
+                          assignment: str = 'greedy',
+                          onResult: typing.Union[None, typing.Callable[[int, tuple], None]] = None,
+                          shouldStop: typing.Union[None, typing.Callable[[], bool]] = None,
+                          tileGrid: typing.Union[None, int, typing.Iterable[int]] = None,
+                          onTileMetrics: typing.Union[None, typing.Callable[[int, dict], None]] = None,
+                          fillHoles: bool = True) -> typing.List[tuple]:
+
+    assert nWorkers >= 1, 'nWorkers must be at least 1, got {}'.format(nWorkers)
+
+    # ground truth is read and measured only once and shared by all the comparisons below
+    if isinstance(groundTruthLabelImagFile, GroundTruthFeatures):
+        gtFeatures = groundTruthLabelImagFile
+    else:
+        gtFeatures = GroundTruthFeatures(groundTruthLabelImagFile, slabSize=slabSize, fillHoles=fillHoles)
+
+    nWorkers = min(nWorkers, len(testLabelImageFiles))
+    segQualErrorsKwargs = {'saveDebugInfoTo': saveDebugInfoTo, 'slabSize': slabSize, 'tableFormat': tableFormat,
+                           'matching': matching, 'iouThreshold': iouThreshold, 'assignment': assignment,
+                           'tileGrid': tileGrid, 'fillHoles': fillHoles}
+
+    # shouldStop is checked between files: files being processed are finished, no new ones are started, and the
+    # errors of the files finished until then are returned
+    if shouldStop is None:
+        shouldStop = lambda: False
+
+    # with a tileGrid, onTileMetrics gets the tile metrics of each file, as returned by segQualErrorsTiles, just
+    # before onResult gets its errors
+    def handleResult(ind, errors, tileMetrics):
+        if onTileMetrics is not None and tileMetrics is not None:
+            onTileMetrics(ind, tileMetrics)
+        if onResult is not None:
+            onResult(ind, errors)
+
+    if nWorkers <= 1:
+        allErrors = []
+        for ind, testLabelImageFile in enumerate(testLabelImageFiles):
+            if shouldStop():
+                break
+            errors, tileMetrics = _segQualErrors(testLabelImageFile, gtFeatures, **segQualErrorsKwargs)
+            allErrors.append(errors)
+            handleResult(ind, errors, tileMetrics)
+        return allErrors
+
+    # gt features go to the workers once, as memory mapped files, and not pickled with every task.
+    # Workers are spawned rather than forked, callers may be running other threads, e.g. a GUI or batch job groups,
+    # and forking a process with threads can deadlock
+    sharedDir = tempfile.mkdtemp(prefix='segQualGT')
+    try:
+        gtFeatures.saveShared(sharedDir)
+        with multiprocessing.get_context('spawn').Pool(processes=nWorkers, initializer=_initSegQualErrorsWorker,
+                                                       initargs=(sharedDir, getDefaultFeatureCache())) as pool:
+            # at most nWorkers files are in flight, so that stopping does not leave queued tasks behind.
+            # Results are taken in the order of the files
+            tasks = iter([(x, segQualErrorsKwargs) for x in testLabelImageFiles])
+            inFlight = collections.deque()
+            for task in tasks:
+                inFlight.append(pool.apply_async(_segQualErrorsWorker, (task,)))
+                if len(inFlight) == nWorkers:
+                    break
+
+            allErrors = []
+            while inFlight:
+                errors, tileMetrics, records = inFlight.popleft().get()
+                allErrors.append(errors)
+                for record in records:
+                    emitRecord(record)
+                handleResult(len(allErrors) - 1, errors, tileMetrics)
+                if not shouldStop():
+                    task = next(tasks, None)
+                    if task is not None:
+                        inFlight.append(pool.apply_async(_segQualErrorsWorker, (task,)))
+    finally:
+        shutil.rmtree(sharedDir, ignore_errors=True)
+
+    return allErrors
+
+
+def _runReports(outputDir: str, excelExport: bool, reportMode: str, tableFiles: typing.List[str]):
+
+    from nuclearSegQualityMetrics.reports import renderReports, startReports
+
+    # only the tables written by the run are rendered and exported, not those of earlier runs into outputDir
+    if reportMode == 'sync':
+        renderReports(outputDir, excelExport=excelExport, tableFiles=tableFiles)
+    elif reportMode == 'background':
+        startReports(outputDir, excelExport=excelExport, tableFiles=tableFiles)
+
+
+# reports, i.e. plots and excel files, are rendered from the saved tables after they are written. 'sync' renders
+# them before returning, 'background' in a separate process and 'skip' not at all, see reports.renderReports
+reportModes = ('sync', 'background', 'skip')
+
+
+def resultsManifestOptions(saveDebugInfo: bool = False, tableFormat: str = 'csv', matching: str = 'centroid',
+                           iouThreshold: float = 0.5, assignment: str = 'greedy',
+                           tileGrid: typing.Union[None, int, typing.Iterable[int]] = None,
+                           fillHoles: bool = True) -> dict:
+
+    # the options the results in the run manifest depend on, they are part of the keys of its entries.
+    # tileGrid and fillHoles only when not the defaults, so that the keys of runs without them stay as they were
+    options = {'saveDebugInfo': saveDebugInfo, 'tableFormat': tableFormat, 'matching': matching,
+               'iouThreshold': iouThreshold, 'assignment': assignment}
+    if tileGrid is not None:
+        options['tileGrid'] = list(normalizeTileGrid(tileGrid))
+    if not fillHoles:
+        options['fillHoles'] = False
+
+    return options
 
 
 def saveResultsTestList(testLabelImageFiles: typing.Iterable[str],
-                        groundTruthLabelImagFile: str, outputDir: str,
-                        labels: typing.Iterable[str], saveDebugInfo: bool = False) -> pd.DataFrame:
+                        groundTruthLabelImagFile: typing.Union[str, GroundTruthFeatures], outputDir: str,
+                        labels: typing.Iterable[str], saveDebugInfo: bool = False,
+                        nWorkers: int = 1, slabSize: typing.Union[None, int] = None,
+                        tableFormat: str = 'csv', excelExport: bool = False,
+                        reportMode: str = 'sync', resume: bool = False, matching: str = 'centroid',
+                        iouThreshold: float = 0.5, assignment: str = 'greedy',
+                        onResult: typing.Union[None, typing.Callable[[int, tuple], None]] = None,
+                        shouldStop: typing.Union[None, typing.Callable[[], bool]] = None,
+                        resultsStore: typing.Union[None, str] = None, nBootstrap: int = 2000,
+                        confidenceLevel: float = 0.95,
+                        tileGrid: typing.Union[None, int, typing.Iterable[int]] = None,
+                        fillHoles: bool = True) -> 'pandas.DataFrame':
     assert len(labels) == len(testLabelImageFiles), 'Number of elements in labels ' \
                                                         'and testLabelImageFiles are not equal'
+    assert reportMode in reportModes, 'Unknown reportMode {}, must be one of {}'.format(reportMode, reportModes)
+
+    # pandas and the plotting stack are only needed here, not for computing errors
+    import pandas as pd
+    from nuclearSegQualityMetrics.resultsIO import writeTable
 
     nTest = len(testLabelImageFiles)
-    resDF = pd.DataFrame()
 
     if saveDebugInfo:
         saveDebugInfoTo = outputDir
     else:
         saveDebugInfoTo = None
-    for label, testLabelImageFile in zip(labels, testLabelImageFiles):
-        nFP, nTP, nFN, nNoiseFP, nNonNoiseFP= \
-            segQualErrors(testLabelImageFile, groundTruthLabelImagFile, saveDebugInfoTo=saveDebugInfoTo)
+
+    if isinstance(groundTruthLabelImagFile, GroundTruthFeatures):
+        gtLabelImageFile = groundTruthLabelImagFile.labelImageFile
+    else:
+        gtLabelImageFile = groundTruthLabelImagFile
+
+    recorder = StageRecorder('saveResultsTestList', groundTruthLabelImageFile=gtLabelImageFile,
+                             outputDir=outputDir, nTestFiles=nTest)
+
+    # every result is appended to the run manifest as soon as it is computed, so that an interrupted run
+    # can be resumed. With resume, pairs finished by an earlier run, whose files have not changed since, are not
+    # recomputed. Without it, the manifest starts over and every pair is computed
+    manifest = RunManifest(outputDir)
+    manifestOptions = resultsManifestOptions(saveDebugInfo=saveDebugInfo, tableFormat=tableFormat,
+                                             matching=matching, iouThreshold=iouThreshold, assignment=assignment,
+                                             tileGrid=tileGrid, fillHoles=fillHoles)
+    pairKeys = [RunManifest.pairKey(x, gtLabelImageFile, manifestOptions) for x in testLabelImageFiles]
+    if resume:
+        finishedEntries = manifest.load()
+    else:
+        manifest.clear()
+        finishedEntries = {}
+    pendingInds = [ind for ind, key in enumerate(pairKeys) if key not in finishedEntries]
+    recorder.count('pairsReused', nTest - len(pendingInds))
+
+    # onResult gets the index into testLabelImageFiles, also for the results reused from the manifest
+    if onResult is not None:
+        for ind, key in enumerate(pairKeys):
+            if key in finishedEntries:
+                onResult(ind, tuple(finishedEntries[key]['errors']))
+
+    # tile counts are kept in the manifest entries too, so that reused pairs have their tiles
+    pendingTileMetrics = {}
+
+    def keepTileMetrics(pendingInd, tileMetrics):
+        pendingTileMetrics[pendingInd] = tileMetrics
+
+    def appendToManifest(pendingInd, errors):
+        ind = pendingInds[pendingInd]
+        manifest.append(testLabelImageFiles[ind], gtLabelImageFile, manifestOptions, labels[ind], errors,
+                        tileCounts=pendingTileMetrics.pop(pendingInd, None))
+        if onResult is not None:
+            onResult(ind, errors)
+
+    if pendingInds:
+        segQualErrorsTestList([testLabelImageFiles[x] for x in pendingInds], groundTruthLabelImagFile,
+                              saveDebugInfoTo=saveDebugInfoTo, nWorkers=nWorkers, slabSize=slabSize,
+                              tableFormat=tableFormat, matching=matching, iouThreshold=iouThreshold,
+                              assignment=assignment, onResult=appendToManifest, shouldStop=shouldStop,
+                              tileGrid=tileGrid, onTileMetrics=keepTileMetrics, fillHoles=fillHoles)
+
+    # tables and plots are built from the manifest. After a stop, they contain the files finished until then
+    finishedEntries = manifest.load()
+    groundTruthLabelImagFile = gtLabelImageFile
+
+    records = []
+    for label, testLabelImageFile, pairKey in zip(labels, testLabelImageFiles, pairKeys):
+        if pairKey not in finishedEntries:
+            continue
+        nFP, nTP, nFN, nNoiseFP, nNonNoiseFP = finishedEntries[pairKey]['errors']
         recall, precision, fMeasure, accuracy = getMetricsFromCounts(nFP, nTP, nFN)
         testCellCount = nFP + nTP
         gtCellCount = nTP + nFN
@@ -182,56 +762,184 @@ def saveResultsTestList(testLabelImageFiles: typing.Iterable[str],
                     'groundTruthLabelImageFile': groundTruthLabelImagFile,
                     'label': label, 'testCellCount': testCellCount, 'groundTruthCellCount': gtCellCount,
                     'nFP': nFP, 'nTP': nTP, 'nFN': nFN, 'nNoiseFP': nNoiseFP, 'nNonNoiseFP': nNonNoiseFP}
-        resDF = resDF.append(tempDict, ignore_index=True)
-
-    fig0, ax0 = plt.subplots(figsize=(14, 11.2))
+        # bootstrap confidence intervals of the metrics, from the counts alone, unless nBootstrap is 0
+        if nBootstrap:
+            intervals = bootstrapMetricIntervals(nFP, nTP, nFN, nResamples=nBootstrap,
+                                                 confidenceLevel=confidenceLevel)
+            for metricName, (low, high) in intervals.items():
+                tempDict[metricName + 'CILow'] = low
+                tempDict[metricName + 'CIHigh'] = high
+        records.append(tempDict)
+    resDF = pd.DataFrame.from_records(records)
+
+    if not records:
+        recorder.emit()
+        return resDF
 
     tempDF = resDF.set_index(keys=['label'])
     tempDF = tempDF.sort_index()
-    tempDF.plot(ax=ax0, xticks=range(nTest), y=['Recall', 'Precision', 'fMeasure', 'Accuracy'],
-                marker='o', ms=10, lw=3, )
-
-    ax0.set_xticklabels(ax0.get_xticklabels(), rotation=90)
-
-    ax0.set_xlim(-0.5, nTest - 0.5)
-    fig0.tight_layout()
-    fig0.canvas.draw()
-    fig0.savefig(os.path.join(outputDir, 'metrics.png'), dpi=150)
-
-    fig1, ax1 = plt.subplots(figsize=(14, 11.2))
-    tempDF.plot(ax=ax1, xticks=range(nTest), y=['testCellCount'], marker='o', ms=10, lw=3, color='b')
-    ax1.plot(ax1.get_xlim(), [gtCellCount, gtCellCount], 'r:', lw=3, label='ground Truth')
-    ax1.legend(loc='best')
-    ax1.set_xlim(-0.5, nTest - 0.5)
-    ax1.set_xticklabels(ax0.get_xticklabels(), rotation=90)
-    fig1.tight_layout()
-    fig1.canvas.draw()
-    fig1.savefig(os.path.join(outputDir, 'cellCounts.png'), dpi=150)
-
-    tempDF.to_excel(os.path.join(outputDir, 'metrics.xlsx'))
-
-    for fig in [fig0, fig1]:
-        plt.close(fig.number)
-        del fig
+
+    # result tables of an earlier run into outputDir, e.g. in another format or with tiles, and their reports go
+    from nuclearSegQualityMetrics.reports import removeResultTable
+    for tableName in ('metrics', 'tileMetrics'):
+        removeResultTable(outputDir, tableName)
+
+    with recorder.stage('tableWriting'):
+        tableFiles = [writeTable(tempDF, os.path.join(outputDir, 'metrics'), tableFormat=tableFormat)]
+
+    # the tile metrics of all the pairs, from the tile counts in the manifest, in one table
+    if tileGrid is not None:
+        from nuclearSegQualityMetrics.resultsIO import tileMetricsDataFrame
+        with recorder.stage('tableWriting'):
+            tileDFs = []
+            for label, pairKey in zip(labels, pairKeys):
+                if pairKey not in finishedEntries:
+                    continue
+                tileDF = tileMetricsDataFrame(tileMetricsFromCounts(finishedEntries[pairKey]['tileCounts']))
+                tileDF.insert(0, 'label', label)
+                tileDFs.append(tileDF)
+            tableFiles.append(writeTable(pd.concat(tileDFs, ignore_index=True),
+                                         os.path.join(outputDir, 'tileMetrics'), tableFormat=tableFormat,
+                                         index=False))
+
+    # the debug info tables of the pairs, in the format of this run
+    if saveDebugInfo:
+        debugTableNames = ('gtData', 'testData') if tileGrid is None else ('gtData', 'testData', 'tileMetrics')
+        for testLabelImageFile in resDF['testLabelImageFile']:
+            debugInfoDir = os.path.join(outputDir, debugInfoDirName(testLabelImageFile, groundTruthLabelImagFile))
+            debugTableFiles = ['{}.{}'.format(os.path.join(debugInfoDir, x), tableFormat) for x in debugTableNames]
+            tableFiles.extend(x for x in debugTableFiles if os.path.isfile(x))
+
+    # resultsStore is the database file of a ResultsStore, which gets the run, its pairs and, with debug info,
+    # the classified nuclei
+    if resultsStore is not None:
+        from nuclearSegQualityMetrics.resultsStore import ResultsStore
+        if saveDebugInfo:
+            debugInfoDirs = {x: os.path.join(outputDir, debugInfoDirName(y, groundTruthLabelImagFile))
+                             for x, y in zip(resDF['label'], resDF['testLabelImageFile'])}
+        else:
+            debugInfoDirs = None
+        with recorder.stage('resultsStore'):
+            ResultsStore(resultsStore).addRun(resDF, groundTruthLabelImagFile, outputDir=outputDir,
+                                              options=manifestOptions, debugInfoDirs=debugInfoDirs)
+
+    with recorder.stage('reports'):
+        _runReports(outputDir, excelExport, reportMode, tableFiles)
+
+    recorder.emit()
+
     return resDF
 
-if __name__ == '__main__':
+def saveSweepResultsTestList(testLabelImageFiles: typing.Iterable[str],
+                             groundTruthLabelImagFile: typing.Union[str, GroundTruthFeatures], outputDir: str,
+                             labels: typing.Iterable[str], thresholds: typing.Iterable[float],
+                             matching: str = 'centroid', slabSize: typing.Union[None, int] = None,
+                             assignment: str = 'greedy', tableFormat: str = 'csv',
+                             reportMode: str = 'sync') -> 'pandas.DataFrame':
+    assert len(labels) == len(testLabelImageFiles), 'Number of elements in labels ' \
+                                                        'and testLabelImageFiles are not equal'
+    assert reportMode in reportModes, 'Unknown reportMode {}, must be one of {}'.format(reportMode, reportModes)
 
-    assert len(sys.argv) == 3, \
-        "Invalid Usage. Correct usage: \'python <testLabelImageFile> <groundTruthImageFile>\'"
+    import pandas as pd
+    from nuclearSegQualityMetrics.resultsIO import writeTable
 
-    testLabelImageFile = sys.argv[1]
-    gTLabelImageFile = sys.argv[2]
+    thresholds = np.asarray(thresholds, dtype=np.float64)
 
-    nFP, nTP, nFN, nNoiseFP, nNonNoiseFP = segQualErrors(testLabelImageFile=testLabelImageFile,
-                                                         groundTruthLabeImageFile=gTLabelImageFile)
+    if isinstance(groundTruthLabelImagFile, GroundTruthFeatures):
+        gtFeatures = groundTruthLabelImagFile
+    else:
+        gtFeatures = GroundTruthFeatures(groundTruthLabelImagFile, slabSize=slabSize)
+
+    recorder = StageRecorder('saveSweepResultsTestList', groundTruthLabelImageFile=gtFeatures.labelImageFile,
+                             outputDir=outputDir, nTestFiles=len(testLabelImageFiles), nThresholds=len(thresholds))
+
+    # one row per test file and threshold
+    sweepDFs = []
+    for label, testLabelImageFile in zip(labels, testLabelImageFiles):
+        errors = segQualErrorsSweep(testLabelImageFile, gtFeatures, thresholds, matching=matching,
+                                    slabSize=slabSize, assignment=assignment)
+        nFP, nTP, nFN, nNoiseFP, nNonNoiseFP = errors.T.astype(np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            recall, precision, fMeasure, accuracy = getMetricsFromCounts(nFP, nTP, nFN)
+        sweepDFs.append(pd.DataFrame({'label': label, 'testLabelImageFile': testLabelImageFile,
+                                      'groundTruthLabelImageFile': gtFeatures.labelImageFile,
+                                      'matching': matching, 'threshold': thresholds,
+                                      'Recall': recall, 'Precision': precision, 'fMeasure': fMeasure,
+                                      'Accuracy': accuracy,
+                                      'nFP': errors[:, 0], 'nTP': errors[:, 1], 'nFN': errors[:, 2],
+                                      'nNoiseFP': errors[:, 3], 'nNonNoiseFP': errors[:, 4]}))
+    sweepDF = pd.concat(sweepDFs, ignore_index=True)
+
+    from nuclearSegQualityMetrics.reports import removeResultTable
+    removeResultTable(outputDir, 'metricSweep')
+
+    with recorder.stage('tableWriting'):
+        sweepFile = writeTable(sweepDF, os.path.join(outputDir, 'metricSweep'), tableFormat=tableFormat, index=False)
+
+    with recorder.stage('reports'):
+        _runReports(outputDir, False, reportMode, [sweepFile])
+
+    recorder.emit()
+
+    return sweepDF
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Compute segmentation quality metrics of a test label image '
+                                                 'against a ground truth label image')
+    parser.add_argument('testLabelImageFile')
+    parser.add_argument('groundTruthImageFile')
+    parser.add_argument('--profile', default=None, help='write a cProfile dump to this file')
+    parser.add_argument('--instrumentationLog', default=None,
+                        help='append per-stage timing records to this JSON-lines file')
+    parser.add_argument('--matching', default='centroid', choices=matchingModes,
+                        help='match nuclei by centroid in equivalent sphere or one to one by voxel overlap')
+    parser.add_argument('--iouThreshold', default=0.5, type=float,
+                        help='minimum IoU of a match, with --matching overlap')
+    parser.add_argument('--assignment', default='greedy', choices=assignmentMethods,
+                        help='one to one assignment of overlapping nuclei, with --matching overlap')
+    parser.add_argument('--preview', default=None, metavar='Z,Y,X',
+                        help='approximate metrics quickly, from the stacks sampled with this stride')
+    parser.add_argument('--nPhases', default=2, type=int,
+                        help='number of sampling offsets with --preview, their spread estimates the error')
+    parser.add_argument('--tileGrid', default=None, metavar='Z,Y,X',
+                        help='also print recall and precision of the tiles of this grid, e.g. 8,1,1 for z slabs')
+    parser.add_argument('--noFillHoles', action='store_true',
+                        help='radii of gt nuclei from their voxel counts, without filling enclosed holes, faster')
+    args = parser.parse_args()
+
+    setDefaultFeatureCache(openFeatureCache())
+    if args.instrumentationLog is not None:
+        addInstrumentationHook(JSONLinesLog(args.instrumentationLog))
+
+    if args.preview is not None:
+        preview = runProfiled(args.profile, previewSegQualErrors, args.testLabelImageFile, args.groundTruthImageFile,
+                              stride=tuple(int(x) for x in args.preview.split(',')), nPhases=args.nPhases,
+                              matching=args.matching, iouThreshold=args.iouThreshold, assignment=args.assignment)
+        for metricName, value in preview['metrics'].items():
+            print('{}={:.4f} (spread over sampling offsets {:.4f})'.format(metricName, value,
+                                                                          preview['metricSpreads'][metricName]))
+        sys.exit(0)
+
+    tileGrid = None if args.tileGrid is None else tuple(int(x) for x in args.tileGrid.split(','))
+    if tileGrid is None:
+        errors = runProfiled(args.profile, segQualErrors, testLabelImageFile=args.testLabelImageFile,
+                             groundTruthLabeImageFile=args.groundTruthImageFile, matching=args.matching,
+                             iouThreshold=args.iouThreshold, assignment=args.assignment,
+                             fillHoles=not args.noFillHoles)
+    else:
+        errors, tileMetrics = runProfiled(args.profile, segQualErrorsTiles,
+                                          testLabelImageFile=args.testLabelImageFile,
+                                          groundTruthLabeImageFile=args.groundTruthImageFile, tileGrid=tileGrid,
+                                          matching=args.matching, iouThreshold=args.iouThreshold,
+                                          assignment=args.assignment, fillHoles=not args.noFillHoles)
+        for metricName in ('Recall', 'Precision'):
+            print('{} per tile, z by y by x:\n{}'.format(metricName, np.round(tileMetrics[metricName], 4)))
+    nFP, nTP, nFN, nNoiseFP, nNonNoiseFP = errors
     nTest = nFP + nTP
     nGT = nTP + nFN
 
     recall, precision, fMeasure, accuracy = getMetricsFromCounts(nFP, nTP, nFN)
     print('nFP={}\nnTP={}\nnFN={}\nnNoiseFP={}\nnNonNoiseFP={}'.format(nFP, nTP, nFN, nNoiseFP, nNonNoiseFP))
     print('Recall={}\nPrecision={}\nfMeasure={}\nAccuracy={}'.format(recall, precision, fMeasure, accuracy))
-
-
-
-
@@ -0,0 +1,186 @@
+import collections
+import os
+import threading
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from nuclearSegQualityMetrics.SegmentationQualityMetrics import GroundTruthFeatures, saveResultsTestList, \
+    reportModes
+from nuclearSegQualityMetrics.instrumentation import StageRecorder
+from nuclearSegQualityMetrics.labelStatistics import labelImageShapeDtype
+
+defaultJobOptions = {'nWorkers': 1, 'nGroupWorkers': 1, 'maxMemoryBytes': None, 'saveDebugInfo': True,
+                     'slabSize': None, 'tableFormat': 'csv', 'excelExport': False, 'reportMode': 'sync',
+                     'matching': 'centroid', 'iouThreshold': 0.5, 'assignment': 'greedy', 'resultsStore': None,
+                     'nBootstrap': 2000, 'confidenceLevel': 0.95, 'tileGrid': None, 'resume': False,
+                     'fillHoles': True}
+
+# options that are fixed for the whole job, the others can be overridden per group
+jobOnlyOptions = ('nGroupWorkers', 'maxMemoryBytes')
+
+
+def normalizeBatchJobSpec(spec: dict) -> dict:
+
+    for key in ('outputDir', 'groups'):
+        assert key in spec, 'Batch job spec has no {}'.format(key)
+
+    unknownOptions = set(spec.get('options', {})) - set(defaultJobOptions)
+    assert not unknownOptions, 'Unknown options {} in batch job spec'.format(sorted(unknownOptions))
+    jobOptions = dict(defaultJobOptions)
+    jobOptions.update(spec.get('options', {}))
+    assert jobOptions['reportMode'] in reportModes, \
+        'Unknown reportMode {}, must be one of {}'.format(jobOptions['reportMode'], reportModes)
+
+    groups = []
+    for ind, group in enumerate(spec['groups']):
+        for key in ('gtLabelImageFile', 'testLabelImageFiles', 'testImageFileLabels'):
+            assert key in group, 'Group {} of batch job spec has no {}'.format(ind, key)
+        assert len(group['testLabelImageFiles']) == len(group['testImageFileLabels']), \
+            'Number of testLabelImageFiles and testImageFileLabels of group {} are not equal'.format(ind)
+
+        groupOptions = {x: y for x, y in jobOptions.items() if x not in jobOnlyOptions}
+        unknownOptions = set(group.get('options', {})) - set(groupOptions)
+        assert not unknownOptions, 'Unknown options {} in group {} of batch job spec'.format(sorted(unknownOptions),
+                                                                                         ind)
+        groupOptions.update(group.get('options', {}))
+
+        name = group.get('name', 'group{}'.format(ind))
+        # relative group output folders are inside the output folder of the job
+        outputDir = os.path.join(spec['outputDir'], group.get('outputDir', name))
+
+        groups.append({'name': name, 'outputDir': outputDir, 'gtLabelImageFile': group['gtLabelImageFile'],
+                       'testLabelImageFiles': list(group['testLabelImageFiles']),
+                       'testImageFileLabels': list(group['testImageFileLabels']), 'options': groupOptions})
+
+    return {'outputDir': spec['outputDir'], 'options': jobOptions, 'groups': groups}
+
+
+def estimateGroupMemory(gtLabelImageFile: str, options: dict) -> int:
+
+    # a stack, or a slab of it, for the ground truth and one for the test image of each worker
+    shape, dtype = labelImageShapeDtype(gtLabelImageFile)
+    nPlanes = shape[0] if options['slabSize'] is None else min(options['slabSize'], shape[0])
+    stackBytes = nPlanes * int(np.prod(shape[1:])) * np.dtype(dtype).itemsize
+
+    return stackBytes * (1 + options['nWorkers'])
+
+
+def physicalMemoryBytes() -> typing.Union[None, int]:
+
+    # None where it can not be found out, e.g. on Windows
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def boundedWorkerCount(gtLabelImageFile: str, slabSize: typing.Union[None, int], maxWorkers: int,
+                       maxMemoryBytes: typing.Union[None, int]) -> int:
+
+    # the largest number of workers, up to maxWorkers, whose stacks fit in maxMemoryBytes, at least one
+    if maxMemoryBytes is None:
+        return max(1, maxWorkers)
+    stackBytes = estimateGroupMemory(gtLabelImageFile, {'slabSize': slabSize, 'nWorkers': 0})
+    return max(1, min(maxWorkers, maxMemoryBytes // stackBytes - 1))
+
+
+class MemoryBudget(object):
+
+    def __init__(self, maxBytes: typing.Union[None, int]):
+
+        self.maxBytes = maxBytes
+        self.usedBytes = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, nBytes: int):
+
+        # a job larger than the whole budget still runs, alone
+        with self.condition:
+            while self.maxBytes is not None and self.usedBytes > 0 and self.usedBytes + nBytes > self.maxBytes:
+                self.condition.wait()
+            self.usedBytes += nBytes
+
+    def release(self, nBytes: int):
+
+        with self.condition:
+            self.usedBytes -= nBytes
+            self.condition.notify_all()
+
+
+def _runGTGroups(groups: typing.List[dict], memoryBudget: MemoryBudget) -> typing.List[tuple]:
+
+    memoryBytes = max(estimateGroupMemory(x['gtLabelImageFile'], x['options']) for x in groups)
+    memoryBudget.acquire(memoryBytes)
+    try:
+        # the ground truth features stay in memory while all the groups using them are processed, all of them
+        # with the same slabSize and fillHoles
+        gtFeatures = GroundTruthFeatures(groups[0]['gtLabelImageFile'], slabSize=groups[0]['options']['slabSize'],
+                                         fillHoles=groups[0]['options']['fillHoles'])
+
+        results = []
+        for group in groups:
+            options = group['options']
+            os.makedirs(group['outputDir'], exist_ok=True)
+            resDF = saveResultsTestList(group['testLabelImageFiles'], gtFeatures, group['outputDir'],
+                                        group['testImageFileLabels'], saveDebugInfo=options['saveDebugInfo'],
+                                        nWorkers=options['nWorkers'], slabSize=options['slabSize'],
+                                        tableFormat=options['tableFormat'], excelExport=options['excelExport'],
+                                        reportMode=options['reportMode'], matching=options['matching'],
+                                        iouThreshold=options['iouThreshold'], assignment=options['assignment'],
+                                        resultsStore=options['resultsStore'], nBootstrap=options['nBootstrap'],
+                                        confidenceLevel=options['confidenceLevel'], tileGrid=options['tileGrid'],
+                                        resume=options['resume'], fillHoles=options['fillHoles'])
+            results.append((group, resDF))
+    finally:
+        memoryBudget.release(memoryBytes)
+
+    return results
+
+
+def runBatchJobSpec(spec: dict, reportMode: typing.Union[None, str] = None) -> 'pandas.DataFrame':
+
+    import pandas as pd
+    from nuclearSegQualityMetrics.resultsIO import writeTable
+
+    spec = normalizeBatchJobSpec(spec)
+    # reportMode, if given, applies to all groups
+    if reportMode is not None:
+        assert reportMode in reportModes, 'Unknown reportMode {}, must be one of {}'.format(reportMode, reportModes)
+        for group in spec['groups']:
+            group['options']['reportMode'] = reportMode
+    jobOptions = spec['options']
+    os.makedirs(spec['outputDir'], exist_ok=True)
+
+    # groups sharing a ground truth, a slabSize and fillHoles are processed together, one after the other. A group
+    # with another slabSize reads the ground truth again, so that its memory bound holds, and one with another
+    # fillHoles measures it again
+    gtGroups = collections.OrderedDict()
+    for group in spec['groups']:
+        gtKey = (os.path.abspath(group['gtLabelImageFile']), group['options']['slabSize'],
+                 group['options']['fillHoles'])
+        gtGroups.setdefault(gtKey, []).append(group)
+
+    recorder = StageRecorder('batchJob', outputDir=spec['outputDir'], nGroups=len(spec['groups']),
+                             nGroundTruths=len(gtGroups))
+
+    memoryBudget = MemoryBudget(jobOptions['maxMemoryBytes'])
+    with recorder.stage('groups'):
+        with ThreadPoolExecutor(max_workers=jobOptions['nGroupWorkers']) as executor:
+            gtResults = list(executor.map(lambda groups: _runGTGroups(groups, memoryBudget), gtGroups.values()))
+
+    groupDFs = []
+    for group, resDF in [x for results in gtResults for x in results]:
+        groupDF = resDF.copy()
+        groupDF.insert(0, 'group', group['name'])
+        groupDFs.append(groupDF)
+    summaryDF = pd.concat(groupDFs, ignore_index=True)
+
+    with recorder.stage('tableWriting'):
+        writeTable(summaryDF, os.path.join(spec['outputDir'], 'batchSummary'), tableFormat=jobOptions['tableFormat'],
+                   index=False)
+
+    recorder.emit()
+
+    return summaryDF
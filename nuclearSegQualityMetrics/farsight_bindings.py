@@ -2,14 +2,24 @@ import os
 import shutil
 import subprocess
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import numpy as np
-import seaborn as sns
-from matplotlib import pyplot as plt
-from SimpleITK import LabelShapeStatisticsImageFilter, ReadImage
-from nuclearSegQualityMetrics.matplotlibRCParams import mplPars
 
-sns.set(rc=mplPars, style='darkgrid')
+from nuclearSegQualityMetrics.featureCache import getDefaultFeatureCache
+from nuclearSegQualityMetrics.labelStatistics import labelImagePresentLabels
+from nuclearSegQualityMetrics.reports import setupPlotting
+
+
+def getSegmentNucleiBin(farSightBinDir):
+
+    for binName in ['segment_nuclei.exe', 'segment_nuclei']:
+        segment_nucleiBin = os.path.join(farSightBinDir, binName)
+        if os.path.isfile(segment_nucleiBin):
+            return segment_nucleiBin
+
+    raise(FileNotFoundError('segment_nuclei.exe not found in Farsight bin directory at {}'.format(farSightBinDir)))
 
 
 def runNucleiSegSingle(inputImageFile, outputDir, farSightBinDir, paramFile=None, verify_replace=True):
@@ -38,10 +48,7 @@ def runNucleiSegSingle(inputImageFile, outputDir, farSightBinDir, paramFile=None
 
     os.mkdir(imgOPDir)
 
-    segment_nucleiBin = os.path.join(farSightBinDir, 'segment_nuclei.exe')
-
-    assert os.path.isfile(segment_nucleiBin), 'segment_nuclei.exe not found in ' \
-                                              'Farsight bin directory at {}'.format(farSightBinDir)
+    segment_nucleiBin = getSegmentNucleiBin(farSightBinDir)
 
     opFile = os.path.join(imgOPDir, ipFileName)
     logFileName = os.path.join(imgOPDir, '{}Log.log'.format(ipFileNamePrefix))
@@ -49,7 +56,7 @@ def runNucleiSegSingle(inputImageFile, outputDir, farSightBinDir, paramFile=None
     toCall = [segment_nucleiBin, inputImageFile, opFile]
 
     if paramFile:
-        toCall += paramFile
+        toCall.append(paramFile)
 
     with open(logFileName, 'w') as logFile:
         try:
@@ -78,47 +85,101 @@ def runNucleiSegSingle(inputImageFile, outputDir, farSightBinDir, paramFile=None
         print('Finished: segment_nuclei on {} with default parameters.'.format(inputImageFile))
 
 
-def runNucleiSegFolder(dir, outputDir, farSightBinDir, fileSuffix = '.tif', paramFile=None, verify_replace=True):
+def nucleiSegOutputsExist(inputImageFile, outputDir):
+
+    ipFileName = os.path.split(inputImageFile)[1]
+    ipFileNamePrefix = ipFileName.split('.')[0]
+    imgOPDir = os.path.join(outputDir, ipFileNamePrefix)
+
+    return all(os.path.isfile(x) for x in [os.path.join(imgOPDir, ipFileName),
+                                           os.path.join(imgOPDir, '{}_seg_final.dat'.format(ipFileNamePrefix)),
+                                           os.path.join(imgOPDir, '{}_seedPoints.txt'.format(ipFileNamePrefix))])
+
+
+def runNucleiSegJob(inputImageFile, outputDir, segment_nucleiBin, paramFile=None, timeout=600, nRetries=0):
+
+    ipFilePath, ipFileName = os.path.split(inputImageFile)
+    ipFileNamePrefix = ipFileName.split('.')[0]
+    imgOPDir = os.path.join(outputDir, ipFileNamePrefix)
+    logFileName = os.path.join(imgOPDir, '{}Log.log'.format(ipFileNamePrefix))
+
+    jobStatus = {'inputImageFile': inputImageFile, 'outputDir': imgOPDir, 'logFile': logFileName,
+                 'status': None, 'attempts': 0, 'duration': 0.0, 'returncode': None}
+
+    if nucleiSegOutputsExist(inputImageFile, outputDir):
+        jobStatus['status'] = 'skipped'
+        return jobStatus
+
+    toCall = [segment_nucleiBin, inputImageFile, os.path.join(imgOPDir, ipFileName)]
+    if paramFile:
+        toCall.append(paramFile)
+
+    startTime = time.time()
+    for attempt in range(nRetries + 1):
+
+        jobStatus['attempts'] = attempt + 1
+
+        # leftovers of an earlier, incomplete run are removed
+        if os.path.exists(imgOPDir):
+            shutil.rmtree(imgOPDir)
+        os.mkdir(imgOPDir)
+
+        # the log file is written by the subprocess as it runs, so it can be followed while the job is running
+        with open(logFileName, 'w') as logFile:
+            try:
+                completed = subprocess.run(toCall, timeout=timeout, stdout=logFile, stderr=subprocess.STDOUT)
+                jobStatus['returncode'] = completed.returncode
+                jobStatus['status'] = 'done' if completed.returncode == 0 else 'failed'
+            except subprocess.TimeoutExpired:
+                jobStatus['status'] = 'timeout'
+
+        if jobStatus['status'] == 'done':
+            try:
+                for fileName in ['{}_seg_final.dat'.format(ipFileNamePrefix),
+                                 '{}_seedPoints.txt'.format(ipFileNamePrefix)]:
+                    shutil.move(os.path.join(ipFilePath, fileName), os.path.join(imgOPDir, fileName))
+                break
+            except (OSError, shutil.Error):
+                jobStatus['status'] = 'failed'
+
+    jobStatus['duration'] = time.time() - startTime
+    return jobStatus
+
+
+def runNucleiSegFolder(dir, outputDir, farSightBinDir, fileSuffix='.tif', paramFile=None,
+                       nJobs=1, timeout=600, nRetries=0, onJobFinished=None):
 
     assert os.path.isdir(dir), 'Input Directory {} not found'.format(dir)
     assert os.path.isdir(farSightBinDir), 'Farsight Bin directory {} not found'.format(farSightBinDir)
     assert os.path.isdir(outputDir), 'Output Directory {} not found'.format(outputDir)
+    assert nJobs >= 1, 'nJobs must be at least 1, got {}'.format(nJobs)
 
     if paramFile is not None:
         assert os.path.isfile(paramFile), 'Param File {} not found'.format(paramFile)
 
-    inputFileNames = [x for x in os.listdir(dir) if x.endswith(fileSuffix)]
+    segment_nucleiBin = getSegmentNucleiBin(farSightBinDir)
+
+    inputFileNames = sorted(x for x in os.listdir(dir) if x.endswith(fileSuffix))
 
     if not inputFileNames:
         raise(FileNotFoundError('No files with suffix {} found in {}'.format(fileSuffix, dir)))
 
-    existantImgOPDirs = []
-    for ipFN in inputFileNames:
-        ipP, ipS = ipFN.split('.')
-        imgOutputDir = os.path.join(outputDir, ipP)
-        if os.path.isdir(imgOutputDir):
-            existantImgOPDirs.append(imgOutputDir)
-
-    if not existantImgOPDirs:
-        if verify_replace:
-
-            ch = input('The following results already exist\n{}\nReplace them?(y/n):'.format(existantImgOPDirs))
-            if ch == 'y':
-                [shutil.rmtree(x) for x in existantImgOPDirs]
-            else:
-                sys.exit(1)
+    # segment_nuclei does the work in its own process, so threads are enough to run several at once
+    jobStatuses = []
+    with ThreadPoolExecutor(max_workers=nJobs) as executor:
+        futures = [executor.submit(runNucleiSegJob, os.path.join(dir, ipFN), outputDir, segment_nucleiBin,
+                                   paramFile=paramFile, timeout=timeout, nRetries=nRetries)
+                   for ipFN in inputFileNames]
 
-        else:
-            [shutil.rmtree(x) for x in existantImgOPDirs]
+        for future in as_completed(futures):
+            jobStatus = future.result()
+            jobStatuses.append(jobStatus)
+            print('{status}: segment_nuclei on {inputImageFile} after {attempts} attempt(s), '
+                  '{duration:.1f}s. Log: {logFile}'.format(**jobStatus))
+            if onJobFinished is not None:
+                onJobFinished(jobStatus)
 
-    for ipFN in inputFileNames:
-        ipP, ipS = ipFN.split('.')
-        inImageFile = os.path.join(dir, ipFN)
-        runNucleiSegSingle(inputImageFile=inImageFile,
-                           outputDir=outputDir,
-                           farSightBinDir=farSightBinDir,
-                           paramFile=paramFile,
-                           verify_replace=False)
+    return sorted(jobStatuses, key=lambda x: x['inputImageFile'])
 
 
 def readNucleiSegCountSingle(imgOutputDir):
@@ -130,33 +191,48 @@ def readNucleiSegCountSingle(imgOutputDir):
     labelImgFN = os.path.join(imgOutputDir, imgPrefix + '.tif')
 
     assert os.path.isfile(labelImgFN), 'Label image {} not found'.format(labelImgFN)
-    labelImg = ReadImage(labelImgFN)
 
-    lsif = LabelShapeStatisticsImageFilter()
-    lsif.Execute(labelImg)
+    featureCache = getDefaultFeatureCache()
+    if featureCache is not None:
+        cached = featureCache.get(labelImgFN, kind='labelCount')
+        if cached is not None:
+            return int(cached['count'])
 
-    return lsif.GetNumberOfLabels()
+    # only the set of labels present is needed, no shape features
+    cellCount = len(labelImagePresentLabels(labelImgFN))
 
-def readNucleiSegCountDir(outputDir):
+    if featureCache is not None:
+        featureCache.put(labelImgFN, {'count': np.array(cellCount)}, kind='labelCount')
+
+    return cellCount
+
+
+def readNucleiSegCountDir(outputDir, nWorkers=8):
 
     assert os.path.isdir(outputDir), 'Output Directory {} not found'.format(outputDir)
 
-    cellCounts = {}
+    imgOPDirNames = []
     for imgOPDirName in os.listdir(outputDir):
 
         imgOPDir = os.path.join(outputDir, imgOPDirName)
         if os.path.isdir(imgOPDir):
             imgFullPath = os.path.join(imgOPDir, imgOPDirName + '.tif')
             if os.path.isfile(imgFullPath):
-                cellCount = readNucleiSegCountSingle(imgOPDir)
-                cellCounts[imgOPDirName] = cellCount
+                imgOPDirNames.append(imgOPDirName)
 
-    return cellCounts
+    # reading is mostly I/O and decoding, which threads overlap well
+    with ThreadPoolExecutor(max_workers=nWorkers) as executor:
+        cellCounts = list(executor.map(readNucleiSegCountSingle,
+                                       [os.path.join(outputDir, x) for x in imgOPDirNames]))
+
+    return dict(zip(imgOPDirNames, cellCounts))
 
 def plotCellCounts(outputDir):
 
     assert os.path.isdir(outputDir), 'Output Directory {} not found'.format(outputDir)
 
+    plt = setupPlotting()
+
     cellCounts = readNucleiSegCountDir(outputDir)
     fig, ax = plt.subplots(figsize=(10, 8))
     ax.bar(np.arange(len(cellCounts)), cellCounts.values())
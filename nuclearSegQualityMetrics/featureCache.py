@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import tempfile
+import typing
+import zipfile
+
+import numpy as np
+
+from nuclearSegQualityMetrics.folderDefs import getAppDataHome
+
+# bump when the content of cache entries changes, so that old entries are not used anymore
+cacheFormatVersion = 3
+
+
+def getFileContentHash(filePath: str, blockSize: int = 2 ** 20) -> str:
+
+    sha1 = hashlib.sha1()
+    with open(filePath, 'rb') as fle:
+        for block in iter(lambda: fle.read(blockSize), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def getFileIdentity(filePath: str, useContentHash: bool = False) -> dict:
+
+    fileStat = os.stat(filePath)
+    identity = {'path': os.path.abspath(filePath), 'size': fileStat.st_size, 'mtime': fileStat.st_mtime_ns}
+    if useContentHash:
+        identity['sha1'] = getFileContentHash(filePath)
+    return identity
+
+
+class FeatureCache(object):
+
+    def __init__(self, cacheDir: typing.Union[None, str] = None, maxSizeBytes: int = 2 * 2 ** 30,
+                 useContentHash: bool = False):
+
+        if cacheDir is None:
+            cacheDir = os.path.join(getAppDataHome(), 'featureCache')
+
+        self.cacheDir = cacheDir
+        self.maxSizeBytes = maxSizeBytes
+        self.useContentHash = useContentHash
+
+        os.makedirs(self.cacheDir, exist_ok=True)
+
+    def fileIdentity(self, filePath: str) -> dict:
+
+        return getFileIdentity(filePath, useContentHash=self.useContentHash)
+
+    def _entryFile(self, filePath: str, kind: str) -> str:
+
+        key = json.dumps([cacheFormatVersion, kind, self.fileIdentity(filePath)], sort_keys=True)
+        return os.path.join(self.cacheDir, '{}_{}.npz'.format(kind, hashlib.sha1(key.encode()).hexdigest()))
+
+    def get(self, filePath: str, kind: str = 'features') -> typing.Union[None, dict]:
+
+        entryFile = self._entryFile(filePath, kind)
+
+        # a missing or unreadable entry, e.g. truncated by a full disk or a killed process on a shared cache, is a
+        # miss, and is written again by put
+        try:
+            with np.load(entryFile) as entry:
+                arrays = {name: entry[name] for name in entry.files}
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            return None
+
+        # the modification time of an entry is its last use, which eviction goes by. Another process may have
+        # evicted the entry meanwhile, which is a miss
+        try:
+            os.utime(entryFile)
+        except FileNotFoundError:
+            return None
+        return arrays
+
+    def put(self, filePath: str, arrays: dict, kind: str = 'features'):
+
+        entryFile = self._entryFile(filePath, kind)
+
+        # written to a temporary file first, so that concurrent readers never see a partial entry
+        fd, tempFile = tempfile.mkstemp(dir=self.cacheDir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fle:
+                np.savez(fle, **arrays)
+            os.replace(tempFile, entryFile)
+        except BaseException:
+            os.remove(tempFile)
+            raise
+
+        self.evict()
+
+    def evict(self):
+
+        entries = []
+        for dirEntry in os.scandir(self.cacheDir):
+            if dirEntry.name.endswith('.npz'):
+                # entries may be evicted by another process while they are listed
+                try:
+                    entryStat = dirEntry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((entryStat.st_mtime, entryStat.st_size, dirEntry.path))
+
+        totalSize = sum(x[1] for x in entries)
+
+        # least recently used first
+        for mtime, size, entryFile in sorted(entries):
+            if totalSize <= self.maxSizeBytes:
+                break
+            try:
+                os.remove(entryFile)
+            except FileNotFoundError:
+                pass
+            totalSize -= size
+
+    def clear(self):
+
+        for dirEntry in os.scandir(self.cacheDir):
+            if dirEntry.name.endswith('.npz'):
+                try:
+                    os.remove(dirEntry.path)
+                except FileNotFoundError:
+                    pass
+
+
+_defaultFeatureCache = None
+
+
+def setDefaultFeatureCache(featureCache: typing.Union[None, FeatureCache]):
+
+    global _defaultFeatureCache
+    _defaultFeatureCache = featureCache
+
+
+def getDefaultFeatureCache() -> typing.Union[None, FeatureCache]:
+
+    return _defaultFeatureCache
+
+
+def openFeatureCache(cacheDir: typing.Union[None, str] = None) -> typing.Union[None, FeatureCache]:
+
+    # without a cacheDir, the cache is in the app data folder, which is only defined on Windows and Linux.
+    # Elsewhere, or if the folder can not be created, metrics are computed without a cache
+    try:
+        return FeatureCache(cacheDir)
+    except OSError as error:
+        print('Running without a feature cache: {}'.format(error))
+        return None
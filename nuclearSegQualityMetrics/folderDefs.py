@@ -1,5 +1,22 @@
+import os
+import platform
+
 import nuclearSegQualityMetrics
 import pathlib
 
 baseLibPath = pathlib.Path(nuclearSegQualityMetrics.__path__[0]).parent
-testFilesPath = baseLibPath / "tests" / "files"
\ No newline at end of file
+testFilesPath = baseLibPath / "tests" / "files"
+
+
+def getAppDataHome():
+
+    system = platform.system()
+    userHome = os.path.expanduser('~')
+
+    if system == 'Windows':
+        return os.path.join(userHome, 'AppData', 'Local', 'TanimotoLabCellSeg')
+    elif system == 'Linux':
+        return os.path.join(userHome, '.TanimotoLabCellSeg')
+    else:
+        raise(OSError('Unsupported operating system {}. '
+                      'We currently support only Windows and Linux.'.format(system)))
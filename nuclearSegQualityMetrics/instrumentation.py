@@ -0,0 +1,108 @@
+import contextlib
+import cProfile
+import json
+import os
+import threading
+import time
+import typing
+
+
+class StageRecorder(object):
+
+    def __init__(self, kind: str, **fields):
+
+        self.kind = kind
+        self.fields = fields
+        self.stages = {}
+        self.counters = {}
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+
+        startTime = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - startTime
+
+    def count(self, name: str, value: int):
+
+        self.counters[name] = self.counters.get(name, 0) + int(value)
+
+    def asRecord(self) -> dict:
+
+        record = {'kind': self.kind, 'pid': os.getpid(), 'timestamp': time.time(),
+                  'stages': dict(self.stages), 'counters': dict(self.counters)}
+        record.update(self.fields)
+        return record
+
+    def emit(self):
+
+        emitRecord(self.asRecord())
+
+
+_hooks = []
+
+
+def addInstrumentationHook(hook: typing.Callable[[dict], None]):
+
+    _hooks.append(hook)
+
+
+def removeInstrumentationHook(hook: typing.Callable[[dict], None]):
+
+    _hooks.remove(hook)
+
+
+def clearInstrumentationHooks():
+
+    del _hooks[:]
+
+
+def emitRecord(record: dict):
+
+    for hook in list(_hooks):
+        hook(record)
+
+
+@contextlib.contextmanager
+def collectedRecords():
+
+    # records emitted inside the block are collected instead of being passed to the registered hooks,
+    # e.g. in worker processes, which hand them back to the parent process
+    global _hooks
+    records = []
+    previousHooks = _hooks
+    _hooks = [records.append]
+    try:
+        yield records
+    finally:
+        _hooks = previousHooks
+
+
+class JSONLinesLog(object):
+
+    def __init__(self, logFile: str):
+
+        self.logFile = logFile
+        self.lock = threading.Lock()
+
+    def __call__(self, record: dict):
+
+        with self.lock:
+            with open(self.logFile, 'a') as fle:
+                fle.write(json.dumps(record) + '\n')
+
+
+def runProfiled(profileFile: typing.Union[None, str], func: typing.Callable, *args, **kwargs):
+
+    if profileFile is None:
+        return func(*args, **kwargs)
+
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profile.disable()
+        profile.dump_stats(profileFile)
@@ -0,0 +1,349 @@
+import collections
+import os
+import typing
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import tifffile
+from scipy import ndimage
+
+
+class LabelStats(object):
+
+    # one row per label in each of the arrays
+    __slots__ = ('labels', 'centroids', 'radii', 'volumes', 'bboxes')
+
+    def __init__(self, labels: np.ndarray, centroids: np.ndarray, radii: np.ndarray, volumes: np.ndarray,
+                 bboxes: np.ndarray):
+
+        # arrays that already have the right type and layout, including memory maps, are not copied
+        self.labels = np.ascontiguousarray(labels, dtype=np.int64)
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float64).reshape(-1, 3)
+        self.radii = np.ascontiguousarray(radii, dtype=np.float64)
+        self.volumes = np.ascontiguousarray(volumes, dtype=np.int64)
+        self.bboxes = np.ascontiguousarray(bboxes, dtype=np.int64).reshape(-1, 6)
+
+        for name in self.__slots__[1:]:
+            assert len(getattr(self, name)) == len(self.labels), \
+                'LabelStats {} has {} rows, labels has {}'.format(name, len(getattr(self, name)), len(self.labels))
+
+    def __len__(self) -> int:
+
+        return len(self.labels)
+
+    def __getitem__(self, index) -> 'LabelStats':
+
+        # slices give views, index arrays and masks copies
+        return LabelStats(*[getattr(self, name)[index] for name in self.__slots__])
+
+    def splitBy(self, classification: np.ndarray) -> 'collections.OrderedDict':
+
+        # the arrays are copied once, sorted by classification. Each class is then a contiguous slice, i.e. a view,
+        # of the sorted copy, bounded by searchsorted on the sorted classification
+        classification = np.asarray(classification)
+        order = np.argsort(classification, kind='mergesort')
+        sortedStats = self[order]
+        sortedClassification = classification[order]
+        classes = np.unique(sortedClassification)
+        starts = np.searchsorted(sortedClassification, classes, side='left')
+        stops = np.searchsorted(sortedClassification, classes, side='right')
+
+        return collections.OrderedDict((x, sortedStats[start: stop]) for x, start, stop in zip(classes, starts, stops))
+
+    def toArrays(self) -> dict:
+
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def fromArrays(cls, arrays: dict) -> 'LabelStats':
+
+        return cls(*[arrays[name] for name in cls.__slots__])
+
+    def save(self, outputDir: str):
+
+        for name in self.__slots__:
+            np.save(os.path.join(outputDir, '{}.npy'.format(name)), getattr(self, name))
+
+    @classmethod
+    def load(cls, inputDir: str, mmapMode: typing.Union[None, str] = None) -> 'LabelStats':
+
+        return cls(*[np.load(os.path.join(inputDir, '{}.npy'.format(name)), mmap_mode=mmapMode)
+                     for name in cls.__slots__])
+
+
+def _planeCoordinateGrids(planeShape: tuple) -> tuple:
+
+    yGrid, xGrid = np.indices(planeShape, dtype=np.float64)
+
+    return yGrid.ravel(), xGrid.ravel()
+
+
+def labelVoxelCountsCoordinateSums(labelImage: np.ndarray, zOffset: int = 0, maxLabel: int = None) -> tuple:
+
+    assert labelImage.ndim == 3, 'labelImage is not 3D'
+
+    if maxLabel is None:
+        maxLabel = int(labelImage.max()) if labelImage.size else 0
+
+    nBins = maxLabel + 1
+    counts = np.zeros(nBins, dtype=np.int64)
+    coordinateSums = np.zeros((nBins, 3), dtype=np.float64)
+    yGrid, xGrid = _planeCoordinateGrids(labelImage.shape[1:])
+
+    # one plane at a time, so that the weight arrays needed by bincount stay the size of a single plane. The labels
+    # of a plane are cast to the index type of bincount once, and not by each of the three bincounts
+    for planeInd, plane in enumerate(labelImage):
+        planeFlat = plane.ravel().astype(np.intp)
+        planeCounts = np.bincount(planeFlat, minlength=nBins)
+        counts += planeCounts
+        coordinateSums[:, 0] += (planeInd + zOffset) * planeCounts
+        coordinateSums[:, 1] += np.bincount(planeFlat, weights=yGrid, minlength=nBins)
+        coordinateSums[:, 2] += np.bincount(planeFlat, weights=xGrid, minlength=nBins)
+
+    return counts, coordinateSums
+
+
+def labelBoundingBoxes(labelImage: np.ndarray, labels: np.ndarray, zOffset: int = 0) -> np.ndarray:
+
+    maxLabel = int(labels.max()) if labels.size else 0
+    objectSlices = ndimage.find_objects(labelImage, max_label=maxLabel)
+
+    # same layout as regionprops' bbox: (min_z, min_y, min_x, max_z, max_y, max_x), max exclusive
+    bboxes = np.array([[s.start for s in objectSlices[x - 1]] + [s.stop for s in objectSlices[x - 1]]
+                       for x in labels], dtype=np.int64).reshape(-1, 6)
+    bboxes[:, [0, 3]] += zOffset
+
+    return bboxes
+
+
+def labelFilledVolumes(labelImage: np.ndarray, labels: np.ndarray, bboxes: np.ndarray) -> np.ndarray:
+
+    filledVolumes = np.empty(len(labels), dtype=np.int64)
+
+    for ind, (label, bbox) in enumerate(zip(labels, bboxes)):
+        bboxSlice = tuple(slice(start, stop) for start, stop in zip(bbox[:3], bbox[3:]))
+        labelMask = labelImage[bboxSlice] == label
+        filledVolumes[ind] = ndimage.binary_fill_holes(labelMask).sum()
+
+    return filledVolumes
+
+
+def labelStatistics(labelImage: np.ndarray, computeFilledVolumes: bool = False) -> tuple:
+
+    counts, coordinateSums = labelVoxelCountsCoordinateSums(labelImage)
+
+    labels = np.flatnonzero(counts)
+    labels = labels[labels > 0]
+
+    voxelCounts = counts[labels]
+    centroids = coordinateSums[labels] / voxelCounts[:, np.newaxis]
+    bboxes = labelBoundingBoxes(labelImage, labels)
+
+    if computeFilledVolumes:
+        filledVolumes = labelFilledVolumes(labelImage, labels, bboxes)
+    else:
+        filledVolumes = None
+
+    return labels, voxelCounts, centroids, bboxes, filledVolumes
+
+
+def labelImageShapeDtype(labelImageFile: str) -> tuple:
+
+    with tifffile.TiffFile(labelImageFile) as tif:
+        page = tif.pages[0]
+        nPages = len(tif.pages)
+        if nPages == 1 and len(page.shape) == 3:
+            return tuple(page.shape), page.dtype
+        return (nPages,) + tuple(page.shape), page.dtype
+
+
+def readLabelImageSlab(labelImageFile: str, zStart: int, zStop: int) -> np.ndarray:
+
+    # uncompressed, contiguous stacks are memory mapped, everything else is decoded page by page
+    try:
+        return np.array(tifffile.memmap(labelImageFile, mode='r')[zStart: zStop])
+    except ValueError:
+        with tifffile.TiffFile(labelImageFile) as tif:
+            # a 3D stack in a single page, e.g. a compressed volumetric one, can only be decoded whole
+            if len(tif.pages) > 1:
+                slab = tif.asarray(key=range(zStart, zStop))
+            else:
+                slab = tif.asarray()[zStart: zStop]
+        return slab.reshape((zStop - zStart,) + slab.shape[-2:])
+
+
+def labelImageSlabReader(labelImageFile: str, slabSize: int) -> typing.Callable[[int, int], np.ndarray]:
+
+    # memory mapped and multi-page stacks are read slab by slab. A single page holding the whole stack, e.g. a
+    # compressed volumetric one, would be decoded whole for every slab, so it is decoded once here instead, and peak
+    # memory is not bounded by the slab size
+    try:
+        tifffile.memmap(labelImageFile, mode='r')
+        slabReadable = True
+    except ValueError:
+        with tifffile.TiffFile(labelImageFile) as tif:
+            slabReadable = len(tif.pages) > 1
+    if slabReadable:
+        return lambda zStart, zStop: readLabelImageSlab(labelImageFile, zStart, zStop)
+
+    shape, dtype = labelImageShapeDtype(labelImageFile)
+    if slabSize < shape[0]:
+        warnings.warn('{} is a single page that can not be read slab by slab, it is read whole instead, '
+                      'save it with a page per plane to bound memory by the slab size'.format(labelImageFile))
+    labelImage = tifffile.imread(labelImageFile).reshape(shape)
+
+    return lambda zStart, zStop: labelImage[zStart: zStop]
+
+
+def readLabelImageStrided(labelImageFile: str, stride: tuple, offset: tuple = (0, 0, 0)) -> np.ndarray:
+
+    shape, dtype = labelImageShapeDtype(labelImageFile)
+    zInds = list(range(offset[0], shape[0], stride[0]))
+    planeSlice = (slice(offset[1], None, stride[1]), slice(offset[2], None, stride[2]))
+
+    # only the planes sampled along z are read
+    try:
+        planes = tifffile.memmap(labelImageFile, mode='r')[zInds]
+    except ValueError:
+        with tifffile.TiffFile(labelImageFile) as tif:
+            planes = tif.asarray(key=zInds) if len(tif.pages) > 1 else tif.asarray()[zInds]
+        planes = planes.reshape((len(zInds),) + tuple(shape[1:]))
+
+    return np.ascontiguousarray(planes[(slice(None),) + planeSlice])
+
+
+def labelImagePresentLabels(labelImageFile: str, slabSize: int = 32) -> np.ndarray:
+
+    shape, dtype = labelImageShapeDtype(labelImageFile)
+    readSlab = labelImageSlabReader(labelImageFile, slabSize)
+
+    # one streaming pass, slab by slab, that only marks which labels occur
+    if np.dtype(dtype).itemsize <= 2:
+        present = np.zeros(np.iinfo(dtype).max + 1, dtype=bool)
+        for zStart in range(0, shape[0], slabSize):
+            slab = readSlab(zStart, min(zStart + slabSize, shape[0]))
+            slabCounts = np.bincount(slab.ravel())
+            present[:len(slabCounts)] |= slabCounts > 0
+        presentLabels = np.flatnonzero(present)
+    else:
+        presentLabels = np.zeros(0, dtype=dtype)
+        for zStart in range(0, shape[0], slabSize):
+            slab = readSlab(zStart, min(zStart + slabSize, shape[0]))
+            presentLabels = np.union1d(presentLabels, np.unique(slab))
+
+    return presentLabels[presentLabels > 0]
+
+
+def _slabPartialSums(readSlab: typing.Callable[[int, int], np.ndarray], zStart: int, zStop: int) -> tuple:
+
+    slab = readSlab(zStart, zStop)
+    counts, coordinateSums = labelVoxelCountsCoordinateSums(slab, zOffset=zStart)
+
+    slabLabels = np.flatnonzero(counts)
+    slabLabels = slabLabels[slabLabels > 0]
+    bboxes = labelBoundingBoxes(slab, slabLabels, zOffset=zStart)
+
+    return counts, coordinateSums, slabLabels, bboxes
+
+
+def _labelBoxMask(readSlab: typing.Callable[[int, int], np.ndarray], label: int, bbox: np.ndarray,
+                  slabSize: int) -> np.ndarray:
+
+    # the mask of a label within its bounding box, read slab by slab and cropped to the box in y and x
+    zStart, yStart, xStart, zStop, yStop, xStop = (int(x) for x in bbox)
+    labelMask = np.empty((zStop - zStart, yStop - yStart, xStop - xStart), dtype=bool)
+    for slabStart in range(zStart, zStop, slabSize):
+        slab = readSlab(slabStart, min(slabStart + slabSize, zStop))
+        labelMask[slabStart - zStart: slabStart - zStart + len(slab)] = slab[:, yStart: yStop, xStart: xStop] == label
+
+    return labelMask
+
+
+def _slabFilledVolumes(readSlab: typing.Callable[[int, int], np.ndarray], zStart: int, slabSize: int,
+                       labels: np.ndarray, bboxes: np.ndarray) -> np.ndarray:
+
+    # the labels starting in a slab and ending within the next one are filled from the planes of their bounding
+    # boxes, read as one slab of at most twice the slab size. Taller labels are filled one by one from the masks of
+    # their bounding boxes, so that a single tall label does not pull most of the stack into memory
+    filledVolumes = np.empty(len(labels), dtype=np.int64)
+
+    shortMask = bboxes[:, 3] <= zStart + 2 * slabSize
+    if shortMask.any():
+        shortBboxes = bboxes[shortMask].copy()
+        shortBboxes[:, [0, 3]] -= zStart
+        slab = readSlab(zStart, zStart + int(shortBboxes[:, 3].max()))
+        filledVolumes[shortMask] = labelFilledVolumes(slab, labels[shortMask], shortBboxes)
+
+    for ind in np.flatnonzero(~shortMask):
+        labelMask = _labelBoxMask(readSlab, labels[ind], bboxes[ind], slabSize)
+        filledVolumes[ind] = ndimage.binary_fill_holes(labelMask).sum()
+
+    return filledVolumes
+
+
+def _padToLength(array: np.ndarray, length: int, fillValue=0) -> np.ndarray:
+
+    if len(array) >= length:
+        return array
+    padded = np.full((length,) + array.shape[1:], fillValue, dtype=array.dtype)
+    padded[:len(array)] = array
+    return padded
+
+
+def labelStatisticsChunked(labelImageFile: str, slabSize: int = 32, nWorkers: int = 1,
+                           computeFilledVolumes: bool = False) -> tuple:
+
+    assert slabSize >= 1, 'slabSize must be at least 1, got {}'.format(slabSize)
+    assert nWorkers >= 1, 'nWorkers must be at least 1, got {}'.format(nWorkers)
+
+    shape, dtype = labelImageShapeDtype(labelImageFile)
+    assert len(shape) == 3, 'Label image {} is not 3D'.format(labelImageFile)
+
+    slabBounds = [(zStart, min(zStart + slabSize, shape[0])) for zStart in range(0, shape[0], slabSize)]
+    readSlab = labelImageSlabReader(labelImageFile, slabSize)
+
+    counts = np.zeros(1, dtype=np.int64)
+    coordinateSums = np.zeros((1, 3), dtype=np.float64)
+    bboxMins = np.full((1, 3), np.iinfo(np.int64).max, dtype=np.int64)
+    bboxMaxs = np.zeros((1, 3), dtype=np.int64)
+
+    with ThreadPoolExecutor(max_workers=nWorkers) as executor:
+        partialSums = executor.map(lambda bounds: _slabPartialSums(readSlab, *bounds), slabBounds)
+
+        # partial sums of labels spanning several slabs are simply added up, their bounding boxes united
+        for slabCounts, slabCoordinateSums, slabLabels, slabBboxes in partialSums:
+            nBins = max(len(counts), len(slabCounts))
+            counts = _padToLength(counts, nBins)
+            coordinateSums = _padToLength(coordinateSums, nBins)
+            bboxMins = _padToLength(bboxMins, nBins, np.iinfo(np.int64).max)
+            bboxMaxs = _padToLength(bboxMaxs, nBins)
+
+            counts[:len(slabCounts)] += slabCounts
+            coordinateSums[:len(slabCounts)] += slabCoordinateSums
+            bboxMins[slabLabels] = np.minimum(bboxMins[slabLabels], slabBboxes[:, :3])
+            bboxMaxs[slabLabels] = np.maximum(bboxMaxs[slabLabels], slabBboxes[:, 3:])
+
+    labels = np.flatnonzero(counts)
+    labels = labels[labels > 0]
+
+    voxelCounts = counts[labels]
+    centroids = coordinateSums[labels] / voxelCounts[:, np.newaxis]
+    bboxes = np.concatenate([bboxMins[labels], bboxMaxs[labels]], axis=1)
+
+    # holes are filled label by label, from slabs read like the ones above, so that compressed stacks work the same
+    # and memory stays bounded, see _slabFilledVolumes
+    if computeFilledVolumes:
+        filledVolumes = np.zeros(len(labels), dtype=np.int64)
+        slabInds = [np.flatnonzero((bboxes[:, 0] >= zStart) & (bboxes[:, 0] < zStop)) for zStart, zStop in slabBounds]
+        slabTasks = [(zStart, inds) for (zStart, zStop), inds in zip(slabBounds, slabInds) if len(inds)]
+        with ThreadPoolExecutor(max_workers=nWorkers) as executor:
+            slabFilledVolumes = executor.map(
+                lambda task: _slabFilledVolumes(readSlab, task[0], slabSize, labels[task[1]], bboxes[task[1]]),
+                slabTasks)
+            for (zStart, inds), volumes in zip(slabTasks, slabFilledVolumes):
+                filledVolumes[inds] = volumes
+    else:
+        filledVolumes = None
+
+    return labels, voxelCounts, centroids, bboxes, filledVolumes
@@ -0,0 +1,217 @@
+import typing
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from nuclearSegQualityMetrics.labelStatistics import labelImageShapeDtype, labelImageSlabReader
+
+assignmentMethods = ('greedy', 'hungarian')
+
+
+def labelPairCounts(gtLabelImage: np.ndarray, testLabelImage: np.ndarray, nTestBins: int) -> tuple:
+
+    # each voxel gets the key gtLabel * nTestBins + testLabel, so that the non zero entries of the
+    # gt x test contingency table come out of a single np.unique over the keys
+    keys = gtLabelImage.astype(np.uint64).ravel() * np.uint64(nTestBins) + testLabelImage.astype(np.uint64).ravel()
+    pairKeys, pairCounts = np.unique(keys, return_counts=True)
+
+    return pairKeys // np.uint64(nTestBins), pairKeys % np.uint64(nTestBins), pairCounts
+
+
+def _maxLabel(labelImageFile: str, dtype: np.dtype, readSlab: typing.Callable[[int, int], np.ndarray], nPlanes: int,
+              slabSize: int) -> int:
+
+    # unsigned labels of at most 32 bits are bounded by their type. Others, signed or 64 bit, are bounded by the
+    # labels actually present, found in a pass over the slabs, and must not be negative
+    dtype = np.dtype(dtype)
+    assert dtype.kind in 'ui', 'Label image {} is not of an integer type, got {}'.format(labelImageFile, dtype)
+    if dtype.kind == 'u' and dtype.itemsize <= 4:
+        return int(np.iinfo(dtype).max)
+
+    minLabel, maxLabel = 0, 0
+    for zStart in range(0, nPlanes, slabSize):
+        slab = readSlab(zStart, min(zStart + slabSize, nPlanes))
+        if slab.size:
+            minLabel, maxLabel = min(minLabel, int(slab.min())), max(maxLabel, int(slab.max()))
+    assert minLabel >= 0, 'Label image {} has negative labels, e.g. {}'.format(labelImageFile, minLabel)
+
+    return maxLabel
+
+
+def labelContingencyTable(gtLabelImageFile: str, testLabelImageFile: str,
+                          slabSize: typing.Union[None, int] = None) -> tuple:
+
+    gtShape, gtDtype = labelImageShapeDtype(gtLabelImageFile)
+    testShape, testDtype = labelImageShapeDtype(testLabelImageFile)
+    assert gtShape == testShape, 'Label images {} and {} do not have the same shape'.format(gtLabelImageFile,
+                                                                                            testLabelImageFile)
+
+    if slabSize is None:
+        slabSize = gtShape[0]
+    readGTSlab = labelImageSlabReader(gtLabelImageFile, slabSize)
+    readTestSlab = labelImageSlabReader(testLabelImageFile, slabSize)
+
+    maxGTLabel = _maxLabel(gtLabelImageFile, gtDtype, readGTSlab, gtShape[0], slabSize)
+    nTestBins = _maxLabel(testLabelImageFile, testDtype, readTestSlab, testShape[0], slabSize) + 1
+    # gt labels times the number of test labels have to fit into the uint64 keys
+    assert nTestBins < 2 ** 64 and (maxGTLabel + 1) * nTestBins <= 2 ** 64, \
+        'The labels of {} and {}, up to {} and {}, are too large to be paired'.format(
+            gtLabelImageFile, testLabelImageFile, maxGTLabel, nTestBins - 1)
+
+    slabPairKeys = []
+    slabPairCounts = []
+    for zStart in range(0, gtShape[0], slabSize):
+        zStop = min(zStart + slabSize, gtShape[0])
+        gtPairLabels, testPairLabels, pairCounts = labelPairCounts(
+            readGTSlab(zStart, zStop), readTestSlab(zStart, zStop), nTestBins)
+        slabPairKeys.append(gtPairLabels * np.uint64(nTestBins) + testPairLabels)
+        slabPairCounts.append(pairCounts)
+
+    # pairs occurring in several slabs are added up
+    pairKeys, pairInds = np.unique(np.concatenate(slabPairKeys), return_inverse=True)
+    pairCounts = np.bincount(pairInds, weights=np.concatenate(slabPairCounts)).astype(np.int64)
+
+    # pairs with the background label 0 are kept, they complete the voxel counts of the labels
+    return pairKeys // np.uint64(nTestBins), pairKeys % np.uint64(nTestBins), pairCounts
+
+
+def pairIoUs(gtPairLabels: np.ndarray, testPairLabels: np.ndarray, pairCounts: np.ndarray) -> tuple:
+
+    gtLabels, gtPairInds = np.unique(gtPairLabels, return_inverse=True)
+    testLabels, testPairInds = np.unique(testPairLabels, return_inverse=True)
+    gtSizes = np.bincount(gtPairInds, weights=pairCounts)
+    testSizes = np.bincount(testPairInds, weights=pairCounts)
+
+    candidateMask = (gtPairLabels > 0) & (testPairLabels > 0)
+    intersections = pairCounts[candidateMask]
+    candidateGTInds = gtPairInds[candidateMask]
+    candidateTestInds = testPairInds[candidateMask]
+    candidateIoUs = intersections / (gtSizes[candidateGTInds] + testSizes[candidateTestInds] - intersections)
+
+    # indices are returned into the label arrays without the background label
+    gtOffset = int(gtLabels[0] == 0) if len(gtLabels) else 0
+    testOffset = int(testLabels[0] == 0) if len(testLabels) else 0
+
+    return gtLabels[gtOffset:], testLabels[testOffset:], \
+        candidateGTInds - gtOffset, candidateTestInds - testOffset, candidateIoUs
+
+
+def assignPairs(candidateGTInds: np.ndarray, candidateTestInds: np.ndarray, candidateIoUs: np.ndarray,
+                iouThreshold: float = 0.5, assignment: str = 'greedy') -> tuple:
+
+    assert assignment in assignmentMethods, 'Unknown assignment {}, must be one of {}'.format(assignment,
+                                                                                           assignmentMethods)
+
+    keep = candidateIoUs >= iouThreshold
+    candidateGTInds = candidateGTInds[keep]
+    candidateTestInds = candidateTestInds[keep]
+    candidateIoUs = candidateIoUs[keep]
+
+    if assignment == 'greedy':
+        return _assignGreedy(candidateGTInds, candidateTestInds, candidateIoUs)
+    else:
+        return _assignHungarian(candidateGTInds, candidateTestInds, candidateIoUs)
+
+
+def _assignGreedy(candidateGTInds: np.ndarray, candidateTestInds: np.ndarray, candidateIoUs: np.ndarray) -> tuple:
+
+    # highest IoU first, each label matched at most once
+    order = np.argsort(-candidateIoUs, kind='mergesort')
+    gtTaken = set()
+    testTaken = set()
+    matchInds = []
+    for ind in order:
+        gtInd, testInd = candidateGTInds[ind], candidateTestInds[ind]
+        if gtInd not in gtTaken and testInd not in testTaken:
+            gtTaken.add(gtInd)
+            testTaken.add(testInd)
+            matchInds.append(ind)
+
+    matchInds = np.array(matchInds, dtype=np.intp)
+    return candidateGTInds[matchInds], candidateTestInds[matchInds], candidateIoUs[matchInds]
+
+
+def _assignHungarian(candidateGTInds: np.ndarray, candidateTestInds: np.ndarray,
+                     candidateIoUs: np.ndarray) -> tuple:
+
+    if len(candidateIoUs) == 0:
+        return candidateGTInds, candidateTestInds, candidateIoUs
+
+    # candidates form a sparse bipartite graph, the assignment is solved separately in each of its connected
+    # components, so that the dense cost matrices are only as large as the components
+    nGT = int(candidateGTInds.max()) + 1
+    nNodes = nGT + int(candidateTestInds.max()) + 1
+    graph = coo_matrix((np.ones(len(candidateIoUs)), (candidateGTInds, candidateTestInds + nGT)),
+                       shape=(nNodes, nNodes))
+    nComponents, nodeComponents = connected_components(graph, directed=False)
+
+    candidateComponents = nodeComponents[candidateGTInds]
+    componentSizes = np.bincount(candidateComponents, minlength=nComponents)
+
+    # components made of a single candidate pair, almost all of them, need no assignment
+    matchMask = componentSizes[candidateComponents] == 1
+
+    multipleInds = np.flatnonzero(~matchMask)
+    multipleInds = multipleInds[np.argsort(candidateComponents[multipleInds], kind='mergesort')]
+    splitPoints = np.flatnonzero(np.diff(candidateComponents[multipleInds])) + 1
+    for componentInds in np.split(multipleInds, splitPoints):
+        if len(componentInds) == 0:
+            continue
+        gtInds, gtLocal = np.unique(candidateGTInds[componentInds], return_inverse=True)
+        testInds, testLocal = np.unique(candidateTestInds[componentInds], return_inverse=True)
+        ious = np.zeros((len(gtInds), len(testInds)))
+        ious[gtLocal, testLocal] = candidateIoUs[componentInds]
+        localCandidates = -np.ones((len(gtInds), len(testInds)), dtype=np.intp)
+        localCandidates[gtLocal, testLocal] = componentInds
+        rowInds, colInds = linear_sum_assignment(-ious)
+        assigned = localCandidates[rowInds, colInds]
+        matchMask[assigned[assigned >= 0]] = True
+
+    return candidateGTInds[matchMask], candidateTestInds[matchMask], candidateIoUs[matchMask]
+
+
+def classifyOverlaps(gtLabels: np.ndarray, testLabels: np.ndarray,
+                     gtPairLabels: np.ndarray, testPairLabels: np.ndarray, pairCounts: np.ndarray,
+                     iouThreshold: float = 0.5, assignment: str = 'greedy') -> tuple:
+
+    tableGTLabels, tableTestLabels, candidateGTInds, candidateTestInds, candidateIoUs = \
+        pairIoUs(gtPairLabels, testPairLabels, pairCounts)
+
+    gtMatchInds, testMatchInds, matchIoUs = assignPairs(candidateGTInds, candidateTestInds, candidateIoUs,
+                                                        iouThreshold=iouThreshold, assignment=assignment)
+
+    # the masks are aligned with the given gtLabels and testLabels
+    gtTPMask = np.isin(gtLabels, tableGTLabels[gtMatchInds])
+    testTPMask = np.isin(testLabels, tableTestLabels[testMatchInds])
+
+    # FPs that do not overlap any gt nucleus are noise
+    testNoiseFPMask = ~testTPMask & ~np.isin(testLabels, tableTestLabels[candidateTestInds])
+
+    return gtTPMask, testTPMask, testNoiseFPMask
+
+
+def overlapSweepCounts(gtPairLabels: np.ndarray, testPairLabels: np.ndarray, pairCounts: np.ndarray,
+                       iouThresholds: typing.Iterable[float], assignment: str = 'greedy') -> tuple:
+
+    iouThresholds = np.asarray(iouThresholds, dtype=np.float64)
+
+    tableGTLabels, tableTestLabels, candidateGTInds, candidateTestInds, candidateIoUs = \
+        pairIoUs(gtPairLabels, testPairLabels, pairCounts)
+
+    if assignment == 'greedy':
+        # pairs below a threshold come last in the greedy order, so the matches at any threshold are
+        # the matches at the lowest threshold with an IoU above it
+        gtMatchInds, testMatchInds, matchIoUs = assignPairs(candidateGTInds, candidateTestInds, candidateIoUs,
+                                                            iouThreshold=iouThresholds.min(), assignment=assignment)
+        sortedMatchIoUs = np.sort(matchIoUs)
+        nTP = len(sortedMatchIoUs) - np.searchsorted(sortedMatchIoUs, iouThresholds, side='left')
+    else:
+        nTP = np.array([len(assignPairs(candidateGTInds, candidateTestInds, candidateIoUs,
+                                        iouThreshold=x, assignment=assignment)[0]) for x in iouThresholds])
+
+    # test nuclei overlapping no gt nucleus are noise FPs at every threshold
+    nNoiseFP = len(tableTestLabels) - len(np.unique(candidateTestInds))
+
+    return nTP, np.full(len(iouThresholds), nNoiseFP, dtype=np.int64)
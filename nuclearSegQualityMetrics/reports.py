@@ -0,0 +1,257 @@
+import argparse
+import multiprocessing
+import os
+import threading
+import typing
+
+_plottingReady = False
+# pyplot is not thread safe, reports rendered from several threads, e.g. for batch job groups, take turns
+_plottingLock = threading.Lock()
+
+# processes started by startReports, which waitForReports joins
+_reportProcesses = []
+
+# the plots rendered from each result table in an output folder
+reportPlotNames = {'metrics': ('metrics.png', 'cellCounts.png'), 'metricSweep': ('metricSweep.png',),
+                   'tileMetrics': ('tileMetrics.png',)}
+
+
+def setupPlotting():
+
+    # seaborn and matplotlib are imported only when a report is actually rendered
+    global _plottingReady
+    import seaborn as sns
+    from matplotlib import pyplot as plt
+    from nuclearSegQualityMetrics.matplotlibRCParams import mplPars
+
+    if not _plottingReady:
+        sns.set(rc=mplPars, style='darkgrid')
+        _plottingReady = True
+
+    return plt
+
+
+def plotMetricsCellCounts(metricsDF, outputDir: str):
+
+    with _plottingLock:
+        _plotMetricsCellCounts(metricsDF, outputDir)
+
+
+def _plotMetricsCellCounts(metricsDF, outputDir: str):
+
+    plt = setupPlotting()
+
+    nTest = metricsDF.shape[0]
+    gtCellCount = metricsDF['groundTruthCellCount'].iloc[-1]
+
+    fig0, ax0 = plt.subplots(figsize=(14, 11.2))
+
+    metricNames = ['Recall', 'Precision', 'fMeasure', 'Accuracy']
+    metricsDF.plot(ax=ax0, xticks=range(nTest), y=metricNames, marker='o', ms=10, lw=3, )
+
+    # confidence intervals, if the table has them, as bands in the colors of the lines
+    for metricName, line in zip(metricNames, ax0.get_lines()):
+        if metricName + 'CILow' in metricsDF.columns:
+            ax0.fill_between(range(nTest), metricsDF[metricName + 'CILow'], metricsDF[metricName + 'CIHigh'],
+                             color=line.get_color(), alpha=0.2, lw=0)
+
+    ax0.set_xticklabels(ax0.get_xticklabels(), rotation=90)
+
+    ax0.set_xlim(-0.5, nTest - 0.5)
+    fig0.tight_layout()
+    fig0.canvas.draw()
+    fig0.savefig(os.path.join(outputDir, 'metrics.png'), dpi=150)
+
+    fig1, ax1 = plt.subplots(figsize=(14, 11.2))
+    metricsDF.plot(ax=ax1, xticks=range(nTest), y=['testCellCount'], marker='o', ms=10, lw=3, color='b')
+    ax1.plot(ax1.get_xlim(), [gtCellCount, gtCellCount], 'r:', lw=3, label='ground Truth')
+    ax1.legend(loc='best')
+    ax1.set_xlim(-0.5, nTest - 0.5)
+    ax1.set_xticklabels(ax0.get_xticklabels(), rotation=90)
+    fig1.tight_layout()
+    fig1.canvas.draw()
+    fig1.savefig(os.path.join(outputDir, 'cellCounts.png'), dpi=150)
+
+    for fig in [fig0, fig1]:
+        plt.close(fig.number)
+        del fig
+
+
+def plotMetricSweep(sweepDF, outputDir: str):
+
+    with _plottingLock:
+        _plotMetricSweep(sweepDF, outputDir)
+
+
+def _plotMetricSweep(sweepDF, outputDir: str):
+
+    plt = setupPlotting()
+
+    thresholdName = 'IoU threshold' if sweepDF['matching'].iloc[0] == 'overlap' else 'gt radius scale'
+
+    fig, (ax0, ax1) = plt.subplots(1, 2, figsize=(20, 9))
+
+    for label, labelDF in sweepDF.groupby('label', sort=True):
+        ax0.plot(labelDF['threshold'], labelDF['Precision'], 'o-', ms=6, lw=2, label='{} Precision'.format(label))
+        ax0.plot(labelDF['threshold'], labelDF['Recall'], 's--', ms=6, lw=2, label='{} Recall'.format(label))
+        ax1.plot(labelDF['Recall'], labelDF['Precision'], 'o-', ms=6, lw=2, label=label)
+
+    ax0.set_xlabel(thresholdName)
+    ax0.legend(loc='best')
+    ax1.set_xlabel('Recall')
+    ax1.set_ylabel('Precision')
+    ax1.legend(loc='best')
+    fig.tight_layout()
+    fig.savefig(os.path.join(outputDir, 'metricSweep.png'), dpi=150)
+    plt.close(fig.number)
+
+
+def plotTileMetrics(tileDF, outputDir: str):
+
+    with _plottingLock:
+        _plotTileMetrics(tileDF, outputDir)
+
+
+def _plotTileMetrics(tileDF, outputDir: str):
+
+    plt = setupPlotting()
+
+    # recall and precision of the z slabs of each test file, and the recall in y and x of all of them together
+    # tiles without nuclei are NaN, and left blank
+    slabDF = tileDF.groupby(['label', 'tileZ'], sort=True)[['nGT', 'nFN', 'nTP', 'nTest']].sum()
+    slabRecall = ((slabDF['nGT'] - slabDF['nFN']) / slabDF['nGT']).unstack('tileZ')
+    slabPrecision = (slabDF['nTP'] / slabDF['nTest']).unstack('tileZ')
+    yxDF = tileDF.groupby(['tileY', 'tileX'], sort=True)[['nGT', 'nFN']].sum()
+    yxRecall = ((yxDF['nGT'] - yxDF['nFN']) / yxDF['nGT']).unstack('tileX')
+
+    fig, axes = plt.subplots(1, 3, figsize=(24, 8))
+
+    for ax, valueDF, title in ((axes[0], slabRecall, 'Recall per z slab'),
+                               (axes[1], slabPrecision, 'Precision per z slab')):
+        image = ax.imshow(valueDF.values, vmin=0, vmax=1, cmap='viridis', aspect='auto', interpolation='nearest')
+        ax.set_yticks(range(valueDF.shape[0]))
+        ax.set_yticklabels(valueDF.index)
+        ax.set_xticks(range(valueDF.shape[1]))
+        ax.set_xlabel('z tile')
+        ax.set_title(title)
+        ax.grid(False)
+        fig.colorbar(image, ax=ax)
+
+    image = axes[2].imshow(yxRecall.values, vmin=0, vmax=1, cmap='viridis', interpolation='nearest')
+    axes[2].set_xticks(range(yxRecall.shape[1]))
+    axes[2].set_yticks(range(yxRecall.shape[0]))
+    axes[2].set_xlabel('x tile')
+    axes[2].set_ylabel('y tile')
+    axes[2].set_title('Recall per y/x tile')
+    axes[2].grid(False)
+    fig.colorbar(image, ax=axes[2])
+
+    fig.tight_layout()
+    fig.savefig(os.path.join(outputDir, 'tileMetrics.png'), dpi=150)
+    plt.close(fig.number)
+
+
+def removeResultTable(outputDir: str, tableName: str):
+
+    # a result table left in outputDir by an earlier run, in any format, and its excel export and plots
+    from nuclearSegQualityMetrics.resultsIO import tableFormats
+
+    for fileName in ['{}.{}'.format(tableName, x) for x in tableFormats + ('xlsx',)] + \
+            list(reportPlotNames[tableName]):
+        try:
+            os.remove(os.path.join(outputDir, fileName))
+        except FileNotFoundError:
+            pass
+
+
+def findReportTables(outputDir: str) -> typing.List[str]:
+
+    # the result tables in outputDir, and the debug info tables of the pairs in its metrics table
+    from nuclearSegQualityMetrics.SegmentationQualityMetrics import debugInfoDirName
+    from nuclearSegQualityMetrics.resultsIO import debugTableNames, findTable, readTable, resultTableNames
+
+    tableFiles = [findTable(os.path.join(outputDir, x)) for x in resultTableNames]
+    metricsFile = tableFiles[0]
+    if metricsFile is not None:
+        metricsDF = readTable(metricsFile)
+        for testLabelImageFile, gtLabelImageFile in zip(metricsDF['testLabelImageFile'],
+                                                        metricsDF['groundTruthLabelImageFile']):
+            debugInfoDir = os.path.join(outputDir, debugInfoDirName(testLabelImageFile, gtLabelImageFile))
+            tableFiles.extend(findTable(os.path.join(debugInfoDir, x)) for x in debugTableNames)
+
+    return [x for x in tableFiles if x is not None]
+
+
+def renderReports(outputDir: str, excelExport: bool = False,
+                  tableFiles: typing.Union[None, typing.Iterable[str]] = None) -> typing.List[str]:
+
+    # reports are rendered from saved tables only, so that they can be regenerated at any time without recomputing
+    # the metrics. Runs pass the tables they wrote, without them the tables are looked up in outputDir
+    from nuclearSegQualityMetrics.instrumentation import StageRecorder
+    from nuclearSegQualityMetrics.resultsIO import exportExcel, readTable
+
+    if tableFiles is None:
+        tableFiles = findReportTables(outputDir)
+    tableFiles = list(tableFiles)
+
+    recorder = StageRecorder('renderReports', outputDir=outputDir)
+    plotFunctions = {'metrics': lambda x: plotMetricsCellCounts(readTable(x, indexCol='label'), outputDir),
+                     'metricSweep': lambda x: plotMetricSweep(readTable(x), outputDir),
+                     'tileMetrics': lambda x: plotTileMetrics(readTable(x), outputDir)}
+
+    reportFiles = []
+    for tableFile in tableFiles:
+        # tables of the debug info folders are only exported
+        if os.path.dirname(os.path.abspath(tableFile)) != os.path.abspath(outputDir):
+            continue
+        tableName = os.path.splitext(os.path.basename(tableFile))[0]
+        with recorder.stage('plotting'):
+            plotFunctions[tableName](tableFile)
+        reportFiles.extend(os.path.join(outputDir, x) for x in reportPlotNames[tableName])
+
+    if excelExport:
+        with recorder.stage('excelExport'):
+            reportFiles.extend(exportExcel(tableFiles))
+
+    recorder.emit()
+
+    return reportFiles
+
+
+def startReports(outputDir: str, excelExport: bool = False,
+                 tableFiles: typing.Union[None, typing.Iterable[str]] = None) -> multiprocessing.Process:
+
+    # spawned rather than forked, the caller may be running other threads, e.g. a GUI or batch job groups.
+    # The process is not a daemon, python waits for it at exit
+    process = multiprocessing.get_context('spawn').Process(target=renderReports,
+                                                           args=(outputDir, excelExport, tableFiles),
+                                                           name='renderReports')
+    process.start()
+    _reportProcesses.append(process)
+
+    return process
+
+
+def waitForReports(timeout: typing.Union[None, float] = None) -> bool:
+
+    # True if all the reports started so far are finished
+    while _reportProcesses:
+        process = _reportProcesses[0]
+        process.join(timeout)
+        if process.is_alive():
+            return False
+        _reportProcesses.pop(0)
+
+    return True
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Render the plots, and optionally the excel files, of results '
+                                                 'saved by saveResultsTestList or saveSweepResultsTestList')
+    parser.add_argument('outputDir', help='folder with the saved results')
+    parser.add_argument('--excelExport', action='store_true', help='also convert the result tables to xlsx')
+    args = parser.parse_args()
+
+    for reportFile in renderReports(args.outputDir, excelExport=args.excelExport):
+        print(reportFile)
@@ -0,0 +1,85 @@
+import os
+import typing
+
+import numpy as np
+import pandas as pd
+
+tableFormats = ('csv', 'parquet')
+
+# the tables runs write into the output folder, and into the debug info folder of each pair
+resultTableNames = ('metrics', 'metricSweep', 'tileMetrics')
+debugTableNames = ('gtData', 'testData', 'tileMetrics')
+
+
+def writeTable(df: pd.DataFrame, outputFileStem: str, tableFormat: str = 'csv', index: bool = True) -> str:
+
+    assert tableFormat in tableFormats, 'Unknown table format {}, must be one of {}'.format(tableFormat,
+                                                                                         tableFormats)
+    outputFile = '{}.{}'.format(outputFileStem, tableFormat)
+
+    # parquet needs pyarrow or fastparquet, which are optional
+    if tableFormat == 'parquet':
+        df.to_parquet(outputFile, index=index)
+    else:
+        df.to_csv(outputFile, index=index)
+
+    return outputFile
+
+
+def readTable(tableFile: str, indexCol: typing.Union[None, str] = None) -> pd.DataFrame:
+
+    if tableFile.endswith('.parquet'):
+        df = pd.read_parquet(tableFile)
+        if indexCol is not None and indexCol in df.columns:
+            df = df.set_index(indexCol)
+        return df
+    else:
+        return pd.read_csv(tableFile, index_col=indexCol)
+
+
+def findTable(outputFileStem: str) -> typing.Union[None, str]:
+
+    for tableFormat in tableFormats:
+        tableFile = '{}.{}'.format(outputFileStem, tableFormat)
+        if os.path.isfile(tableFile):
+            return tableFile
+    return None
+
+
+def debugInfoDataFrame(labelStats, classification: np.ndarray) -> pd.DataFrame:
+
+    df = pd.DataFrame(index=pd.Index(data=labelStats.labels, name="Label Value"))
+    df["Centroid Z"] = labelStats.centroids[:, 0]
+    df["Centroid Y"] = labelStats.centroids[:, 1]
+    df["Centroid X"] = labelStats.centroids[:, 2]
+    df["Classification"] = np.asarray(classification)
+    df["Equivalent Sperical Radius (pixels)"] = labelStats.radii
+    df["Volume (pixels)"] = labelStats.volumes
+
+    return df
+
+
+def tileMetricsDataFrame(tileMetrics: dict) -> pd.DataFrame:
+
+    # one row per tile, with its z, y and x tile indices
+    tileGrid = tileMetrics['nGT'].shape
+    df = pd.DataFrame({'tile' + x: y.ravel() for x, y in zip('ZYX', np.indices(tileGrid))})
+    for name, values in tileMetrics.items():
+        df[name] = values.ravel()
+
+    return df
+
+
+def exportExcel(tableFiles: typing.Iterable[str]) -> typing.List[str]:
+
+    # converts the given tables, e.g. those written by a run, into xlsx files next to them
+    excelFiles = []
+    for tableFile in tableFiles:
+        excelFile = '{}.xlsx'.format(os.path.splitext(tableFile)[0])
+        df = readTable(tableFile)
+        if df.index.name is not None:
+            df = df.reset_index()
+        df.to_excel(excelFile, index=False)
+        excelFiles.append(excelFile)
+
+    return excelFiles
@@ -0,0 +1,170 @@
+import contextlib
+import json
+import os
+import sqlite3
+import time
+import typing
+
+import pandas as pd
+
+from nuclearSegQualityMetrics.folderDefs import getAppDataHome
+from nuclearSegQualityMetrics.resultsIO import findTable, readTable
+
+pairMetricColumns = ('nFP', 'nTP', 'nFN', 'nNoiseFP', 'nNonNoiseFP', 'Recall', 'Precision', 'fMeasure', 'Accuracy')
+
+_schema = '''
+CREATE TABLE IF NOT EXISTS runs (
+    runId INTEGER PRIMARY KEY,
+    timestamp REAL NOT NULL,
+    outputDir TEXT,
+    gtLabelImageFile TEXT NOT NULL,
+    options TEXT
+);
+CREATE TABLE IF NOT EXISTS pairs (
+    pairId INTEGER PRIMARY KEY,
+    runId INTEGER NOT NULL REFERENCES runs (runId) ON DELETE CASCADE,
+    timestamp REAL NOT NULL,
+    label TEXT,
+    testLabelImageFile TEXT NOT NULL,
+    gtLabelImageFile TEXT NOT NULL,
+    nFP INTEGER, nTP INTEGER, nFN INTEGER, nNoiseFP INTEGER, nNonNoiseFP INTEGER,
+    Recall REAL, Precision REAL, fMeasure REAL, Accuracy REAL
+);
+CREATE TABLE IF NOT EXISTS nuclei (
+    pairId INTEGER NOT NULL REFERENCES pairs (pairId) ON DELETE CASCADE,
+    source TEXT NOT NULL,
+    labelValue INTEGER NOT NULL,
+    centroidZ REAL, centroidY REAL, centroidX REAL,
+    radius REAL, volume INTEGER,
+    classification TEXT
+);
+CREATE INDEX IF NOT EXISTS runsTimestamp ON runs (timestamp);
+CREATE INDEX IF NOT EXISTS runsGT ON runs (gtLabelImageFile);
+CREATE INDEX IF NOT EXISTS pairsRunId ON pairs (runId);
+CREATE INDEX IF NOT EXISTS pairsGT ON pairs (gtLabelImageFile);
+CREATE INDEX IF NOT EXISTS pairsTest ON pairs (testLabelImageFile);
+CREATE INDEX IF NOT EXISTS pairsLabel ON pairs (label);
+CREATE INDEX IF NOT EXISTS pairsTimestamp ON pairs (timestamp);
+CREATE INDEX IF NOT EXISTS nucleiPairId ON nuclei (pairId);
+'''
+
+# columns of the gtData and testData debug tables written by segQualErrors
+_debugInfoColumns = ['Label Value', 'Centroid Z', 'Centroid Y', 'Centroid X', 'Equivalent Sperical Radius (pixels)',
+                     'Volume (pixels)', 'Classification']
+
+
+class ResultsStore(object):
+
+    def __init__(self, dbFile: typing.Union[None, str] = None):
+
+        if dbFile is None:
+            dbFile = os.path.join(getAppDataHome(), 'results.sqlite')
+
+        self.dbFile = dbFile
+        with self._connect() as connection:
+            connection.executescript(_schema)
+
+    @contextlib.contextmanager
+    def _connect(self):
+
+        # a connection per operation, so that the store can be used from several threads and processes.
+        # Everything written through one connection is a single transaction
+        connection = sqlite3.connect(self.dbFile, timeout=60)
+        try:
+            connection.execute('PRAGMA foreign_keys = ON')
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def addRun(self, metricsDF: pd.DataFrame, gtLabelImageFile: str, outputDir: typing.Union[None, str] = None,
+               options: typing.Union[None, dict] = None,
+               debugInfoDirs: typing.Union[None, typing.Dict[str, str]] = None) -> int:
+
+        # debugInfoDirs maps labels of test files to the folders with their gtData and testData debug tables,
+        # whose nuclei are stored with their classification
+        timestamp = time.time()
+        with self._connect() as connection:
+            runId = connection.execute('INSERT INTO runs (timestamp, outputDir, gtLabelImageFile, options) '
+                                       'VALUES (?, ?, ?, ?)',
+                                       (timestamp, outputDir, gtLabelImageFile,
+                                        json.dumps(options, sort_keys=True))).lastrowid
+
+            for record in metricsDF.to_dict('records'):
+                pairId = connection.execute(
+                    'INSERT INTO pairs (runId, timestamp, label, testLabelImageFile, gtLabelImageFile, {}) '
+                    'VALUES (?, ?, ?, ?, ?, {})'.format(', '.join(pairMetricColumns),
+                                                        ', '.join('?' * len(pairMetricColumns))),
+                    [runId, timestamp, str(record['label']), record['testLabelImageFile'], gtLabelImageFile] +
+                    [_toSQLite(record[x]) for x in pairMetricColumns]).lastrowid
+
+                if debugInfoDirs is not None and record['label'] in debugInfoDirs:
+                    for source in ('gt', 'test'):
+                        tableFile = findTable(os.path.join(debugInfoDirs[record['label']], source + 'Data'))
+                        if tableFile is None:
+                            continue
+                        nucleiDF = readTable(tableFile).reset_index()
+                        rows = nucleiDF[_debugInfoColumns].itertuples(index=False, name=None)
+                        connection.executemany('INSERT INTO nuclei VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                               ([pairId, source] + [_toSQLite(x) for x in row] for row in rows))
+
+        return runId
+
+    def _query(self, query: str, parameters: typing.Iterable = ()) -> pd.DataFrame:
+
+        with self._connect() as connection:
+            return pd.read_sql_query(query, connection, params=list(parameters))
+
+    def queryRuns(self, gtLabelImageFile: typing.Union[None, str] = None) -> pd.DataFrame:
+
+        if gtLabelImageFile is None:
+            return self._query('SELECT * FROM runs ORDER BY timestamp')
+        return self._query('SELECT * FROM runs WHERE gtLabelImageFile = ? ORDER BY timestamp', [gtLabelImageFile])
+
+    def queryPairs(self, gtLabelImageFile: typing.Union[None, str] = None,
+                   testLabelImageFile: typing.Union[None, str] = None, label: typing.Union[None, str] = None,
+                   since: typing.Union[None, float] = None, until: typing.Union[None, float] = None,
+                   runIds: typing.Union[None, typing.Iterable[int]] = None) -> pd.DataFrame:
+
+        conditions = []
+        parameters = []
+        for column, value in (('gtLabelImageFile', gtLabelImageFile), ('testLabelImageFile', testLabelImageFile),
+                              ('label', label)):
+            if value is not None:
+                conditions.append('pairs.{} = ?'.format(column))
+                parameters.append(value)
+        if since is not None:
+            conditions.append('pairs.timestamp >= ?')
+            parameters.append(since)
+        if until is not None:
+            conditions.append('pairs.timestamp <= ?')
+            parameters.append(until)
+        if runIds is not None:
+            runIds = list(runIds)
+            conditions.append('pairs.runId IN ({})'.format(', '.join('?' * len(runIds))))
+            parameters.extend(runIds)
+
+        query = 'SELECT pairs.*, runs.outputDir, runs.options FROM pairs JOIN runs USING (runId)'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+
+        return self._query(query + ' ORDER BY pairs.timestamp, pairs.pairId', parameters)
+
+    def queryNuclei(self, pairId: int, source: typing.Union[None, str] = None) -> pd.DataFrame:
+
+        if source is None:
+            return self._query('SELECT * FROM nuclei WHERE pairId = ?', [pairId])
+        return self._query('SELECT * FROM nuclei WHERE pairId = ? AND source = ?', [pairId, source])
+
+    def compareRuns(self, runIds: typing.Iterable[int], metric: str = 'fMeasure') -> pd.DataFrame:
+
+        # one row per label, one column per run
+        assert metric in pairMetricColumns, 'Unknown metric {}, must be one of {}'.format(metric, pairMetricColumns)
+        pairsDF = self.queryPairs(runIds=runIds)
+        return pairsDF.pivot_table(index='label', columns='runId', values=metric)
+
+
+def _toSQLite(value):
+
+    # numpy scalars are not understood by sqlite3
+    return value.item() if hasattr(value, 'item') else value
@@ -0,0 +1,72 @@
+import json
+import os
+import threading
+import typing
+
+import numpy as np
+
+from nuclearSegQualityMetrics.featureCache import getFileIdentity
+from nuclearSegQualityMetrics.spatialMetrics import tileCountNames
+
+
+class RunManifest(object):
+
+    def __init__(self, outputDir: str, manifestFileName: str = 'runManifest.jsonl'):
+
+        self.manifestFile = os.path.join(outputDir, manifestFileName)
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def pairKey(testLabelImageFile: str, groundTruthLabelImageFile: str, options: dict) -> str:
+
+        # the identities of both files are part of the key, so results of changed files are not reused
+        return json.dumps({'test': getFileIdentity(testLabelImageFile),
+                           'groundTruth': getFileIdentity(groundTruthLabelImageFile),
+                           'options': options}, sort_keys=True)
+
+    def load(self) -> dict:
+
+        entries = {}
+        if not os.path.isfile(self.manifestFile):
+            return entries
+
+        with open(self.manifestFile) as fle:
+            for line in fle:
+                # the last line can be incomplete, if a run was killed while writing it
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                entries[entry['key']] = entry
+
+        return entries
+
+    def clear(self):
+
+        with self.lock:
+            if os.path.isfile(self.manifestFile):
+                os.remove(self.manifestFile)
+
+    def append(self, testLabelImageFile: str, groundTruthLabelImageFile: str, options: dict, label: str,
+               errors: typing.Iterable[int], tileCounts: typing.Union[None, dict] = None):
+
+        entry = {'key': self.pairKey(testLabelImageFile, groundTruthLabelImageFile, options),
+                 'testLabelImageFile': testLabelImageFile, 'groundTruthLabelImageFile': groundTruthLabelImageFile,
+                 'label': label, 'errors': [int(x) for x in errors]}
+        # per-tile counts, as nested lists of the shape of the tile grid. The metrics are derived from them
+        if tileCounts is not None:
+            entry['tileCounts'] = {x: np.asarray(tileCounts[x]).tolist() for x in tileCountNames}
+
+        with self.lock:
+            # an incomplete last line, left by a killed run, is ended so that it does not swallow this entry
+            prefix = ''
+            if os.path.isfile(self.manifestFile) and os.path.getsize(self.manifestFile):
+                with open(self.manifestFile, 'rb') as fle:
+                    fle.seek(-1, os.SEEK_END)
+                    if fle.read(1) != b'\n':
+                        prefix = '\n'
+
+            with open(self.manifestFile, 'a') as fle:
+                fle.write(prefix + json.dumps(entry) + '\n')
+                fle.flush()
+                os.fsync(fle.fileno())
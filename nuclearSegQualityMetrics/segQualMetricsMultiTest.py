@@ -1,13 +1,66 @@
+import argparse
 import json
 import sys
 
 from nuclearSegQualityMetrics.SegmentationQualityMetrics import saveResultsTestList
+from nuclearSegQualityMetrics.batchJobs import runBatchJobSpec
+from nuclearSegQualityMetrics.featureCache import openFeatureCache, setDefaultFeatureCache
+from nuclearSegQualityMetrics.instrumentation import JSONLinesLog, addInstrumentationHook, runProfiled
+from nuclearSegQualityMetrics.workQueue import saveResultsWorkQueue
 
-assert len(sys.argv) == 2, 'Invalid Usage. Please use as: ' \
-                           '\'python segQualMetricsMultiTest.py <json paramater file>\''
-pars = json.load(open(sys.argv[1]))
-gtLabelImageFile = pars['gtLabelImageFile']
-testLabelImageFiles = pars['testLabelImageFiles']
-testLabels = pars['testImageFileLabels']
-outputDir = pars['outputDir']
-saveResultsTestList(testLabelImageFiles, gtLabelImageFile, outputDir, testLabels, True)
+# the guard is needed for worker processes started with 'spawn', which import this module
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Compute segmentation quality metrics for a list of test '
+                                                 'label images against a ground truth label image')
+    parser.add_argument('parameterFile', help='json paramater file, with one ground truth or a batch job spec '
+                                              'listing groups of ground truths and their tests')
+    parser.add_argument('--profile', default=None, help='write a cProfile dump to this file')
+    parser.add_argument('--instrumentationLog', default=None,
+                        help='append per-stage timing records to this JSON-lines file')
+    parser.add_argument('--headless', action='store_true',
+                        help='compute and save metrics without rendering plots or excel files, which '
+                             'nuclearSegQualityMetrics.reports can render later')
+    args = parser.parse_args()
+
+    pars = json.load(open(args.parameterFile))
+    if pars.get('useFeatureCache', True):
+        setDefaultFeatureCache(openFeatureCache(pars.get('featureCacheDir', None)))
+    if args.instrumentationLog is not None:
+        addInstrumentationHook(JSONLinesLog(args.instrumentationLog))
+
+    # a batch job spec has 'groups', each with a ground truth, its tests and optionally its own options
+    if 'groups' in pars:
+        runProfiled(args.profile, runBatchJobSpec, pars, reportMode='skip' if args.headless else None)
+        sys.exit(0)
+
+    gtLabelImageFile = pars['gtLabelImageFile']
+    testLabelImageFiles = pars['testLabelImageFiles']
+    testLabels = pars['testImageFileLabels']
+    outputDir = pars['outputDir']
+    nWorkers = pars.get('nWorkers', 1)
+
+    # with a queueDir on a shared filesystem, this process is the coordinator of workers started on any node with
+    # 'python -m nuclearSegQualityMetrics.workQueue worker queueDir', and nWorkers of them on this node
+    if 'queueDir' in pars:
+        runProfiled(args.profile, saveResultsWorkQueue, testLabelImageFiles, gtLabelImageFile, outputDir, testLabels,
+                    pars['queueDir'], saveDebugInfo=True, tableFormat=pars.get('tableFormat', 'csv'),
+                    excelExport=pars.get('excelExport', False),
+                    reportMode='skip' if args.headless else pars.get('reportMode', 'sync'),
+                    matching=pars.get('matching', 'centroid'), iouThreshold=pars.get('iouThreshold', 0.5),
+                    assignment=pars.get('assignment', 'greedy'), resultsStore=pars.get('resultsStore', None),
+                    nLocalWorkers=pars.get('nWorkers', 0), heartbeatTimeout=pars.get('heartbeatTimeout', 60.0),
+                    nBootstrap=pars.get('nBootstrap', 2000), confidenceLevel=pars.get('confidenceLevel', 0.95),
+                    tileGrid=pars.get('tileGrid', None), resume=pars.get('resume', False),
+                    fillHoles=pars.get('fillHoles', True))
+        sys.exit(0)
+
+    runProfiled(args.profile, saveResultsTestList, testLabelImageFiles, gtLabelImageFile, outputDir, testLabels, True,
+                nWorkers=nWorkers, tableFormat=pars.get('tableFormat', 'csv'),
+                excelExport=pars.get('excelExport', False),
+                reportMode='skip' if args.headless else pars.get('reportMode', 'sync'),
+                matching=pars.get('matching', 'centroid'), iouThreshold=pars.get('iouThreshold', 0.5),
+                assignment=pars.get('assignment', 'greedy'), resultsStore=pars.get('resultsStore', None),
+                nBootstrap=pars.get('nBootstrap', 2000), confidenceLevel=pars.get('confidenceLevel', 0.95),
+                tileGrid=pars.get('tileGrid', None), resume=pars.get('resume', False),
+                fillHoles=pars.get('fillHoles', True))
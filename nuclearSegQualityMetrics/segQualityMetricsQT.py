@@ -1,16 +1,24 @@
 import inspect
+import multiprocessing
 import os
 import platform
 import sys
 
-from PyQt5.QtCore import QThread, pyqtSignal, QObject
+from PyQt5.QtCore import QThread, pyqtSignal, QObject, Qt, QAbstractTableModel, QModelIndex, QVariant
 from PyQt5.QtGui import QIcon
 from PyQt5.QtWidgets import QApplication, QMainWindow, QAction, \
-    QMessageBox, QDesktopWidget, QTableWidget, QTextEdit, \
-    QVBoxLayout, QHBoxLayout, QWidget, QPushButton, QCheckBox, QGroupBox, QLineEdit
+    QMessageBox, QDesktopWidget, QTableWidget, QTableWidgetItem, QTableView, QTextEdit, \
+    QVBoxLayout, QHBoxLayout, QWidget, QPushButton, QGroupBox, QProgressBar, QLineEdit
 
 from nuclearSegQualityMetrics.customWidgets import FileSelect, DirSelect, raiseInfo
-from nuclearSegQualityMetrics.SegmentationQualityMetrics import saveResultsTestList
+from nuclearSegQualityMetrics.featureCache import FeatureCache, setDefaultFeatureCache
+from nuclearSegQualityMetrics.folderDefs import getAppDataHome
+from nuclearSegQualityMetrics.SegmentationQualityMetrics import saveResultsTestList, getMetricsFromCounts, \
+    previewSegQualErrors
+from nuclearSegQualityMetrics.batchJobs import boundedWorkerCount, physicalMemoryBytes
+
+# the GUI uses at most this many worker processes, and their stacks at most half of the memory of the machine
+maxGUIWorkers = 8
 
 def getShortenedPath(path, showLast=2, compressWith='.....'):
 
@@ -24,46 +32,268 @@ def getShortenedPath(path, showLast=2, compressWith='.....'):
         return os.path.join(*toRetain)
 
 
+def iterFileBatchesInTree(dir, filter=None, batchSize=256):
+
+    # scandir based and depth first, files are handed out in batches as they are found
+    batch = []
+    dirStack = [os.path.abspath(dir)]
+    while dirStack:
+        dirName = dirStack.pop()
+        try:
+            dirEntries = sorted(os.scandir(dirName), key=lambda x: x.name)
+        except OSError:
+            continue
+        subDirs = []
+        for dirEntry in dirEntries:
+            if dirEntry.is_dir(follow_symlinks=False):
+                subDirs.append(dirEntry.path)
+            elif filter is None or dirEntry.name.endswith(filter):
+                batch.append(dirEntry.path)
+                if len(batch) == batchSize:
+                    yield batch
+                    batch = []
+        dirStack.extend(reversed(subDirs))
+    if batch:
+        yield batch
+
+
 def getAllFilesInTree(dir, filter=None):
 
     files = []
-    for dirName, subDirList, fileList in os.walk(dir):
-
-        dirFull = os.path.abspath(dirName)
-        if filter is not None:
-            fileList = [x for x in fileList if x.endswith(filter)]
-        files += [os.path.join(dirFull, file) for file in fileList]
+    for batch in iterFileBatchesInTree(dir, filter):
+        files += batch
     return files
 
+
+class DirScanThread(QThread):
+
+    # id of the scan and a batch of files. Batches of an earlier scan can still be queued when a new scan starts
+    batchFound = pyqtSignal(int, list)
+
+    def __init__(self):
+
+        self.dir = None
+        self.filter = None
+        self.scanId = 0
+
+        super().__init__()
+
+    def setDir(self, dir: str, filter: str = None):
+
+        self.dir = dir
+        self.filter = filter
+        self.scanId += 1
+
+    def run(self):
+
+        for batch in iterFileBatchesInTree(self.dir, self.filter):
+            if self.isInterruptionRequested():
+                break
+            self.batchFound.emit(self.scanId, batch)
+
+
+class TiffFileTableModel(QAbstractTableModel):
+
+    columns = ['Tiff File', 'Label']
+
+    def __init__(self, parent=None):
+
+        super().__init__(parent)
+        self.files = []
+        self.labels = []
+        # rows are checked when added. Keeping the checked rows in a set keeps queries O(selected)
+        self.checkedRows = set()
+
+    def rowCount(self, parent=QModelIndex()):
+
+        return 0 if parent.isValid() else len(self.files)
+
+    def columnCount(self, parent=QModelIndex()):
+
+        return 0 if parent.isValid() else len(self.columns)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.columns[section]
+        return QVariant()
+
+    def data(self, index, role=Qt.DisplayRole):
+
+        if not index.isValid():
+            return QVariant()
+        row, column = index.row(), index.column()
+        if column == 0:
+            if role == Qt.DisplayRole:
+                return getShortenedPath(self.files[row])
+            if role == Qt.ToolTipRole:
+                return self.files[row]
+            if role == Qt.CheckStateRole:
+                return Qt.Checked if row in self.checkedRows else Qt.Unchecked
+        elif role in (Qt.DisplayRole, Qt.EditRole):
+            return self.labels[row]
+        return QVariant()
+
+    def setData(self, index, value, role=Qt.EditRole):
+
+        if not index.isValid():
+            return False
+        row, column = index.row(), index.column()
+        if column == 0 and role == Qt.CheckStateRole:
+            if value == Qt.Checked:
+                self.checkedRows.add(row)
+            else:
+                self.checkedRows.discard(row)
+        elif column == 1 and role == Qt.EditRole:
+            self.labels[row] = str(value)
+        else:
+            return False
+        self.dataChanged.emit(index, index, [role])
+        return True
+
+    def flags(self, index):
+
+        if not index.isValid():
+            return Qt.NoItemFlags
+        if index.column() == 0:
+            return Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsUserCheckable
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsEditable
+
+    def appendFiles(self, files: list):
+
+        nRows = len(self.files)
+        self.beginInsertRows(QModelIndex(), nRows, nRows + len(files) - 1)
+        self.files.extend(files)
+        self.labels.extend('File{}'.format(ind + 1) for ind in range(nRows, nRows + len(files)))
+        self.checkedRows.update(range(nRows, nRows + len(files)))
+        self.endInsertRows()
+
+    def clear(self):
+
+        self.beginResetModel()
+        self.files = []
+        self.labels = []
+        self.checkedRows = set()
+        self.endResetModel()
+
+    def checkedFilesLabels(self) -> tuple:
+
+        checkedRows = sorted(self.checkedRows)
+        return [self.files[x] for x in checkedRows], [self.labels[x] for x in checkedRows]
+
 class SegQualityMetricsThread(QThread):
 
-    def __init__(self, testLabelImageFiles: list,
-                 gtLabelImageFile: str, testLabels: list, outputDir: str):
+    # index of the test file, its label and (nFP, nTP, nFN, nNoiseFP, nNonNoiseFP)
+    resultReady = pyqtSignal(int, str, list)
+    progress = pyqtSignal(int, int)
+    failed = pyqtSignal(str)
+
+    def __init__(self):
+
+        self.testLabelImageFiles = []
+        self.gtLabelImageFile = None
+        self.testLabels = []
+        self.outputDir = None
+        self.nFinished = 0
+
+        super().__init__()
+
+    def setJob(self, testLabelImageFiles: list, gtLabelImageFile: str, testLabels: list, outputDir: str):
+
         self.testLabelImageFiles = testLabelImageFiles
         self.gtLabelImageFile = gtLabelImageFile
         self.testLabels = testLabels
         self.outputDir = outputDir
-        self.terminated = False
 
-        super().__init__()
+    def emitResult(self, ind: int, errors: tuple):
+
+        self.nFinished += 1
+        self.resultReady.emit(ind, self.testLabels[ind], list(errors))
+        self.progress.emit(self.nFinished, len(self.testLabelImageFiles))
 
     def run(self):
-        saveResultsTestList(testLabelImageFiles=self.testLabelImageFiles,
+
+        self.nFinished = 0
+        self.progress.emit(0, len(self.testLabelImageFiles))
+
+        # test files are compared on a pool of processes. An interruption is checked between files, so that
+        # files being processed are completed and everything finished is kept in the output folder
+        try:
+            memoryBytes = physicalMemoryBytes()
+            nWorkers = boundedWorkerCount(self.gtLabelImageFile, None, min(os.cpu_count() or 1, maxGUIWorkers),
+                                          None if memoryBytes is None else memoryBytes // 2)
+            saveResultsTestList(testLabelImageFiles=self.testLabelImageFiles,
                                 groundTruthLabelImagFile=self.gtLabelImageFile,
                                 outputDir=self.outputDir,
                                 labels=self.testLabels,
-                                saveDebugInfo=True)
+                                saveDebugInfo=True,
+                                nWorkers=nWorkers,
+                                excelExport=True,
+                                reportMode='background',
+                                onResult=self.emitResult,
+                                shouldStop=self.isInterruptionRequested)
+        except Exception as e:
+            self.failed.emit(str(e))
+
 
 
+class PreviewThread(QThread):
+
+    # label of the test file and the result of previewSegQualErrors
+    previewReady = pyqtSignal(str, dict)
+    failed = pyqtSignal(str)
+
+    def __init__(self):
+
+        self.testLabelImageFiles = []
+        self.gtLabelImageFile = None
+        self.testLabels = []
+        self.stride = (2, 2, 2)
+
+        super().__init__()
+
+    def setJob(self, testLabelImageFiles: list, gtLabelImageFile: str, testLabels: list, stride: tuple):
+
+        self.testLabelImageFiles = testLabelImageFiles
+        self.gtLabelImageFile = gtLabelImageFile
+        self.testLabels = testLabels
+        self.stride = stride
+
+    def run(self):
+
+        try:
+            for testLabelImageFile, testLabel in zip(self.testLabelImageFiles, self.testLabels):
+                if self.isInterruptionRequested():
+                    break
+                self.previewReady.emit(testLabel, previewSegQualErrors(testLabelImageFile, self.gtLabelImageFile,
+                                                                       stride=self.stride))
+        except Exception as e:
+            self.failed.emit(str(e))
 
 
 class CentralWidget(QWidget):
     startCalcSig = pyqtSignal(list, str, list, str)
 
+    resultColumns = ['Label', 'Recall', 'Precision', 'fMeasure', 'Accuracy', 'nTP', 'nFP', 'nFN']
+
     def __init__(self, parent):
         super().__init__(parent)
         self.initui()
-        self.calcThread = SegQualityMetricsThread(None, None, None, None)
+        self.sqmFailed = False
+        # QThread clears its interruption request when it finishes, so interruptions are remembered here
+        self.calcInterrupted = False
+
+        # signals are connected once here, not on every run
+        self.calcThread = SegQualityMetricsThread()
+        self.calcThread.resultReady.connect(self.addResult)
+        self.calcThread.progress.connect(self.updateProgress)
+        self.calcThread.failed.connect(self.handleSQMFailed)
+        self.calcThread.finished.connect(self.handleSQMFinished)
+        self.interruptButton.clicked.connect(self.interruptCalc)
+
+        self.previewThread = PreviewThread()
+        self.previewThread.previewReady.connect(self.showPreview)
+        self.previewThread.failed.connect(self.handleSQMFailed)
 
 
     def initui(self):
@@ -89,14 +319,18 @@ class CentralWidget(QWidget):
         refreshButton = QPushButton('Load Tiff Files in TestFolder')
         refreshButton.clicked.connect(self.loadTiffs)
 
-        self.tiffFiles = []
-
         tableActionButtons.addWidget(refreshButton)
 
-        self.tiffTable = QTableWidget()
-        self.loadTable()
+        self.tiffTableModel = TiffFileTableModel(self)
+        self.tiffTable = QTableView()
+        self.tiffTable.setModel(self.tiffTableModel)
         mainVBox.addWidget(self.tiffTable)
 
+        # test folders are scanned in the background, files show up in the table in batches
+        self.dirScanThread = DirScanThread()
+        self.dirScanThread.batchFound.connect(self.addScannedFiles)
+        self.dirScanThread.finished.connect(self.tiffTable.resizeColumnsToContents)
+
         self.opDirSelect = DirSelect(title='Output Folder',
                                parent=self,
                                dialogTitle='Choose folder OutputFolder',
@@ -111,9 +345,18 @@ class CentralWidget(QWidget):
         startButton.clicked.connect(self.runSegQualMetrics)
 
         self.interruptButton = QPushButton('Interrupt')
+        self.interruptButton.setEnabled(False)
+
+        # approximate metrics from stacks sampled with a stride, e.g. while tuning segmentation parameters
+        previewButton = QPushButton('Preview')
+        previewButton.clicked.connect(self.runPreview)
+        self.previewStride = QLineEdit('2,2,2', self)
+        self.previewStride.setToolTip('Sampling stride along Z,Y,X used by Preview')
 
         runControlBox.addWidget(startButton)
         runControlBox.addWidget(self.interruptButton)
+        runControlBox.addWidget(previewButton)
+        runControlBox.addWidget(self.previewStride)
 
         self.outputDisplay = QTextEdit()
         self.outputDisplay.setReadOnly(True)
@@ -124,6 +367,13 @@ class CentralWidget(QWidget):
 
         mainVBox.addWidget(runGroupBox)
 
+        self.progressBar = QProgressBar(self)
+        mainVBox.addWidget(self.progressBar)
+
+        self.resultsTable = QTableWidget(0, len(self.resultColumns), self)
+        self.resultsTable.setHorizontalHeaderLabels(self.resultColumns)
+        mainVBox.addWidget(self.resultsTable)
+
         self.setLayout(mainVBox)
 
     def initSegQualPy(self):
@@ -134,15 +384,7 @@ class CentralWidget(QWidget):
 
     def getcheckedTiffList(self):
 
-        checkedTiffFiles = []
-        checkedTiffFileLabels = []
-        for rowInd in range(self.tiffTable.rowCount()):
-            item = self.tiffTable.cellWidget(rowInd, 0)
-            label = self.tiffTable.cellWidget(rowInd, 1).text()
-            if item.isChecked():
-                checkedTiffFiles.append(self.tiffFiles[rowInd])
-                checkedTiffFileLabels.append(label)
-        return checkedTiffFiles, checkedTiffFileLabels
+        return self.tiffTableModel.checkedFilesLabels()
 
     def runSegQualMetrics(self):
 
@@ -157,65 +399,112 @@ class CentralWidget(QWidget):
 
         if reply == QMessageBox.Yes:
 
-            self.calcThread.__init__(checkedTiffFiles,
+            if self.calcThread.isRunning():
+                raiseInfo('A calculation is already running. Please wait for it to finish or interrupt it.', self)
+                return
+
+            self.calcThread.setJob(checkedTiffFiles,
                                    gtLabelImage,
                                    checkedTiffFileLabels,
                                    outputDir)
-            try:
-                self.calcThread.start()
-                self.outputDisplay.append('Calculating metrics for:\n{}\nPlease Wait. The program may take '
-                                          'a few minutes to finish......'.format(currentData))
-            except Exception as e:
-                self.outputDisplay.append('The Program has encoutered an error. Here is the error message:\n'
-                                          '{}'.format(str(e)))
-                self.calcThread.terminated
-            self.interruptButton.clicked.connect(self.termicateCalc)
-            self.calcThread.finished.connect(self.handleSQMFinished)
-
-    def termicateCalc(self):
-        self.calcThread.terminated = True
-        self.calcThread.terminate()
-        self.calcThread.wait()
+            self.resultsTable.setRowCount(0)
+            self.sqmFailed = False
+            self.calcInterrupted = False
+            self.calcThread.start()
+            self.interruptButton.setEnabled(True)
+            self.outputDisplay.append('Calculating metrics for:\n{}\nResults are shown below as each test '
+                                      'image is finished......'.format(currentData))
+
+    def runPreview(self):
+
+        if self.previewThread.isRunning():
+            raiseInfo('A preview is already running. Please wait for it to finish.', self)
+            return
+
+        try:
+            stride = tuple(int(x) for x in self.previewStride.text().split(','))
+            assert len(stride) == 3 and min(stride) >= 1
+        except (ValueError, AssertionError):
+            raiseInfo('Invalid preview stride {}. Please enter three positive integers, '
+                      'e.g. 2,2,2'.format(self.previewStride.text()), self)
+            return
+
+        checkedTiffFiles, checkedTiffFileLabels = self.getcheckedTiffList()
+        self.previewThread.setJob(checkedTiffFiles, self.gtLabelImageSelect.getText(), checkedTiffFileLabels,
+                                  stride)
+        self.previewThread.start()
+        self.outputDisplay.append('Previewing metrics with stride {}......'.format(stride))
 
+    def showPreview(self, label: str, preview: dict):
+
+        metrics = ['{}={:.3f} (spread {:.3f})'.format(x, y, preview['metricSpreads'][x])
+                   for x, y in preview['metrics'].items()]
+        self.outputDisplay.append('Preview {}: {}'.format(label, ', '.join(metrics)))
+
+    def interruptCalc(self):
+
+        # cooperative: the thread stops after the files being processed, which are kept
+        self.calcInterrupted = True
+        self.calcThread.requestInterruption()
+        self.interruptButton.setEnabled(False)
+        self.outputDisplay.append('Interrupting. Waiting for the test images being processed to finish......')
+
+    def addResult(self, ind: int, label: str, errors: list):
+
+        nFP, nTP, nFN, nNoiseFP, nNonNoiseFP = errors
+        recall, precision, fMeasure, accuracy = getMetricsFromCounts(nFP, nTP, nFN)
+
+        rowInd = self.resultsTable.rowCount()
+        self.resultsTable.insertRow(rowInd)
+        values = [label] + ['{:.3f}'.format(x) for x in (recall, precision, fMeasure, accuracy)] + \
+                 [str(x) for x in (nTP, nFP, nFN)]
+        for colInd, value in enumerate(values):
+            self.resultsTable.setItem(rowInd, colInd, QTableWidgetItem(value))
+        self.resultsTable.resizeColumnsToContents()
+
+    def updateProgress(self, nFinished: int, nTotal: int):
+
+        self.progressBar.setMaximum(nTotal)
+        self.progressBar.setValue(nFinished)
+
+    def handleSQMFailed(self, message: str):
+
+        self.sqmFailed = True
+        self.outputDisplay.append('The Program has encoutered an error. Here is the error message:\n'
+                                  '{}'.format(message))
 
     def handleSQMFinished(self):
 
-        if self.calcThread.terminated:
-            self.outputDisplay.append('Calculation Terminated. No Output generated.')
+        self.interruptButton.setEnabled(False)
+        if self.sqmFailed:
+            return
+        if self.calcInterrupted:
+            self.outputDisplay.append('Calculation Interrupted. Metrics of the {} finished test images written '
+                                      'into {}'.format(self.calcThread.nFinished, self.opDirSelect.getText()))
         else:
             self.outputDisplay.append('Finished Succesfully. '
                                           'Metrics written into {}'.format(self.opDirSelect.getText()))
 
+    def addScannedFiles(self, scanId: int, files: list):
+
+        if scanId == self.dirScanThread.scanId:
+            self.tiffTableModel.appendFiles(files)
+
     def loadTiffs(self):
 
         testFolder = self.testFolder.getText()
 
         if not os.path.isdir(testFolder):
             raiseInfo('Invalid Test Folder: {}'.format(testFolder), self)
-        else:
-            self.tiffFiles = getAllFilesInTree(testFolder, '.tif')
-
-        self.loadTable()
-
-
-    def loadTable(self):
-
-        self.tiffTable.setRowCount(len(self.tiffFiles))
-        self.tiffTable.setColumnCount(2)
-        self.tiffTable.setHorizontalHeaderLabels(['Tiff File', 'Label'])
+            return
 
-        for ind, tifffile in enumerate(self.tiffFiles):
+        # a scan still running for a previously chosen folder is stopped first
+        self.dirScanThread.requestInterruption()
+        self.dirScanThread.wait()
+        self.tiffTableModel.clear()
 
-            shortenedTiffFilePath = getShortenedPath(tifffile)
-            checkBox = QCheckBox(shortenedTiffFilePath, self)
-            checkBox.setChecked(1)
-            self.tiffTable.setCellWidget(ind, 0, checkBox)
-
-            label = QLineEdit(self)
-            label.setText('File{}'.format(ind + 1))
-            self.tiffTable.setCellWidget(ind, 1, label)
-
-        self.tiffTable.resizeColumnsToContents()
+        self.dirScanThread.setDir(testFolder, '.tif')
+        self.dirScanThread.start()
 
 
 
@@ -255,19 +544,18 @@ class MainWindow(QMainWindow):
 
     def initAppHome(self):
 
-        system = platform.system()
-        userHome = os.path.expanduser('~')
-
-        if system == 'Windows':
-            self.appDataHome = os.path.join(userHome, 'AppData', 'Local', 'TanimotoLabCellSeg')
-        elif system == 'Linux':
-            self.appDataHome = os.path.join(userHome, '.TanimotoLabCellSeg')
-        else:
+        try:
+            self.appDataHome = getAppDataHome()
+        except OSError as e:
             raiseInfo('We are sorry, but we do not support your operating system {}.'
-                      'We currently support only Windows and Linux.'.format(system), self)
+                      'We currently support only Windows and Linux.'.format(platform.system()), self)
+            raise e
         if not os.path.isdir(self.appDataHome):
             os.mkdir(self.appDataHome)
 
+        # features of label images are reused across runs, as long as the images do not change
+        setDefaultFeatureCache(FeatureCache(os.path.join(self.appDataHome, 'featureCache')))
+
     def center(self):
         qr = self.frameGeometry()
         cp = QDesktopWidget().availableGeometry().center()
@@ -279,7 +567,7 @@ class MainWindow(QMainWindow):
         centralWidget = self.centralWidget()
         threadRunning = centralWidget.calcThread.isRunning()
         if threadRunning:
-            msg = "The program is running a job. Close it and quit?"
+            msg = "The program is running a job. Quit after the test images being processed are finished?"
         else:
             msg = "Are you sure to quit?"
         reply = QMessageBox.question(self, 'Message',
@@ -288,13 +576,17 @@ class MainWindow(QMainWindow):
 
         if reply == QMessageBox.Yes:
             if threadRunning:
-                centralWidget.calcThread.terminate()
-                centralWidget.wait()
+                centralWidget.calcThread.requestInterruption()
+                centralWidget.calcThread.wait()
+            centralWidget.previewThread.requestInterruption()
+            centralWidget.previewThread.wait()
             event.accept()
         else:
             event.ignore()
 
 if __name__ == '__main__':
+    # the worker processes of the calculation need this in the frozen application
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     ex = MainWindow()
     sys.exit(app.exec_())
\ No newline at end of file
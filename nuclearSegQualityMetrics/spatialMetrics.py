@@ -0,0 +1,67 @@
+import typing
+
+import numpy as np
+
+tileCountNames = ('nGT', 'nTest', 'nTP', 'nFP', 'nFN', 'nNoiseFP')
+tileMetricNames = ('Recall', 'Precision', 'fMeasure')
+
+
+def normalizeTileGrid(tileGrid: typing.Union[int, typing.Iterable[int]]) -> tuple:
+
+    # a single number is the number of z slabs, the tiles span whole planes
+    if np.isscalar(tileGrid):
+        tileGrid = (tileGrid, 1, 1)
+    tileGrid = tuple(int(x) for x in tileGrid)
+    assert len(tileGrid) == 3 and min(tileGrid) >= 1, \
+        'tileGrid must be a number of tiles along z, y and x, each at least 1, got {}'.format(tileGrid)
+
+    return tileGrid
+
+
+def tileIndices(centroids: np.ndarray, shape: tuple, tileGrid: tuple) -> np.ndarray:
+
+    # flat index of the tile of each centroid, tiles split the stack into equal parts along each axis
+    centroids = np.asarray(centroids, dtype=np.float64).reshape(-1, 3)
+    tileGrid = np.array(tileGrid, dtype=np.intp)
+    multiInds = np.floor(centroids * (tileGrid / np.asarray(shape, dtype=np.float64))).astype(np.intp)
+    np.clip(multiInds, 0, tileGrid - 1, out=multiInds)
+
+    return np.ravel_multi_index(tuple(multiInds.T), tuple(tileGrid))
+
+
+def tileCounts(gtCentroids: np.ndarray, gtTPMask: np.ndarray, testCentroids: np.ndarray, testTPMask: np.ndarray,
+               testNoiseFPMask: np.ndarray, shape: tuple, tileGrid: typing.Union[int, typing.Iterable[int]]) -> dict:
+
+    tileGrid = normalizeTileGrid(tileGrid)
+    nTiles = int(np.prod(tileGrid))
+
+    # one pass over the classified centroids. gt nuclei count towards recall, test nuclei towards precision,
+    # each in the tile of its own centroid
+    gtTiles = tileIndices(gtCentroids, shape, tileGrid)
+    testTiles = tileIndices(testCentroids, shape, tileGrid)
+
+    counts = {'nGT': np.bincount(gtTiles, minlength=nTiles),
+              'nTest': np.bincount(testTiles, minlength=nTiles),
+              'nTP': np.bincount(testTiles, weights=testTPMask, minlength=nTiles).astype(np.int64),
+              'nNoiseFP': np.bincount(testTiles, weights=testNoiseFPMask, minlength=nTiles).astype(np.int64)}
+    gtTP = np.bincount(gtTiles, weights=gtTPMask, minlength=nTiles)
+    counts['nFP'] = counts['nTest'] - counts['nTP']
+    counts['nFN'] = counts['nGT'] - gtTP.astype(np.int64)
+
+    return tileMetricsFromCounts({x: y.reshape(tileGrid) for x, y in counts.items()})
+
+
+def tileMetricsFromCounts(tileCounts: dict) -> dict:
+
+    # the counts may be nested lists, as stored in the run manifest
+    tileMetrics = {x: np.asarray(tileCounts[x], dtype=np.int64) for x in tileCountNames}
+
+    # tiles without gt or test nuclei have no recall or precision
+    with np.errstate(divide='ignore', invalid='ignore'):
+        recall = (tileMetrics['nGT'] - tileMetrics['nFN']) / tileMetrics['nGT']
+        precision = tileMetrics['nTP'] / tileMetrics['nTest']
+        fMeasure = 2 * recall * precision / (recall + precision)
+
+    tileMetrics.update({'Recall': recall, 'Precision': precision, 'fMeasure': fMeasure})
+
+    return tileMetrics
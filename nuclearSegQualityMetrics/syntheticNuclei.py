@@ -0,0 +1,86 @@
+import os
+import typing
+
+import numpy as np
+import tifffile
+
+
+def paintSphere(labelImage: np.ndarray, center: np.ndarray, radius: float, label: int):
+
+    lower = np.maximum(np.floor(center - radius).astype(int), 0)
+    upper = np.minimum(np.ceil(center + radius).astype(int) + 1, labelImage.shape)
+
+    zz, yy, xx = np.ogrid[lower[0]: upper[0], lower[1]: upper[1], lower[2]: upper[2]]
+    sphereMask = (zz - center[0]) ** 2 + (yy - center[1]) ** 2 + (xx - center[2]) ** 2 <= radius ** 2
+    labelImage[lower[0]: upper[0], lower[1]: upper[1], lower[2]: upper[2]][sphereMask] = label
+
+
+def makeSyntheticLabelPair(shape: tuple = (64, 256, 256), nNuclei: int = 200,
+                           radiusMean: float = 4.0, radiusStd: float = 0.5,
+                           missedRate: float = 0.1, spuriousRate: float = 0.1, displacedRate: float = 0.05,
+                           seed: typing.Union[None, int] = None) -> tuple:
+
+    rng = np.random.RandomState(seed)
+    minRadius = 2.5
+    maxRadius = max(radiusMean + 3 * radiusStd, minRadius)
+
+    # every nucleus sits in its own cubic cell, large enough that even when it is displaced by 1.5 radii
+    # it neither touches the nuclei of the neighbouring cells nor has its centroid in their spheres
+    cellSize = int(np.ceil(4 * maxRadius)) + 1
+    gridShape = tuple(x // cellSize for x in shape)
+    nCells = int(np.prod(gridShape))
+
+    nSpurious = int(round(spuriousRate * nNuclei))
+    assert nNuclei + nSpurious <= nCells, \
+        'A volume of shape {} holds at most {} nuclei of radius up to {:.1f}, asked for {} ' \
+        '(including spurious ones)'.format(shape, nCells, maxRadius, nNuclei + nSpurious)
+
+    cellInds = rng.permutation(nCells)[:nNuclei + nSpurious]
+    cellCenters = (np.stack(np.unravel_index(cellInds, gridShape), axis=1) + 0.5) * cellSize
+    radii = np.clip(rng.normal(radiusMean, radiusStd, size=nNuclei + nSpurious), minRadius, maxRadius)
+
+    nucleusFate = rng.choice(['found', 'missed', 'displaced'], size=nNuclei,
+                             p=[1 - missedRate - displacedRate, missedRate, displacedRate])
+
+    # found nuclei are jittered within a third of their radius, displaced ones moved by 1.5 radii
+    directions = rng.normal(size=(nNuclei + nSpurious, 3))
+    directions /= np.linalg.norm(directions, axis=1)[:, np.newaxis]
+    offsets = directions * radii[:, np.newaxis] * rng.uniform(0, 0.3, size=(nNuclei + nSpurious, 1))
+    displacedMask = np.concatenate([nucleusFate == 'displaced', np.zeros(nSpurious, dtype=bool)])
+    offsets[displacedMask] = directions[displacedMask] * 1.5 * radii[displacedMask, np.newaxis]
+
+    gtLabelImage = np.zeros(shape, dtype=np.uint16)
+    testLabelImage = np.zeros(shape, dtype=np.uint16)
+
+    gtLabelValues = rng.permutation(nNuclei) + 1
+    testLabelValues = rng.permutation(nNuclei + nSpurious) + 1
+
+    for ind in range(nNuclei):
+        paintSphere(gtLabelImage, cellCenters[ind], radii[ind], gtLabelValues[ind])
+
+    for ind in range(nNuclei + nSpurious):
+        if ind < nNuclei and nucleusFate[ind] == 'missed':
+            continue
+        paintSphere(testLabelImage, cellCenters[ind] + offsets[ind], radii[ind], testLabelValues[ind])
+
+    nFound = int(np.sum(nucleusFate == 'found'))
+    nMissed = int(np.sum(nucleusFate == 'missed'))
+    nDisplaced = int(np.sum(nucleusFate == 'displaced'))
+
+    # displaced and spurious nuclei lie outside every gt sphere, so all FPs are noise
+    expected = {'nTP': nFound, 'nFN': nMissed + nDisplaced, 'nFP': nDisplaced + nSpurious,
+                'nNoiseFP': nDisplaced + nSpurious, 'nNonNoiseFP': 0}
+
+    return gtLabelImage, testLabelImage, expected
+
+
+def writeSyntheticLabelPair(outputDir: str, stem: str = 'synthetic', **kwargs) -> tuple:
+
+    gtLabelImage, testLabelImage, expected = makeSyntheticLabelPair(**kwargs)
+
+    gtLabelImageFile = os.path.join(outputDir, '{}_gt.tif'.format(stem))
+    testLabelImageFile = os.path.join(outputDir, '{}_test.tif'.format(stem))
+    tifffile.imwrite(gtLabelImageFile, gtLabelImage)
+    tifffile.imwrite(testLabelImageFile, testLabelImage)
+
+    return gtLabelImageFile, testLabelImageFile, expected
@@ -0,0 +1,440 @@
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import tempfile
+import threading
+import time
+import traceback
+import typing
+
+import numpy as np
+
+from nuclearSegQualityMetrics.SegmentationQualityMetrics import GroundTruthFeatures, segQualErrors, \
+    segQualErrorsTiles, saveResultsTestList, resultsManifestOptions, reportModes
+from nuclearSegQualityMetrics.featureCache import FeatureCache, getDefaultFeatureCache, openFeatureCache, \
+    setDefaultFeatureCache
+from nuclearSegQualityMetrics.runManifest import RunManifest
+from nuclearSegQualityMetrics.spatialMetrics import tileCountNames
+
+# A queue is a folder on a filesystem shared by all the nodes. Tasks are json files in 'pending', a worker claims
+# one by renaming it into 'claimed' with its worker id in the name, which only one worker can succeed at, and
+# replaces the claim by a file in 'results' or 'failed' when done. Every worker touches its file in 'workers'
+# while it is running, claims of workers whose file is missing or stale are moved back to 'pending'
+queueSubDirs = ('pending', 'claimed', 'results', 'failed', 'workers')
+
+
+def defaultWorkerId() -> str:
+
+    return '{}-{}'.format(socket.gethostname(), os.getpid())
+
+
+def _writeJSON(filePath: str, obj: dict):
+
+    # written to a temporary file first, so that other nodes never see a partial file
+    fd, tempFile = tempfile.mkstemp(dir=os.path.dirname(filePath), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as fle:
+            json.dump(obj, fle)
+            fle.flush()
+            os.fsync(fle.fileno())
+        os.replace(tempFile, filePath)
+    except BaseException:
+        os.remove(tempFile)
+        raise
+
+
+def _readJSON(filePath: str) -> typing.Union[None, dict]:
+
+    try:
+        with open(filePath) as fle:
+            return json.load(fle)
+    except (OSError, ValueError):
+        return None
+
+
+class WorkQueue(object):
+
+    def __init__(self, queueDir: str):
+
+        self.queueDir = queueDir
+        for subDir in queueSubDirs:
+            os.makedirs(os.path.join(queueDir, subDir), exist_ok=True)
+
+    def _path(self, subDir: str, fileName: str = '') -> str:
+
+        return os.path.join(self.queueDir, subDir, fileName)
+
+    def _listTasks(self, subDir: str) -> typing.List[str]:
+
+        return sorted(x for x in os.listdir(self._path(subDir)) if x.endswith('.json'))
+
+    @staticmethod
+    def _claimTaskId(claimFileName: str) -> tuple:
+
+        # claims are named <taskId>@<workerId>.json
+        taskId, workerId = claimFileName[:-len('.json')].split('@', 1)
+        return taskId, workerId
+
+    def job(self) -> dict:
+
+        job = _readJSON(os.path.join(self.queueDir, 'job.json'))
+        assert job is not None, 'No job submitted to the work queue {}'.format(self.queueDir)
+        return job
+
+    def submit(self, testLabelImageFiles: typing.Iterable[str], groundTruthLabelImageFile: str, outputDir: str,
+               labels: typing.Iterable[str], saveDebugInfo: bool = False, slabSize: typing.Union[None, int] = None,
+               tableFormat: str = 'csv', matching: str = 'centroid', iouThreshold: float = 0.5,
+               assignment: str = 'greedy', resume: bool = False,
+               tileGrid: typing.Union[None, int, typing.Iterable[int]] = None, fillHoles: bool = True) -> int:
+
+        assert len(labels) == len(testLabelImageFiles), 'Number of elements in labels ' \
+                                                        'and testLabelImageFiles are not equal'
+
+        # paths are made absolute, workers may run in other folders
+        job = {'testLabelImageFiles': [os.path.abspath(x) for x in testLabelImageFiles],
+               'groundTruthLabelImageFile': os.path.abspath(groundTruthLabelImageFile),
+               'outputDir': os.path.abspath(outputDir), 'labels': list(labels), 'slabSize': slabSize,
+               'options': resultsManifestOptions(saveDebugInfo=saveDebugInfo, tableFormat=tableFormat,
+                                                 matching=matching, iouThreshold=iouThreshold,
+                                                 assignment=assignment, tileGrid=tileGrid,
+                                                 fillHoles=fillHoles)}
+        # a queue holds one job, submitting it again queues the tasks that have no result yet
+        oldJob = _readJSON(os.path.join(self.queueDir, 'job.json'))
+        assert oldJob is None or oldJob == job, 'The work queue {} holds another job'.format(self.queueDir)
+        os.makedirs(job['outputDir'], exist_ok=True)
+        _writeJSON(os.path.join(self.queueDir, 'job.json'), job)
+
+        # with resume, pairs finished by an earlier run into the same output folder, or by an earlier submission
+        # to this queue, are not queued again. Without it, the manifest and the queue start over, and the manifest
+        # is filled from the results of this queue by aggregateWorkQueue
+        manifest = RunManifest(job['outputDir'])
+        if resume:
+            finishedEntries = manifest.load()
+        else:
+            manifest.clear()
+            self.clearTasks()
+            finishedEntries = {}
+
+        # results of files changed since they were computed are dropped, their files are queued again
+        for result in self.results():
+            if result.get('pairKey') != RunManifest.pairKey(result['testLabelImageFile'],
+                                                            job['groundTruthLabelImageFile'], job['options']):
+                os.remove(self._path('results', result['taskId'] + '.json'))
+
+        queuedTaskIds = set(x[:-len('.json')] for x in self._listTasks('pending') + self._listTasks('results'))
+        queuedTaskIds.update(self._claimTaskId(x)[0] for x in self._listTasks('claimed'))
+
+        nQueued = 0
+        for ind, (testLabelImageFile, label) in enumerate(zip(job['testLabelImageFiles'], job['labels'])):
+            taskId = '{:06d}'.format(ind)
+            if taskId in queuedTaskIds or RunManifest.pairKey(testLabelImageFile, job['groundTruthLabelImageFile'],
+                                                              job['options']) in finishedEntries:
+                continue
+            # failed tasks get another try
+            if os.path.isfile(self._path('failed', taskId + '.json')):
+                os.remove(self._path('failed', taskId + '.json'))
+            _writeJSON(self._path('pending', taskId + '.json'),
+                       {'taskId': taskId, 'ind': ind, 'testLabelImageFile': testLabelImageFile, 'label': label})
+            nQueued += 1
+
+        return nQueued
+
+    def claim(self, workerId: str) -> typing.Union[None, dict]:
+
+        assert '@' not in workerId, 'Worker ids can not contain @, got {}'.format(workerId)
+
+        for fileName in self._listTasks('pending'):
+            claimFile = self._path('claimed', '{}@{}.json'.format(fileName[:-len('.json')], workerId))
+            # rename is atomic, if another worker was faster the task is not in 'pending' anymore
+            try:
+                os.rename(self._path('pending', fileName), claimFile)
+            except FileNotFoundError:
+                continue
+            task = _readJSON(claimFile)
+            if task is not None:
+                return task
+
+        return None
+
+    def _finish(self, task: dict, workerId: str, subDir: str, result: dict):
+
+        result.update(task)
+        result.update({'workerId': workerId, 'timestamp': time.time()})
+        _writeJSON(self._path(subDir, task['taskId'] + '.json'), result)
+
+        # the claim may have been moved back to 'pending' meanwhile, if this worker was taken for dead
+        try:
+            os.remove(self._path('claimed', '{}@{}.json'.format(task['taskId'], workerId)))
+        except FileNotFoundError:
+            pass
+
+    def complete(self, task: dict, workerId: str, errors: typing.Iterable[int], pairKey: str,
+                 tileMetrics: typing.Union[None, dict] = None):
+
+        # pairKey holds the identities of the files the errors were computed from
+        result = {'errors': [int(x) for x in errors], 'pairKey': pairKey}
+        if tileMetrics is not None:
+            result['tileCounts'] = {x: np.asarray(tileMetrics[x]).tolist() for x in tileCountNames}
+        self._finish(task, workerId, 'results', result)
+
+    def fail(self, task: dict, workerId: str, message: str):
+
+        self._finish(task, workerId, 'failed', {'message': message})
+
+    def heartbeat(self, workerId: str):
+
+        heartbeatFile = self._path('workers', workerId)
+        with open(heartbeatFile, 'a'):
+            pass
+        os.utime(heartbeatFile)
+
+    def removeHeartbeat(self, workerId: str):
+
+        try:
+            os.remove(self._path('workers', workerId))
+        except FileNotFoundError:
+            pass
+
+    def reclaimAbandoned(self, heartbeatTimeout: float = 60.0) -> typing.List[str]:
+
+        # heartbeats are compared with the clock of this node, heartbeatTimeout has to be well above the
+        # differences between the clocks of the nodes and the filesystem
+        now = time.time()
+        reclaimedTaskIds = []
+        for fileName in self._listTasks('claimed'):
+            taskId, workerId = self._claimTaskId(fileName)
+            try:
+                if now - os.stat(self._path('workers', workerId)).st_mtime <= heartbeatTimeout:
+                    continue
+            except FileNotFoundError:
+                pass
+
+            if os.path.isfile(self._path('results', taskId + '.json')):
+                target = None
+            else:
+                target = self._path('pending', taskId + '.json')
+            try:
+                if target is None:
+                    os.remove(self._path('claimed', fileName))
+                else:
+                    os.rename(self._path('claimed', fileName), target)
+            except FileNotFoundError:
+                continue
+            reclaimedTaskIds.append(taskId)
+
+        return reclaimedTaskIds
+
+    def status(self) -> dict:
+
+        return {subDir: len(self._listTasks(subDir)) for subDir in ('pending', 'claimed', 'results', 'failed')}
+
+    def isDone(self) -> bool:
+
+        status = self.status()
+        return status['pending'] == 0 and status['claimed'] == 0
+
+    def clearTasks(self):
+
+        for subDir in ('pending', 'claimed', 'results', 'failed'):
+            for fileName in self._listTasks(subDir):
+                try:
+                    os.remove(self._path(subDir, fileName))
+                except FileNotFoundError:
+                    pass
+
+    def results(self, subDir: str = 'results') -> typing.List[dict]:
+
+        results = (_readJSON(self._path(subDir, x)) for x in self._listTasks(subDir))
+        return [x for x in results if x is not None]
+
+
+def runWorker(queueDir: str, workerId: typing.Union[None, str] = None, heartbeatInterval: float = 10.0,
+              heartbeatTimeout: float = 60.0, pollInterval: float = 1.0,
+              shouldStop: typing.Union[None, typing.Callable[[], bool]] = None,
+              featureCache: typing.Union[None, FeatureCache] = None) -> int:
+
+    # workers are spawned, they get the feature cache of their parent, if any, explicitly
+    if featureCache is not None:
+        setDefaultFeatureCache(featureCache)
+
+    queue = WorkQueue(queueDir)
+    if workerId is None:
+        workerId = defaultWorkerId()
+    if shouldStop is None:
+        shouldStop = lambda: False
+
+    # read before the heartbeat starts, so that a worker of a queue without a job leaves nothing behind
+    job = queue.job()
+    options = job['options']
+
+    # the heartbeat is kept by a thread, so that it goes on while a task is computed
+    queue.heartbeat(workerId)
+    stopHeartbeat = threading.Event()
+
+    def beat():
+        while not stopHeartbeat.wait(heartbeatInterval):
+            queue.heartbeat(workerId)
+
+    heartbeatThread = threading.Thread(target=beat, daemon=True)
+    heartbeatThread.start()
+
+    gtFeatures = None
+    nCompleted = 0
+    try:
+        # workers keep polling until no task is pending or claimed, claims of dead workers may be reclaimed
+        while not shouldStop():
+            queue.reclaimAbandoned(heartbeatTimeout)
+            task = queue.claim(workerId)
+            if task is None:
+                if queue.isDone():
+                    break
+                time.sleep(pollInterval)
+                continue
+
+            try:
+                # the identities of the files before they are read
+                pairKey = RunManifest.pairKey(task['testLabelImageFile'], job['groundTruthLabelImageFile'], options)
+                if gtFeatures is None:
+                    gtFeatures = GroundTruthFeatures(job['groundTruthLabelImageFile'], slabSize=job['slabSize'],
+                                                     fillHoles=options.get('fillHoles', True))
+                segQualErrorsKwargs = {'saveDebugInfoTo': job['outputDir'] if options['saveDebugInfo'] else None,
+                                       'slabSize': job['slabSize'], 'tableFormat': options['tableFormat'],
+                                       'matching': options['matching'], 'iouThreshold': options['iouThreshold'],
+                                       'assignment': options['assignment'],
+                                       'fillHoles': options.get('fillHoles', True)}
+                if options.get('tileGrid') is None:
+                    errors = segQualErrors(task['testLabelImageFile'], gtFeatures, **segQualErrorsKwargs)
+                    tileMetrics = None
+                else:
+                    errors, tileMetrics = segQualErrorsTiles(task['testLabelImageFile'], gtFeatures,
+                                                             options['tileGrid'], **segQualErrorsKwargs)
+            except Exception:
+                queue.fail(task, workerId, traceback.format_exc())
+            else:
+                queue.complete(task, workerId, errors, pairKey, tileMetrics=tileMetrics)
+                nCompleted += 1
+    finally:
+        stopHeartbeat.set()
+        heartbeatThread.join()
+        queue.removeHeartbeat(workerId)
+
+    return nCompleted
+
+
+def aggregateWorkQueue(queueDir: str, excelExport: bool = False, reportMode: str = 'sync',
+                       resultsStore: typing.Union[None, str] = None, nBootstrap: int = 2000,
+                       confidenceLevel: float = 0.95) -> 'pandas.DataFrame':
+
+    queue = WorkQueue(queueDir)
+    job = queue.job()
+
+    # results go into the run manifest of the output folder, from which saveResultsTestList writes the usual
+    # tables and reports without recomputing anything
+    manifest = RunManifest(job['outputDir'])
+    finishedEntries = manifest.load()
+    # results of files changed since they were computed are left out, as failed ones
+    for result in queue.results():
+        pairKey = RunManifest.pairKey(result['testLabelImageFile'], job['groundTruthLabelImageFile'],
+                                      job['options'])
+        if result.get('pairKey') == pairKey and pairKey not in finishedEntries:
+            manifest.append(result['testLabelImageFile'], job['groundTruthLabelImageFile'], job['options'],
+                            result['label'], result['errors'], tileCounts=result.get('tileCounts'))
+
+    # pairs without a result, e.g. failed ones, are left out, as by a stopped saveResultsTestList
+    finishedEntries = manifest.load()
+    finishedInds = [ind for ind, x in enumerate(job['testLabelImageFiles'])
+                    if RunManifest.pairKey(x, job['groundTruthLabelImageFile'], job['options']) in finishedEntries]
+
+    options = job['options']
+    return saveResultsTestList([job['testLabelImageFiles'][x] for x in finishedInds],
+                               job['groundTruthLabelImageFile'], job['outputDir'],
+                               [job['labels'][x] for x in finishedInds], saveDebugInfo=options['saveDebugInfo'],
+                               slabSize=job['slabSize'], tableFormat=options['tableFormat'],
+                               excelExport=excelExport, reportMode=reportMode, resume=True,
+                               matching=options['matching'], iouThreshold=options['iouThreshold'],
+                               assignment=options['assignment'], resultsStore=resultsStore,
+                               nBootstrap=nBootstrap, confidenceLevel=confidenceLevel,
+                               tileGrid=options.get('tileGrid'), fillHoles=options.get('fillHoles', True))
+
+
+def saveResultsWorkQueue(testLabelImageFiles: typing.Iterable[str], groundTruthLabelImagFile: str, outputDir: str,
+                         labels: typing.Iterable[str], queueDir: str, saveDebugInfo: bool = False,
+                         slabSize: typing.Union[None, int] = None, tableFormat: str = 'csv',
+                         excelExport: bool = False, reportMode: str = 'sync', resume: bool = False,
+                         matching: str = 'centroid', iouThreshold: float = 0.5, assignment: str = 'greedy',
+                         resultsStore: typing.Union[None, str] = None, nLocalWorkers: int = 0,
+                         heartbeatTimeout: float = 60.0, pollInterval: float = 1.0, nBootstrap: int = 2000,
+                         confidenceLevel: float = 0.95,
+                         tileGrid: typing.Union[None, int, typing.Iterable[int]] = None,
+                         fillHoles: bool = True) -> 'pandas.DataFrame':
+
+    assert reportMode in reportModes, 'Unknown reportMode {}, must be one of {}'.format(reportMode, reportModes)
+
+    queue = WorkQueue(queueDir)
+    queue.submit(testLabelImageFiles, groundTruthLabelImagFile, outputDir, labels, saveDebugInfo=saveDebugInfo,
+                 slabSize=slabSize, tableFormat=tableFormat, matching=matching, iouThreshold=iouThreshold,
+                 assignment=assignment, resume=resume, tileGrid=tileGrid, fillHoles=fillHoles)
+
+    # workers on this node, in addition to those started on other nodes with 'python -m ... worker queueDir'.
+    # Spawned rather than forked, as the worker pools of segQualErrorsTestList
+    context = multiprocessing.get_context('spawn')
+    localWorkers = [context.Process(target=runWorker, args=(queueDir,),
+                                    kwargs={'workerId': '{}-local{}'.format(defaultWorkerId(), ind),
+                                            'heartbeatTimeout': heartbeatTimeout, 'pollInterval': pollInterval,
+                                            'featureCache': getDefaultFeatureCache()})
+                    for ind in range(nLocalWorkers)]
+    for worker in localWorkers:
+        worker.start()
+
+    # the coordinator also reclaims abandoned tasks, in case all workers are gone
+    while not queue.isDone():
+        queue.reclaimAbandoned(heartbeatTimeout)
+        time.sleep(pollInterval)
+
+    for worker in localWorkers:
+        worker.join()
+
+    resDF = aggregateWorkQueue(queueDir, excelExport=excelExport, reportMode=reportMode, resultsStore=resultsStore,
+                               nBootstrap=nBootstrap, confidenceLevel=confidenceLevel)
+
+    # the results of the other tasks are saved by now. Submitting the job again retries the failed ones
+    failedTasks = queue.results('failed')
+    if failedTasks:
+        raise RuntimeError('{} of {} tasks of the work queue {} failed:\n{}'.format(
+            len(failedTasks), len(testLabelImageFiles), queueDir,
+            '\n'.join('{testLabelImageFile} on {workerId}\n{message}'.format(**x) for x in failedTasks)))
+
+    return resDF
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Work on the tasks of a work queue on a shared filesystem, or '
+                                                 'aggregate its results into the usual outputs')
+    parser.add_argument('command', choices=('worker', 'aggregate', 'status'))
+    parser.add_argument('queueDir', help='queue folder, written by segQualMetricsMultiTest.py with a queueDir')
+    parser.add_argument('--nWorkers', type=int, default=1, help='number of worker processes on this node')
+    parser.add_argument('--heartbeatTimeout', type=float, default=60.0,
+                        help='seconds without heartbeat after which the tasks of a worker are reclaimed')
+    parser.add_argument('--featureCacheDir', default=None, help='feature cache folder of this node')
+    parser.add_argument('--noFeatureCache', action='store_true', help='do not use a feature cache')
+    parser.add_argument('--reportMode', default='sync', choices=reportModes, help='reports of aggregate')
+    args = parser.parse_args()
+
+    if args.command == 'worker':
+        featureCache = None if args.noFeatureCache else openFeatureCache(args.featureCacheDir)
+        workers = [multiprocessing.get_context('spawn').Process(
+                       target=runWorker, args=(args.queueDir,),
+                       kwargs={'workerId': '{}-{}'.format(defaultWorkerId(), ind),
+                               'heartbeatTimeout': args.heartbeatTimeout, 'featureCache': featureCache})
+                   for ind in range(args.nWorkers)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    elif args.command == 'aggregate':
+        print(aggregateWorkQueue(args.queueDir, reportMode=args.reportMode))
+    else:
+        print(WorkQueue(args.queueDir).status())
@@ -0,0 +1,23 @@
+import pathlib
+import shutil
+import typing
+
+from nuclearSegQualityMetrics.folderDefs import testFilesPath
+
+# the ground truth and farsight label images most tests compare, and the errors they give:
+# nFP, nTP, nFN, nNoiseFP, nNonNoiseFP
+testDir = testFilesPath / "CountingResults" / "test2"
+gtLabelImageFile = str(testDir / "GT_8bit.tif")
+testLabelImageFile = str(testDir / "farsight_label_croped.tif")
+expectedErrors = (40, 113, 8, 29, 11)
+
+
+def copyTestLabelImageFiles(outputDir: pathlib.Path, nFiles: int) -> typing.List[str]:
+
+    # copies of the test label image, files of their own identity, e.g. for the run manifest or a work queue
+    testLabelImageFiles = []
+    for ind in range(nFiles):
+        testLabelImageFiles.append(str(outputDir / 'test{}.tif'.format(ind)))
+        shutil.copy(testLabelImageFile, testLabelImageFiles[-1])
+
+    return testLabelImageFiles
@@ -0,0 +1,93 @@
+import pathlib
+import tempfile
+
+import pandas as pd
+
+from nuclearSegQualityMetrics.batchJobs import runBatchJobSpec, normalizeBatchJobSpec, MemoryBudget, \
+    boundedWorkerCount
+from nuclearSegQualityMetrics.instrumentation import addInstrumentationHook, removeInstrumentationHook
+from nuclearSegQualityMetrics.syntheticNuclei import writeSyntheticLabelPair
+
+from labelImageFixtures import gtLabelImageFile, testLabelImageFile
+
+
+def testNormalizeBatchJobSpec():
+
+    spec = normalizeBatchJobSpec({'outputDir': 'out', 'options': {'nWorkers': 2, 'nGroupWorkers': 3},
+                                  'groups': [{'gtLabelImageFile': 'gt.tif', 'testLabelImageFiles': ['t.tif'],
+                                              'testImageFileLabels': ['t'], 'options': {'nWorkers': 4}},
+                                             {'name': 'b', 'outputDir': 'bOut', 'gtLabelImageFile': 'gt.tif',
+                                              'testLabelImageFiles': [], 'testImageFileLabels': []}]})
+
+    assert [x['name'] for x in spec['groups']] == ['group0', 'b']
+    assert [x['outputDir'] for x in spec['groups']] == [str(pathlib.Path('out', 'group0')),
+                                                        str(pathlib.Path('out', 'bOut'))]
+    assert [x['options']['nWorkers'] for x in spec['groups']] == [4, 2]
+    assert 'nGroupWorkers' not in spec['groups'][0]['options']
+
+
+def testMemoryBudget():
+
+    memoryBudget = MemoryBudget(10)
+    memoryBudget.acquire(20)
+    memoryBudget.release(20)
+    memoryBudget.acquire(4)
+    memoryBudget.acquire(6)
+    assert memoryBudget.usedBytes == 10
+
+
+def testBoundedWorkerCount():
+
+    # the 8 bit gt stack is 20 x 40 x 40 voxels, 32000 bytes
+    assert boundedWorkerCount(gtLabelImageFile, None, 8, None) == 8
+    assert boundedWorkerCount(gtLabelImageFile, None, 8, 32000 * 4) == 3
+    assert boundedWorkerCount(gtLabelImageFile, 5, 8, 32000 * 4) == 8
+    assert boundedWorkerCount(gtLabelImageFile, None, 8, 1000) == 1
+
+
+def testRunBatchJobSpec(tmp_path):
+
+    syntheticGTFile, syntheticTestFile, expected = writeSyntheticLabelPair(
+        str(tmp_path), shape=(32, 96, 96), nNuclei=20, radiusMean=3, radiusStd=0.3, seed=1)
+
+    spec = {'outputDir': str(tmp_path / 'output'), 'options': {'nGroupWorkers': 2, 'reportMode': 'skip'},
+            'groups': [{'name': 'embryo1', 'gtLabelImageFile': gtLabelImageFile,
+                        'testLabelImageFiles': [testLabelImageFile], 'testImageFileLabels': ['farsight']},
+                       {'name': 'synthetic', 'gtLabelImageFile': syntheticGTFile,
+                        'testLabelImageFiles': [syntheticTestFile], 'testImageFileLabels': ['synthetic']},
+                       {'name': 'embryo1Again', 'gtLabelImageFile': gtLabelImageFile,
+                        'testLabelImageFiles': [testLabelImageFile], 'testImageFileLabels': ['farsight'],
+                        'options': {'saveDebugInfo': False}},
+                       {'name': 'embryo1Slabs', 'gtLabelImageFile': gtLabelImageFile,
+                        'testLabelImageFiles': [testLabelImageFile], 'testImageFileLabels': ['farsight'],
+                        'options': {'slabSize': 4}}]}
+
+    records = []
+    addInstrumentationHook(records.append)
+    try:
+        summaryDF = runBatchJobSpec(spec)
+    finally:
+        removeInstrumentationHook(records.append)
+
+    # each ground truth is measured once per slabSize, also when several groups use it
+    assert sum(x['kind'] == 'groundTruthFeatures' for x in records) == 3
+
+    assert sorted(summaryDF['group']) == ['embryo1', 'embryo1Again', 'embryo1Slabs', 'synthetic']
+    summaryDF = summaryDF.set_index('group')
+    assert summaryDF.loc['embryo1', 'nTP'] == summaryDF.loc['embryo1Again', 'nTP'] == 113
+    assert summaryDF.loc['embryo1Slabs', 'nTP'] == 113
+    assert summaryDF.loc['synthetic', 'nTP'] == expected['nTP']
+
+    assert pd.read_csv(str(tmp_path / 'output' / 'batchSummary.csv')).shape[0] == 4
+    for groupName in ('embryo1', 'embryo1Again', 'synthetic'):
+        assert (tmp_path / 'output' / groupName / 'metrics.csv').is_file()
+    assert (tmp_path / 'output' / 'embryo1' / 'farsight_label_croped_GT_8bit').is_dir()
+    assert not (tmp_path / 'output' / 'embryo1Again' / 'farsight_label_croped_GT_8bit').is_dir()
+
+
+if __name__ == '__main__':
+
+    testNormalizeBatchJobSpec()
+    testMemoryBudget()
+    testBoundedWorkerCount()
+    testRunBatchJobSpec(pathlib.Path(tempfile.mkdtemp()))
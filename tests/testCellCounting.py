@@ -0,0 +1,51 @@
+import pathlib
+import shutil
+import tempfile
+
+import numpy as np
+import tifffile
+
+from nuclearSegQualityMetrics.farsight_bindings import readNucleiSegCountDir
+from nuclearSegQualityMetrics.featureCache import FeatureCache, setDefaultFeatureCache
+from nuclearSegQualityMetrics.folderDefs import testFilesPath
+
+
+testDir = testFilesPath / "CountingResults" / "test2"
+
+
+def testReadNucleiSegCountDir(tmp_path):
+
+    expectedCounts = {}
+    for fileName in ["GT_8bit.tif", "farsight_label_croped.tif"]:
+        imgOPDirName = fileName.split('.')[0]
+        (tmp_path / imgOPDirName).mkdir()
+        shutil.copy(str(testDir / fileName), str(tmp_path / imgOPDirName / (imgOPDirName + '.tif')))
+
+        labelImage = tifffile.imread(str(testDir / fileName))
+        expectedCounts[imgOPDirName] = int(np.count_nonzero(np.unique(labelImage)))
+
+    # compressed and larger than the slab size, so that it is read page by page in several slabs
+    labelImage = np.zeros((70, 20, 20), dtype=np.uint16)
+    labelImage[5:65, 2:4, 2:4] = 60000
+    labelImage[40, 10, 10] = 7
+    (tmp_path / 'compressed').mkdir()
+    tifffile.imwrite(str(tmp_path / 'compressed' / 'compressed.tif'), labelImage, compression='zlib')
+    expectedCounts['compressed'] = 2
+
+    (tmp_path / 'notAnOutputDir').mkdir()
+
+    assert readNucleiSegCountDir(str(tmp_path), nWorkers=3) == expectedCounts
+
+    featureCache = FeatureCache(str(tmp_path / 'cache'))
+    setDefaultFeatureCache(featureCache)
+    try:
+        assert readNucleiSegCountDir(str(tmp_path)) == expectedCounts
+        assert readNucleiSegCountDir(str(tmp_path)) == expectedCounts
+        assert len(list((tmp_path / 'cache').glob('labelCount_*.npz'))) == 3
+    finally:
+        setDefaultFeatureCache(None)
+
+
+if __name__ == '__main__':
+
+    testReadNucleiSegCountDir(pathlib.Path(tempfile.mkdtemp()))
@@ -0,0 +1,71 @@
+import os
+import pathlib
+import stat
+import sys
+import tempfile
+
+from nuclearSegQualityMetrics.farsight_bindings import runNucleiSegFolder
+
+# stands in for segment_nuclei.exe: copies the input to the output and writes the two files farsight
+# leaves next to the input image. Input names decide failures: 'fail' always fails, 'slow' times out and
+# 'flaky' fails on its first attempt
+stubScript = '''#!{python}
+import os, shutil, sys, time
+inputImageFile, outputFile = sys.argv[1:3]
+prefix = os.path.splitext(inputImageFile)[0]
+print('segmenting', inputImageFile, flush=True)
+if 'fail' in inputImageFile:
+    sys.exit(1)
+if 'slow' in inputImageFile:
+    time.sleep(30)
+if 'flaky' in inputImageFile and not os.path.exists(prefix + '.attempted'):
+    open(prefix + '.attempted', 'w').close()
+    sys.exit(2)
+shutil.copy(inputImageFile, outputFile)
+for suffix in ['_seg_final.dat', '_seedPoints.txt']:
+    open(prefix + suffix, 'w').close()
+'''
+
+
+def makeStubFarsight(binDir):
+
+    stubFile = os.path.join(binDir, 'segment_nuclei')
+    with open(stubFile, 'w') as fle:
+        fle.write(stubScript.format(python=sys.executable))
+    os.chmod(stubFile, os.stat(stubFile).st_mode | stat.S_IEXEC)
+
+
+def testRunNucleiSegFolderConcurrent(tmp_path):
+
+    inputDir, outputDir, binDir = [tmp_path / x for x in ['input', 'output', 'bin']]
+    for directory in [inputDir, outputDir, binDir]:
+        directory.mkdir()
+    makeStubFarsight(str(binDir))
+
+    for name in ['img1', 'img2', 'img3', 'fail', 'slow', 'flaky']:
+        (inputDir / '{}.tif'.format(name)).write_bytes(b'tif')
+
+    finished = []
+    jobStatuses = runNucleiSegFolder(str(inputDir), str(outputDir), str(binDir), nJobs=4, timeout=1,
+                                     nRetries=1, onJobFinished=finished.append)
+    statuses = {os.path.basename(x['inputImageFile']): x for x in jobStatuses}
+
+    assert len(finished) == 6
+    assert {x: statuses[x]['status'] for x in statuses} == \
+        {'img1.tif': 'done', 'img2.tif': 'done', 'img3.tif': 'done', 'fail.tif': 'failed',
+         'slow.tif': 'timeout', 'flaky.tif': 'done'}
+    assert statuses['flaky.tif']['attempts'] == 2
+    assert statuses['fail.tif']['attempts'] == 2
+    assert (outputDir / 'img1' / 'img1_seedPoints.txt').is_file()
+    assert 'segmenting' in (outputDir / 'img1' / 'img1Log.log').read_text()
+
+    # finished images are skipped without prompting, the others are run again
+    jobStatuses = runNucleiSegFolder(str(inputDir), str(outputDir), str(binDir), nJobs=4, timeout=1)
+    statuses = {os.path.basename(x['inputImageFile']): x['status'] for x in jobStatuses}
+    assert statuses['img1.tif'] == statuses['flaky.tif'] == 'skipped'
+    assert statuses['fail.tif'] == 'failed'
+
+
+if __name__ == '__main__':
+
+    testRunNucleiSegFolderConcurrent(pathlib.Path(tempfile.mkdtemp()))
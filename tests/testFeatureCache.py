@@ -0,0 +1,133 @@
+import os
+import pathlib
+import shutil
+import tempfile
+
+import numpy as np
+
+from nuclearSegQualityMetrics.SegmentationQualityMetrics import labelImageFileFeatures
+from nuclearSegQualityMetrics import featureCache as featureCacheModule
+from nuclearSegQualityMetrics.featureCache import FeatureCache, openFeatureCache, setDefaultFeatureCache
+from nuclearSegQualityMetrics.folderDefs import testFilesPath
+
+
+testDir = testFilesPath / "CountingResults" / "test2"
+
+
+def testFeatureCacheTransparent(tmp_path):
+
+    labelImageFile = str(tmp_path / "labels.tif")
+    shutil.copy(str(testDir / "farsight_label_croped.tif"), labelImageFile)
+
+    expected = labelImageFileFeatures(labelImageFile)
+
+    featureCache = FeatureCache(str(tmp_path / "cache"))
+    setDefaultFeatureCache(featureCache)
+    try:
+        assert featureCache.get(labelImageFile) is None
+        computed = labelImageFileFeatures(labelImageFile)
+        assert featureCache.get(labelImageFile) is not None
+        cached = labelImageFileFeatures(labelImageFile)
+
+        for features in [computed, cached]:
+            assert features[:2] == expected[:2]
+            for name, expectedArray in expected[2].toArrays().items():
+                np.testing.assert_array_equal(getattr(features[2], name), expectedArray)
+
+        # a changed file is a different entry
+        fileStat = os.stat(labelImageFile)
+        os.utime(labelImageFile, ns=(fileStat.st_atime_ns, fileStat.st_mtime_ns + 10 ** 9))
+        assert featureCache.get(labelImageFile) is None
+    finally:
+        setDefaultFeatureCache(None)
+
+
+def testFeatureCacheLRUEviction(tmp_path):
+
+    featureCache = FeatureCache(str(tmp_path / "cache"), maxSizeBytes=10 ** 5)
+    imageFiles = []
+    for ind in range(3):
+        imageFile = tmp_path / "image{}.tif".format(ind)
+        imageFile.write_bytes(bytes([ind]))
+        imageFiles.append(str(imageFile))
+
+    arrays = {'data': np.zeros(5000)}
+    featureCache.put(imageFiles[0], arrays)
+    featureCache.put(imageFiles[1], arrays)
+
+    # the second entry becomes the least recently used one
+    entryFile = featureCache._entryFile(imageFiles[1], 'features')
+    os.utime(entryFile, (1, 1))
+    assert featureCache.get(imageFiles[0]) is not None
+
+    featureCache.put(imageFiles[2], arrays)
+    assert featureCache.get(imageFiles[0]) is not None
+    assert featureCache.get(imageFiles[1]) is None
+    assert featureCache.get(imageFiles[2]) is not None
+
+
+def testFeatureCacheMisses(tmp_path):
+
+    featureCache = FeatureCache(str(tmp_path / "cache"))
+    imageFile = str(tmp_path / "image")
+    open(imageFile, 'w').close()
+    featureCache.put(imageFile, {'x': np.arange(3)})
+
+    # an entry evicted by another process between reading it and marking it used is a miss
+    utime = os.utime
+
+    def evictingUtime(path, *args, **kwargs):
+        os.remove(path)
+        utime(path, *args, **kwargs)
+
+    featureCacheModule.os.utime = evictingUtime
+    try:
+        assert featureCache.get(imageFile) is None
+    finally:
+        featureCacheModule.os.utime = utime
+    assert featureCache.get(imageFile) is None
+
+    # a truncated entry is a miss, and is replaced by the next put
+    featureCache.put(imageFile, {'x': np.arange(1000)})
+    entryFile = featureCache._entryFile(imageFile, 'features')
+    with open(entryFile, 'r+b') as fle:
+        fle.truncate(os.path.getsize(entryFile) // 2)
+    assert featureCache.get(imageFile) is None
+    featureCache.put(imageFile, {'x': np.arange(1000)})
+    np.testing.assert_array_equal(featureCache.get(imageFile)['x'], np.arange(1000))
+
+    # entries evicted by another process while they are listed are skipped
+    scandir = os.scandir
+
+    def evictingScandir(path):
+        dirEntries = list(scandir(path))
+        for dirEntry in dirEntries:
+            os.remove(dirEntry.path)
+        return dirEntries
+
+    featureCacheModule.os.scandir = evictingScandir
+    try:
+        featureCache.evict()
+    finally:
+        featureCacheModule.os.scandir = scandir
+    assert featureCache.get(imageFile) is None
+
+    # without an app data folder, e.g. on macOS, there is no cache
+    getAppDataHome = featureCacheModule.getAppDataHome
+
+    def unsupportedAppDataHome():
+        raise OSError('Unsupported operating system')
+
+    featureCacheModule.getAppDataHome = unsupportedAppDataHome
+    try:
+        assert openFeatureCache() is None
+    finally:
+        featureCacheModule.getAppDataHome = getAppDataHome
+    assert openFeatureCache(str(tmp_path / "cache")).cacheDir == str(tmp_path / "cache")
+
+
+if __name__ == '__main__':
+
+    testFeatureCacheTransparent(pathlib.Path(tempfile.mkdtemp()))
+    testFeatureCacheLRUEviction(pathlib.Path(tempfile.mkdtemp()))
+    testFeatureCacheMisses(pathlib.Path(tempfile.mkdtemp()))
@@ -0,0 +1,38 @@
+import json
+import subprocess
+import sys
+
+from nuclearSegQualityMetrics.folderDefs import baseLibPath
+
+heavyModules = ['matplotlib', 'seaborn', 'pandas', 'skimage', 'SimpleITK', 'openpyxl']
+
+importScript = '''
+import json, sys, time
+startTime = time.perf_counter()
+import {module}
+importTime = time.perf_counter() - startTime
+print(json.dumps({{'importTime': importTime, 'modules': sorted(sys.modules)}}))
+'''
+
+
+def importInFreshInterpreter(module):
+
+    output = subprocess.check_output([sys.executable, '-c', importScript.format(module=module)],
+                                     cwd=str(baseLibPath))
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def testComputeModulesImportWithoutPlottingStack():
+
+    for module in ['nuclearSegQualityMetrics.SegmentationQualityMetrics',
+                   'nuclearSegQualityMetrics.farsight_bindings']:
+        result = importInFreshInterpreter(module)
+        importedHeavy = [x for x in heavyModules if x in result['modules']]
+
+        print('{}: {:.3f}s'.format(module, result['importTime']))
+        assert not importedHeavy, 'Importing {} imports {}'.format(module, importedHeavy)
+
+
+if __name__ == '__main__':
+
+    testComputeModulesImportWithoutPlottingStack()
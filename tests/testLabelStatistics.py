@@ -0,0 +1,192 @@
+import pathlib
+import tempfile
+import warnings
+
+import numpy as np
+import tifffile
+from skimage import measure
+
+from nuclearSegQualityMetrics.SegmentationQualityMetrics import labelCentroidRadius, labelImageFileFeatures
+from nuclearSegQualityMetrics import labelStatistics as labelStatisticsModule
+from nuclearSegQualityMetrics.labelStatistics import LabelStats, labelImageShapeDtype, labelStatistics, \
+    labelStatisticsChunked, readLabelImageSlab
+from nuclearSegQualityMetrics.folderDefs import testFilesPath
+
+
+testDir = testFilesPath / "CountingResults" / "test2"
+
+
+def getHollowLabelImage():
+
+    labelImage = np.zeros((12, 20, 24), dtype=np.uint16)
+    labelImage[1:8, 2:9, 3:12] = 3
+    labelImage[3:5, 4:6, 5:8] = 0
+    labelImage[6:11, 12:18, 14:22] = 7
+    labelImage[9, 13, 15] = 0
+    labelImage[0, 19, 23] = 12
+    return labelImage
+
+
+def assertMatchesRegionprops(labelImage):
+
+    regionProps = measure.regionprops(labelImage)
+    labels, voxelCounts, centroids, bboxes, filledVolumes = labelStatistics(labelImage, computeFilledVolumes=True)
+
+    np.testing.assert_array_equal(labels, [x.label for x in regionProps])
+    np.testing.assert_array_equal(voxelCounts, [x.area for x in regionProps])
+    np.testing.assert_allclose(centroids, [x.centroid for x in regionProps], rtol=0, atol=1e-9)
+    np.testing.assert_array_equal(bboxes, [x.bbox for x in regionProps])
+    np.testing.assert_array_equal(filledVolumes, [x.filled_area for x in regionProps])
+
+
+def testLabelStatisticsMatchRegionpropsFixtures():
+
+    for fileName in ["GT_8bit.tif", "farsight_label_croped.tif"]:
+        assertMatchesRegionprops(tifffile.imread(str(testDir / fileName)))
+
+
+def testLabelStatisticsMatchRegionpropsHoles():
+
+    labelImage = getHollowLabelImage()
+    assertMatchesRegionprops(labelImage)
+
+    labels, voxelCounts, centroids, bboxes, filledVolumes = labelStatistics(labelImage)
+    assert filledVolumes is None
+    assert np.all(voxelCounts <= [x.filled_area for x in measure.regionprops(labelImage)])
+
+
+def testLabelStatisticsChunked(tmp_path):
+
+    labelImage = getHollowLabelImage()
+    expected = labelStatistics(labelImage, computeFilledVolumes=True)
+
+    for compression in [None, 'zlib']:
+        labelImageFile = str(tmp_path / 'labels_{}.tif'.format(compression))
+        tifffile.imwrite(labelImageFile, labelImage, compression=compression)
+
+        # slabs of 3 planes cut through both large labels
+        for nWorkers in [1, 3]:
+            chunked = labelStatisticsChunked(labelImageFile, slabSize=3, nWorkers=nWorkers,
+                                             computeFilledVolumes=True)
+            for expectedArray, chunkedArray in zip(expected[:4], chunked[:4]):
+                np.testing.assert_allclose(chunkedArray, expectedArray, rtol=0, atol=1e-9)
+            np.testing.assert_array_equal(chunked[4], expected[4])
+
+
+def testReadLabelImageSlab(tmp_path):
+
+    labelImage = getHollowLabelImage()
+
+    # pages, and a single page holding the whole 3D stack, each uncompressed and compressed
+    for volumetric in [False, True]:
+        for compression in [None, 'zlib']:
+            labelImageFile = str(tmp_path / 'labels_{}_{}.tif'.format(volumetric, compression))
+            if volumetric:
+                tifffile.imwrite(labelImageFile, labelImage, volumetric=True, tile=(4, 16, 16),
+                                 compression=compression)
+            else:
+                tifffile.imwrite(labelImageFile, labelImage, compression=compression)
+
+            assert labelImageShapeDtype(labelImageFile) == (labelImage.shape, labelImage.dtype)
+            np.testing.assert_array_equal(readLabelImageSlab(labelImageFile, 3, 8), labelImage[3:8])
+            np.testing.assert_array_equal(labelStatisticsChunked(labelImageFile, slabSize=5,
+                                                                 computeFilledVolumes=True)[4],
+                                          labelStatistics(labelImage, computeFilledVolumes=True)[4])
+
+
+def testLabelStatisticsChunkedBoundedReads(tmp_path):
+
+    # a hollow label through the whole stack, and small ones in between
+    labelImage = np.zeros((40, 12, 12), dtype=np.uint16)
+    labelImage[:, 1:8, 1:8] = 5
+    labelImage[5:35, 3:6, 3:6] = 0
+    labelImage[10:13, 9:11, 9:11] = 9
+    labelImage[21:28, 9:12, 0:3] = 11
+    expected = labelStatistics(labelImage, computeFilledVolumes=True)
+
+    labelImageFile = str(tmp_path / 'labels.tif')
+    tifffile.imwrite(labelImageFile, labelImage)
+
+    readBounds = []
+    readLabelImageSlab = labelStatisticsModule.readLabelImageSlab
+
+    def recordingReadLabelImageSlab(labelImageFile, zStart, zStop):
+        readBounds.append((zStart, zStop))
+        return readLabelImageSlab(labelImageFile, zStart, zStop)
+
+    labelStatisticsModule.readLabelImageSlab = recordingReadLabelImageSlab
+    try:
+        chunked = labelStatisticsChunked(labelImageFile, slabSize=4, computeFilledVolumes=True)
+    finally:
+        labelStatisticsModule.readLabelImageSlab = readLabelImageSlab
+
+    np.testing.assert_array_equal(chunked[4], expected[4])
+    # the tall label is not filled from one read of the whole stack
+    assert max(zStop - zStart for zStart, zStop in readBounds) <= 8
+
+    # a single page holding the whole stack is decoded once, with a warning, and not once per slab
+    volumetricFile = str(tmp_path / 'labelsVolumetric.tif')
+    tifffile.imwrite(volumetricFile, labelImage, volumetric=True, tile=(8, 16, 16), compression='zlib')
+    del readBounds[:]
+    labelStatisticsModule.readLabelImageSlab = recordingReadLabelImageSlab
+    try:
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            chunked = labelStatisticsChunked(volumetricFile, slabSize=4, computeFilledVolumes=True)
+    finally:
+        labelStatisticsModule.readLabelImageSlab = readLabelImageSlab
+
+    np.testing.assert_array_equal(chunked[4], expected[4])
+    assert not readBounds
+    assert len(caught) == 1 and volumetricFile in str(caught[0].message)
+
+
+def testLabelVolumesFilled(tmp_path):
+
+    labelImage = getHollowLabelImage()
+    filledAreas = [x.filled_area for x in measure.regionprops(labelImage)]
+
+    np.testing.assert_array_equal(labelCentroidRadius(labelImage).volumes, filledAreas)
+    assert labelCentroidRadius(labelImage, fillHoles=False).volumes[0] < filledAreas[0]
+
+    labelImageFile = str(tmp_path / 'labels.tif')
+    tifffile.imwrite(labelImageFile, labelImage)
+    for slabSize in [None, 3]:
+        shape, dtype, labelStats = labelImageFileFeatures(labelImageFile, slabSize=slabSize)
+        np.testing.assert_array_equal(labelStats.volumes, filledAreas)
+
+
+def testLabelStats(tmp_path):
+
+    labels, voxelCounts, centroids, bboxes, filledVolumes = labelStatistics(getHollowLabelImage())
+    labelStats = LabelStats(labels, centroids, np.ones(len(labels)), voxelCounts, bboxes)
+
+    np.testing.assert_array_equal(labelStats[1:].labels, [7, 12])
+    np.testing.assert_array_equal(labelStats[np.array([True, False, True])].bboxes, bboxes[[0, 2]])
+
+    split = labelStats.splitBy(np.array(['TP', 'FN', 'TP']))
+    assert list(split) == ['FN', 'TP']
+    np.testing.assert_array_equal(split['TP'].labels, [3, 12])
+    np.testing.assert_array_equal(split['FN'].bboxes, bboxes[[1]])
+    # the classes are views of the same sorted copy, and not copies of their own
+    for name in LabelStats.__slots__:
+        assert not getattr(split['TP'], name).flags.owndata
+        assert getattr(split['TP'], name).base is getattr(split['FN'], name).base
+
+    labelStats.save(str(tmp_path))
+    loaded = LabelStats.load(str(tmp_path), mmapMode='r')
+    for name, array in labelStats.toArrays().items():
+        np.testing.assert_array_equal(getattr(loaded, name), array)
+    # memory mapped, not copied
+    assert not loaded.centroids.flags.owndata and not loaded.centroids.flags.writeable
+
+
+if __name__ == '__main__':
+
+    testLabelStatisticsMatchRegionpropsFixtures()
+    testLabelStatisticsMatchRegionpropsHoles()
+    testLabelStatisticsChunked(pathlib.Path(tempfile.mkdtemp()))
+    testReadLabelImageSlab(pathlib.Path(tempfile.mkdtemp()))
+    testLabelStatisticsChunkedBoundedReads(pathlib.Path(tempfile.mkdtemp()))
+    testLabelVolumesFilled(pathlib.Path(tempfile.mkdtemp()))
+    testLabelStats(pathlib.Path(tempfile.mkdtemp()))
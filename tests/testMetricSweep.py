@@ -0,0 +1,53 @@
+import pathlib
+import tempfile
+
+import numpy as np
+
+from nuclearSegQualityMetrics.SegmentationQualityMetrics import segQualErrors, segQualErrorsSweep, \
+    saveSweepResultsTestList, GroundTruthFeatures, classifyCentroids, labelImageFileFeatures
+
+from labelImageFixtures import gtLabelImageFile, testLabelImageFile
+
+
+def testCentroidSweep():
+
+    radiusScales = [0.25, 0.5, 0.75, 1.0, 1.5, 2.0]
+    gtFeatures = GroundTruthFeatures(gtLabelImageFile)
+    errors = segQualErrorsSweep(testLabelImageFile, gtFeatures, radiusScales)
+
+    assert tuple(errors[3]) == segQualErrors(testLabelImageFile, gtFeatures)
+    assert np.all(np.diff(errors[:, 1]) >= 0)
+
+    testCentroids = labelImageFileFeatures(testLabelImageFile)[2].centroids
+    for radiusScale, (nFP, nTP, nFN, nNoiseFP, nNonNoiseFP) in zip(radiusScales, errors):
+        gtTPMask, testTPMask, testNoiseFPMask = classifyCentroids(testCentroids, gtFeatures.stats.centroids,
+                                                                  radiusScale * gtFeatures.stats.radii)
+        assert (nTP, nNoiseFP) == (testTPMask.sum(), testNoiseFPMask.sum())
+
+
+def testOverlapSweep():
+
+    iouThresholds = [0.1, 0.3, 0.5, 0.7]
+    for assignment in ('greedy', 'hungarian'):
+        errors = segQualErrorsSweep(testLabelImageFile, gtLabelImageFile, iouThresholds, matching='overlap',
+                                    assignment=assignment)
+        for iouThreshold, thresholdErrors in zip(iouThresholds, errors):
+            assert tuple(thresholdErrors) == segQualErrors(testLabelImageFile, gtLabelImageFile, matching='overlap',
+                                                           iouThreshold=iouThreshold, assignment=assignment)
+
+
+def testSaveSweepResultsTestList(tmp_path):
+
+    sweepDF = saveSweepResultsTestList([testLabelImageFile] * 2, gtLabelImageFile, str(tmp_path), ['a', 'b'],
+                                       [0.5, 1.0], reportMode='skip')
+
+    assert sweepDF.shape[0] == 4
+    assert list(sweepDF.loc[sweepDF['threshold'] == 1.0, 'nTP']) == [113, 113]
+    assert (tmp_path / 'metricSweep.csv').is_file()
+
+
+if __name__ == '__main__':
+
+    testCentroidSweep()
+    testOverlapSweep()
+    testSaveSweepResultsTestList(pathlib.Path(tempfile.mkdtemp()))
@@ -0,0 +1,114 @@
+import pathlib
+import tempfile
+import time
+
+import numpy as np
+import tifffile
+
+from nuclearSegQualityMetrics.SegmentationQualityMetrics import segQualErrors
+from nuclearSegQualityMetrics.overlapMatching import labelContingencyTable, pairIoUs, assignPairs
+from nuclearSegQualityMetrics.syntheticNuclei import writeSyntheticLabelPair
+
+from labelImageFixtures import gtLabelImageFile, testLabelImageFile
+
+
+def testLabelContingencyTable():
+
+    gtLabelImage = tifffile.imread(gtLabelImageFile).astype(np.int64)
+    testLabelImage = tifffile.imread(testLabelImageFile).astype(np.int64)
+
+    gtPairLabels, testPairLabels, pairCounts = labelContingencyTable(gtLabelImageFile, testLabelImageFile)
+    assert pairCounts.sum() == gtLabelImage.size
+
+    expectedPairs, expectedCounts = np.unique(np.stack([gtLabelImage.ravel(), testLabelImage.ravel()]),
+                                              axis=1, return_counts=True)
+    assert np.array_equal(np.stack([gtPairLabels, testPairLabels]).astype(np.int64), expectedPairs)
+    assert np.array_equal(pairCounts, expectedCounts)
+
+    for result, slabResult in zip((gtPairLabels, testPairLabels, pairCounts),
+                                  labelContingencyTable(gtLabelImageFile, testLabelImageFile, slabSize=3)):
+        assert np.array_equal(result, slabResult)
+
+
+def testLabelContingencyTableDtypes(tmp_path):
+
+    gtLabelImage = tifffile.imread(gtLabelImageFile)
+    testLabelImage = tifffile.imread(testLabelImageFile)
+    expected = labelContingencyTable(gtLabelImageFile, testLabelImageFile)
+
+    # signed and 64 bit labels are paired by the labels present, as long as they are not negative
+    gtFile, testFile = str(tmp_path / 'gt.tif'), str(tmp_path / 'test.tif')
+    for gtDtype, testDtype in ((np.int32, np.uint16), (np.uint8, np.uint64), (np.int64, np.int32)):
+        tifffile.imwrite(gtFile, gtLabelImage.astype(gtDtype), photometric='minisblack')
+        tifffile.imwrite(testFile, testLabelImage.astype(testDtype), photometric='minisblack')
+        for slabSize in (None, 3):
+            for result, dtypeResult in zip(expected, labelContingencyTable(gtFile, testFile, slabSize=slabSize)):
+                assert np.array_equal(result, dtypeResult)
+
+    # negative labels, and 64 bit labels that would overflow the pair keys, are not
+    for gtLabels, testLabels in ((np.array([0, -1], dtype=np.int16), np.array([0, 1], dtype=np.uint16)),
+                                 (np.array([0, 2 ** 40], dtype=np.uint64), np.array([0, 2 ** 30], dtype=np.uint64))):
+        tifffile.imwrite(gtFile, np.resize(gtLabels, (2, 4, 4)), photometric='minisblack')
+        tifffile.imwrite(testFile, np.resize(testLabels, (2, 4, 4)), photometric='minisblack')
+        try:
+            labelContingencyTable(gtFile, testFile)
+        except AssertionError:
+            pass
+        else:
+            raise AssertionError('{} and {} labels were accepted'.format(gtLabels, testLabels))
+
+
+def testAssignPairs():
+
+    # greedy takes the single best pair, the optimal assignment matches both gt nuclei
+    candidateGTInds = np.array([0, 0, 1])
+    candidateTestInds = np.array([0, 1, 0])
+    candidateIoUs = np.array([0.6, 0.55, 0.55])
+
+    assert len(assignPairs(candidateGTInds, candidateTestInds, candidateIoUs, 0.1, 'greedy')[0]) == 1
+
+    gtInds, testInds, ious = assignPairs(candidateGTInds, candidateTestInds, candidateIoUs, 0.1, 'hungarian')
+    assert sorted(zip(gtInds, testInds)) == [(0, 1), (1, 0)]
+
+    assert len(assignPairs(candidateGTInds, candidateTestInds, candidateIoUs, 0.58, 'hungarian')[0]) == 1
+
+
+def testSegQualErrorsOverlapSynthetic(tmp_path):
+
+    gtFile, testFile, expected = writeSyntheticLabelPair(str(tmp_path), shape=(64, 128, 128), nNuclei=120,
+                                                         radiusMean=3, radiusStd=0.3, seed=0)
+
+    for assignment in ('greedy', 'hungarian'):
+        nFP, nTP, nFN, nNoiseFP, nNonNoiseFP = segQualErrors(testFile, gtFile, matching='overlap',
+                                                             iouThreshold=0.3, assignment=assignment)
+        assert (nFP, nTP, nFN) == (expected['nFP'], expected['nTP'], expected['nFN'])
+        # displaced nuclei still overlap their gt nucleus a little
+        assert nNoiseFP + nNonNoiseFP == nFP and nNonNoiseFP > 0
+
+
+def testOverlapMatchingScaling():
+
+    # 2x2x3 blocks, 40000 labels, test labels shifted by one voxel along x so that each overlaps two gt labels
+    gtLabelImage = np.arange(1, 40001).reshape(10, 40, 100).repeat(2, 0).repeat(2, 1).repeat(3, 2)
+    testLabelImage = np.roll(gtLabelImage, 1, axis=2)
+
+    pairs, pairCounts = np.unique(np.stack([gtLabelImage.ravel(), testLabelImage.ravel()]), axis=1,
+                                  return_counts=True)
+
+    startTime = time.perf_counter()
+    gtLabels, testLabels, candidateGTInds, candidateTestInds, candidateIoUs = pairIoUs(pairs[0], pairs[1], pairCounts)
+    gtInds, testInds, ious = assignPairs(candidateGTInds, candidateTestInds, candidateIoUs, 0.1, 'hungarian')
+    elapsed = time.perf_counter() - startTime
+
+    assert len(gtInds) == 40000 and np.array_equal(gtLabels[gtInds], testLabels[testInds])
+    assert len(candidateIoUs) == 80000 and np.allclose(ious, 0.5)
+    assert elapsed < 5.0, 'overlap matching took {:.2f}s for 40000 labels'.format(elapsed)
+
+
+if __name__ == '__main__':
+
+    testLabelContingencyTable()
+    testLabelContingencyTableDtypes(pathlib.Path(tempfile.mkdtemp()))
+    testAssignPairs()
+    testSegQualErrorsOverlapSynthetic(pathlib.Path(tempfile.mkdtemp()))
+    testOverlapMatchingScaling()
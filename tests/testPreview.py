@@ -0,0 +1,44 @@
+import pathlib
+import tempfile
+
+import numpy as np
+import tifffile
+
+from nuclearSegQualityMetrics.SegmentationQualityMetrics import previewSegQualErrors, segQualErrors, \
+    getMetricsFromCounts
+from nuclearSegQualityMetrics.labelStatistics import readLabelImageStrided
+
+from labelImageFixtures import gtLabelImageFile, testLabelImageFile
+
+
+def testReadLabelImageStrided(tmp_path):
+
+    labelImage = tifffile.imread(testLabelImageFile)
+    compressedFile = str(tmp_path / 'compressed.tif')
+    tifffile.imwrite(compressedFile, labelImage, compression='zlib')
+
+    for labelImageFile in (testLabelImageFile, compressedFile):
+        np.testing.assert_array_equal(readLabelImageStrided(labelImageFile, (2, 3, 4), (1, 2, 0)),
+                                      labelImage[1::2, 2::3, ::4])
+
+
+def testPreviewSegQualErrors():
+
+    fullMetrics = getMetricsFromCounts(*segQualErrors(testLabelImageFile, gtLabelImageFile)[:3])
+
+    preview = previewSegQualErrors(testLabelImageFile, gtLabelImageFile, stride=(1, 1, 1))
+    assert preview['phaseErrors'] == [segQualErrors(testLabelImageFile, gtLabelImageFile)] * 2
+    assert max(preview['metricSpreads'].values()) == 0
+
+    preview = previewSegQualErrors(testLabelImageFile, gtLabelImageFile, stride=(2, 2, 2))
+    for metricName, fullMetric in zip(('Recall', 'Precision', 'fMeasure', 'Accuracy'), fullMetrics):
+        assert abs(preview['metrics'][metricName] - fullMetric) < 0.05
+
+    preview = previewSegQualErrors(testLabelImageFile, gtLabelImageFile, stride=(1, 2, 2), matching='overlap')
+    assert len(preview['phaseErrors']) == 2
+
+
+if __name__ == '__main__':
+
+    testReadLabelImageStrided(pathlib.Path(tempfile.mkdtemp()))
+    testPreviewSegQualErrors()
@@ -0,0 +1,85 @@
+import pathlib
+import tempfile
+
+import pandas as pd
+
+from nuclearSegQualityMetrics.SegmentationQualityMetrics import saveResultsTestList
+from nuclearSegQualityMetrics.reports import renderReports, waitForReports
+
+from labelImageFixtures import gtLabelImageFile, testLabelImageFile, expectedErrors, copyTestLabelImageFiles
+
+
+def testBackgroundReports(tmp_path):
+
+    # debug info of another run in the same folder is not exported
+    otherDebugInfoDir = tmp_path / 'other_GT_8bit'
+    otherDebugInfoDir.mkdir()
+    (otherDebugInfoDir / 'testData.csv').write_text('label,x\n1,2\n')
+
+    resDF = saveResultsTestList([testLabelImageFile], gtLabelImageFile, str(tmp_path), ['a'], saveDebugInfo=True,
+                                reportMode='background', excelExport=True)
+
+    assert tuple(resDF[['nFP', 'nTP', 'nFN', 'nNoiseFP', 'nNonNoiseFP']].iloc[0]) == expectedErrors
+    assert (tmp_path / 'metrics.csv').is_file()
+
+    assert waitForReports(timeout=300)
+    for fileName in ('metrics.png', 'cellCounts.png', 'metrics.xlsx', 'farsight_label_croped_GT_8bit/gtData.xlsx',
+                     'farsight_label_croped_GT_8bit/testData.xlsx'):
+        assert (tmp_path / fileName).is_file()
+    assert not (otherDebugInfoDir / 'testData.xlsx').exists()
+
+
+def testRenderReportsAgain(tmp_path):
+
+    saveResultsTestList([testLabelImageFile], gtLabelImageFile, str(tmp_path), ['a'], reportMode='skip')
+    assert not (tmp_path / 'metrics.png').is_file()
+
+    # reports are regenerated from the saved tables alone
+    reportFiles = renderReports(str(tmp_path))
+    assert sorted(pathlib.Path(x).name for x in reportFiles) == ['cellCounts.png', 'metrics.png']
+    assert (tmp_path / 'metrics.png').is_file()
+    assert not (tmp_path / 'metrics.xlsx').is_file()
+
+
+def testReportsOfTheLastRunOnly(tmp_path):
+
+    testLabelImageFiles = copyTestLabelImageFiles(tmp_path, 3)
+    outputDir = tmp_path / 'output'
+    outputDir.mkdir()
+
+    saveResultsTestList(testLabelImageFiles, gtLabelImageFile, str(outputDir), ['a', 'b', 'c'], saveDebugInfo=True,
+                        excelExport=True, tileGrid=(2, 1, 1))
+    assert (outputDir / 'tileMetrics.xlsx').is_file() and (outputDir / 'tileMetrics.png').is_file()
+    debugExcelFiles = list(outputDir.glob('*/*.xlsx'))
+    assert len(debugExcelFiles) == 9
+    for excelFile in debugExcelFiles:
+        excelFile.unlink()
+
+    # a second run into the same folder, without tiles and on other pairs
+    saveResultsTestList(testLabelImageFiles[:2], gtLabelImageFile, str(outputDir), ['x', 'y'], excelExport=True)
+
+    assert list(pd.read_excel(str(outputDir / 'metrics.xlsx'))['label']) == ['x', 'y']
+    for fileName in ('tileMetrics.csv', 'tileMetrics.xlsx', 'tileMetrics.png'):
+        assert not (outputDir / fileName).exists()
+    # the second run has no debug info, that of the first run is not exported again
+    assert not list(outputDir.glob('*/*.xlsx'))
+
+    # a parquet run after a csv run, with a parquet engine
+    try:
+        import pyarrow
+    except ImportError:
+        try:
+            import fastparquet
+        except ImportError:
+            return
+    saveResultsTestList(testLabelImageFiles[2:], gtLabelImageFile, str(outputDir), ['z'], tableFormat='parquet',
+                        excelExport=True)
+    assert not (outputDir / 'metrics.csv').exists()
+    assert list(pd.read_excel(str(outputDir / 'metrics.xlsx'))['label']) == ['z']
+
+
+if __name__ == '__main__':
+
+    testBackgroundReports(pathlib.Path(tempfile.mkdtemp()))
+    testRenderReportsAgain(pathlib.Path(tempfile.mkdtemp()))
+    testReportsOfTheLastRunOnly(pathlib.Path(tempfile.mkdtemp()))
@@ -0,0 +1,51 @@
+import pathlib
+import tempfile
+import time
+
+import numpy as np
+
+from nuclearSegQualityMetrics.SegmentationQualityMetrics import saveResultsTestList
+from nuclearSegQualityMetrics.resultsStore import ResultsStore
+
+from labelImageFixtures import gtLabelImageFile, testLabelImageFile, copyTestLabelImageFiles
+
+
+def testResultsStore(tmp_path):
+
+    dbFile = str(tmp_path / 'results.sqlite')
+    testLabelImageFiles = copyTestLabelImageFiles(tmp_path, 2)
+
+    runIds = []
+    for run in range(2):
+        outputDir = tmp_path / 'output{}'.format(run)
+        outputDir.mkdir()
+        saveResultsTestList(testLabelImageFiles, gtLabelImageFile, str(outputDir), ['a', 'b'],
+                            saveDebugInfo=run == 0, reportMode='skip', resultsStore=dbFile)
+        runIds.append(int(ResultsStore(dbFile).queryRuns()['runId'].iloc[-1]))
+
+    resultsStore = ResultsStore(dbFile)
+    assert len(resultsStore.queryRuns(gtLabelImageFile)) == 2
+
+    pairsDF = resultsStore.queryPairs(label='a')
+    assert list(pairsDF['runId']) == runIds
+    assert list(pairsDF['nTP']) == [113, 113]
+    assert np.allclose(pairsDF['fMeasure'], 2 * 113 / (2 * 113 + 40 + 8))
+
+    assert len(resultsStore.queryPairs(testLabelImageFile=testLabelImageFiles[1])) == 2
+    assert len(resultsStore.queryPairs(since=time.time() + 10)) == 0
+
+    comparisonDF = resultsStore.compareRuns(runIds)
+    assert list(comparisonDF.index) == ['a', 'b'] and list(comparisonDF.columns) == runIds
+
+    # nuclei are stored for the run with debug info only
+    firstPairId = int(resultsStore.queryPairs(runIds=runIds[:1])['pairId'].iloc[0])
+    nucleiDF = resultsStore.queryNuclei(firstPairId, source='test')
+    assert len(nucleiDF) == 153 and (nucleiDF['classification'] == 'TP').sum() == 113
+    assert len(resultsStore.queryNuclei(firstPairId, source='gt')) == 121
+    lastPairId = int(resultsStore.queryPairs(runIds=runIds[1:])['pairId'].iloc[0])
+    assert len(resultsStore.queryNuclei(lastPairId)) == 0
+
+
+if __name__ == '__main__':
+
+    testResultsStore(pathlib.Path(tempfile.mkdtemp()))
@@ -0,0 +1,224 @@
+import pathlib
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from nuclearSegQualityMetrics.SegmentationQualityMetrics import segQualErrors, GroundTruthFeatures, \
+    classifyCentroids, segQualErrorsTestList, saveResultsTestList, bootstrapMetricIntervals, getMetricsFromCounts, \
+    metricNames
+from nuclearSegQualityMetrics.instrumentation import addInstrumentationHook, removeInstrumentationHook
+
+from labelImageFixtures import gtLabelImageFile, testLabelImageFile, expectedErrors, copyTestLabelImageFiles
+
+
+def testSegQualErrorsCounts():
+
+    assert segQualErrors(testLabelImageFile, gtLabelImageFile) == expectedErrors
+    assert segQualErrors(testLabelImageFile, gtLabelImageFile, slabSize=3) == expectedErrors
+
+
+def testSegQualErrorsPrecomputedGT():
+
+    gtFeatures = GroundTruthFeatures(gtLabelImageFile)
+
+    assert segQualErrors(testLabelImageFile, gtFeatures) == segQualErrors(testLabelImageFile, gtLabelImageFile)
+
+
+def testSegQualErrorsWithoutFillingHoles(tmp_path):
+
+    # the gt nuclei of the fixture have no holes, their radii are the same either way
+    for slabSize in (None, 3):
+        gtFeatures = GroundTruthFeatures(gtLabelImageFile, slabSize=slabSize, fillHoles=False)
+        assert np.array_equal(gtFeatures.stats.volumes, GroundTruthFeatures(gtLabelImageFile).stats.volumes)
+        assert segQualErrors(testLabelImageFile, gtFeatures, slabSize=slabSize, fillHoles=False) == expectedErrors
+
+    try:
+        segQualErrors(testLabelImageFile, gtFeatures)
+    except AssertionError:
+        pass
+    else:
+        raise AssertionError('gt features without filled holes were used by a run filling them')
+
+    # the results of runs with and without filling holes are kept apart in the run manifest
+    records = []
+    addInstrumentationHook(records.append)
+    try:
+        saveResultsTestList([testLabelImageFile], gtLabelImageFile, str(tmp_path), ['a'], reportMode='skip',
+                            fillHoles=False)
+        del records[:]
+        saveResultsTestList([testLabelImageFile], gtLabelImageFile, str(tmp_path), ['a'], reportMode='skip',
+                            resume=True)
+        assert [x['kind'] for x in records].count('segQualErrors') == 1
+    finally:
+        removeInstrumentationHook(records.append)
+
+
+def testSegQualErrorsInstrumentation():
+
+    records = []
+    addInstrumentationHook(records.append)
+    try:
+        segQualErrorsTestList([testLabelImageFile] * 2, gtLabelImageFile, nWorkers=2)
+    finally:
+        removeInstrumentationHook(records.append)
+
+    assert [x['kind'] for x in records] == ['groundTruthFeatures', 'segQualErrors', 'segQualErrors']
+    for record in records[1:]:
+        assert set(record['stages']) >= {'tiffRead', 'labelStatistics', 'kdTree', 'classification'}
+        assert record['counters']['labelsFound'] == 153
+        assert record['testLabelImageFile'] == testLabelImageFile
+
+
+def testSegQualErrorsTestListParallel():
+
+    testLabelImageFiles = [testLabelImageFile] * 3
+    gtFeatures = GroundTruthFeatures(gtLabelImageFile)
+
+    assert segQualErrorsTestList(testLabelImageFiles, gtFeatures, nWorkers=2) == \
+        segQualErrorsTestList(testLabelImageFiles, gtFeatures, nWorkers=1) == [expectedErrors] * 3
+
+
+def testSaveResultsTestList(tmp_path):
+
+    resDF = saveResultsTestList([testLabelImageFile] * 2, gtLabelImageFile, str(tmp_path), ['a', 'b'],
+                                saveDebugInfo=True)
+
+    assert list(resDF['label']) == ['a', 'b']
+    assert list(resDF['nTP']) == [113, 113]
+
+    metricsDF = pd.read_csv(str(tmp_path / 'metrics.csv'), index_col='label')
+    assert list(metricsDF['nFP']) == [40, 40]
+
+    testDataDF = pd.read_csv(str(tmp_path / 'farsight_label_croped_GT_8bit' / 'testData.csv'))
+    assert testDataDF['Centroid Z'].dtype == np.float64
+    assert (testDataDF['Classification'] == 'TP').sum() == 113
+    assert not list(tmp_path.glob('**/*.xlsx'))
+
+
+def testSaveResultsTestListResume(tmp_path):
+
+    testLabelImageFiles = copyTestLabelImageFiles(tmp_path, 3)
+    outputDir = tmp_path / 'output'
+    outputDir.mkdir()
+
+    saveResultsTestList(testLabelImageFiles, gtLabelImageFile, str(outputDir), ['a', 'b', 'c'],
+                        reportMode='skip')
+
+    # as if the run had been killed while writing the result of the third file
+    manifestFile = outputDir / 'runManifest.jsonl'
+    manifestLines = manifestFile.read_text().splitlines()
+    manifestFile.write_text('\n'.join(manifestLines[:2]) + '\n' + manifestLines[2][:20])
+
+    records = []
+    addInstrumentationHook(records.append)
+    try:
+        resDF = saveResultsTestList(testLabelImageFiles, gtLabelImageFile, str(outputDir), ['a', 'b', 'c'],
+                                    reportMode='skip', resume=True)
+        assert [x['testLabelImageFile'] for x in records if x['kind'] == 'segQualErrors'] == \
+            [testLabelImageFiles[2]]
+        assert [x['counters']['pairsReused'] for x in records if x['kind'] == 'saveResultsTestList'] == [2]
+        assert list(resDF['nTP']) == [113] * 3
+
+        # without resume, every pair is computed again
+        del records[:]
+        saveResultsTestList(testLabelImageFiles, gtLabelImageFile, str(outputDir), ['a', 'b', 'c'],
+                            reportMode='skip')
+        assert [x['testLabelImageFile'] for x in records if x['kind'] == 'segQualErrors'] == testLabelImageFiles
+        assert len(manifestFile.read_text().splitlines()) == 3
+    finally:
+        removeInstrumentationHook(records.append)
+
+
+def testSaveResultsTestListStop(tmp_path):
+
+    testLabelImageFiles = copyTestLabelImageFiles(tmp_path, 4)
+
+    for nWorkers in (1, 2):
+        outputDir = tmp_path / 'output{}'.format(nWorkers)
+        outputDir.mkdir()
+
+        results = []
+        resDF = saveResultsTestList(testLabelImageFiles, gtLabelImageFile, str(outputDir),
+                                    ['a', 'b', 'c', 'd'], nWorkers=nWorkers, reportMode='skip',
+                                    onResult=lambda ind, errors: results.append((ind, errors)),
+                                    shouldStop=lambda: len(results) > 0)
+
+        # files in flight when the stop is requested are finished, no others are started
+        assert results == [(ind, expectedErrors) for ind in range(nWorkers)]
+        assert list(resDF['label']) == ['a', 'b', 'c', 'd'][:nWorkers]
+        assert len((outputDir / 'runManifest.jsonl').read_text().splitlines()) == nWorkers
+
+
+def testClassifyCentroidsScaling():
+
+    nNuclei = 100000
+    rng = np.random.RandomState(0)
+    # nuclei on a lattice with spacing 20, so that no two spheres of radius 3 are close to each other
+    gtCentroids = 20.0 * np.stack(np.unravel_index(np.arange(nNuclei), (50, 50, 40)), axis=1)
+    gtRadii = np.full(nNuclei, 3.0)
+
+    # first half found with a small displacement, rest displaced far away from any gt
+    testCentroids = gtCentroids.copy()
+    testCentroids[: nNuclei // 2] += rng.uniform(-1, 1, size=(nNuclei // 2, 3))
+    testCentroids[nNuclei // 2:] = rng.uniform(3000, 5000, size=(nNuclei - nNuclei // 2, 3))
+
+    startTime = time.perf_counter()
+    gtTPMask, testTPMask, testNoiseFPMask = classifyCentroids(testCentroids, gtCentroids, gtRadii)
+    elapsed = time.perf_counter() - startTime
+
+    assert gtTPMask.sum() == testTPMask.sum() == nNuclei // 2
+    assert testNoiseFPMask.sum() == nNuclei - nNuclei // 2
+    assert elapsed < 1.0, 'classifyCentroids took {:.2f}s for {} centroids'.format(elapsed, nNuclei)
+
+
+def testBootstrapMetricIntervals():
+
+    intervals = bootstrapMetricIntervals(40, 113, 8)
+    assert intervals == bootstrapMetricIntervals(40, 113, 8)
+    for metricName, metric in zip(metricNames, getMetricsFromCounts(40, 113, 8)):
+        low, high = intervals[metricName]
+        assert low < metric < high
+
+    # ten times as many nuclei, intervals about sqrt(10) times narrower
+    largeIntervals = bootstrapMetricIntervals(400, 1130, 80)
+    for metricName in metricNames:
+        width = intervals[metricName][1] - intervals[metricName][0]
+        largeWidth = largeIntervals[metricName][1] - largeIntervals[metricName][0]
+        assert 2 < width / largeWidth < 4.5
+
+    startTime = time.perf_counter()
+    bootstrapMetricIntervals(40000, 113000, 8000, nResamples=10000)
+    assert time.perf_counter() - startTime < 0.5
+
+
+def testSaveResultsTestListIntervals(tmp_path):
+
+    resDF = saveResultsTestList([testLabelImageFile], gtLabelImageFile, str(tmp_path), ['a'], reportMode='skip',
+                                confidenceLevel=0.9)
+
+    intervals = bootstrapMetricIntervals(40, 113, 8, confidenceLevel=0.9)
+    metricsDF = pd.read_csv(str(tmp_path / 'metrics.csv'), index_col='label')
+    for metricName in metricNames:
+        assert tuple(resDF[[metricName + 'CILow', metricName + 'CIHigh']].iloc[0]) == intervals[metricName]
+        assert np.isclose(metricsDF.loc['a', metricName + 'CILow'], intervals[metricName][0])
+
+    resDF = saveResultsTestList([testLabelImageFile], gtLabelImageFile, str(tmp_path), ['a'], reportMode='skip',
+                                nBootstrap=0)
+    assert 'fMeasureCILow' not in resDF.columns
+
+
+if __name__ == '__main__':
+
+    testSegQualErrorsCounts()
+    testSegQualErrorsPrecomputedGT()
+    testSegQualErrorsWithoutFillingHoles(pathlib.Path(tempfile.mkdtemp()))
+    testSegQualErrorsInstrumentation()
+    testSegQualErrorsTestListParallel()
+    testSaveResultsTestList(pathlib.Path(tempfile.mkdtemp()))
+    testSaveResultsTestListResume(pathlib.Path(tempfile.mkdtemp()))
+    testSaveResultsTestListStop(pathlib.Path(tempfile.mkdtemp()))
+    testClassifyCentroidsScaling()
+    testBootstrapMetricIntervals()
+    testSaveResultsTestListIntervals(pathlib.Path(tempfile.mkdtemp()))
@@ -0,0 +1,96 @@
+import pathlib
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from nuclearSegQualityMetrics.SegmentationQualityMetrics import segQualErrors, segQualErrorsTiles, saveResultsTestList
+from nuclearSegQualityMetrics.reports import renderReports
+from nuclearSegQualityMetrics.spatialMetrics import tileIndices, tileCounts
+
+from labelImageFixtures import gtLabelImageFile, testLabelImageFile
+
+
+def testTileIndices():
+
+    shape = (10, 20, 40)
+    centroids = np.array([[0, 0, 0], [4.9, 9.9, 19.9], [5, 10, 20], [9.5, 19.5, 40]])
+
+    assert list(tileIndices(centroids, shape, (2, 2, 2))) == [0, 0, 7, 7]
+    assert list(tileIndices(centroids, shape, (4, 1, 1))) == [0, 1, 2, 3]
+
+
+def testTileCounts():
+
+    rng = np.random.RandomState(0)
+    shape = (30, 60, 90)
+    tileGrid = (3, 2, 4)
+    gtCentroids = rng.uniform(0, 1, size=(500, 3)) * shape
+    testCentroids = rng.uniform(0, 1, size=(400, 3)) * shape
+    gtTPMask = rng.uniform(size=500) < 0.7
+    testTPMask = rng.uniform(size=400) < 0.6
+    testNoiseFPMask = ~testTPMask & (rng.uniform(size=400) < 0.5)
+
+    tileMetrics = tileCounts(gtCentroids, gtTPMask, testCentroids, testTPMask, testNoiseFPMask, shape, tileGrid)
+
+    # brute force, tile by tile
+    edges = [np.linspace(0, x, n + 1) for x, n in zip(shape, tileGrid)]
+    for tile in np.ndindex(*tileGrid):
+        gtIn = np.all([(gtCentroids[:, x] >= edges[x][tile[x]]) & (gtCentroids[:, x] < edges[x][tile[x] + 1])
+                       for x in range(3)], axis=0)
+        testIn = np.all([(testCentroids[:, x] >= edges[x][tile[x]]) & (testCentroids[:, x] < edges[x][tile[x] + 1])
+                         for x in range(3)], axis=0)
+        assert tileMetrics['nGT'][tile] == gtIn.sum()
+        assert tileMetrics['nTP'][tile] == (testIn & testTPMask).sum()
+        assert tileMetrics['nFP'][tile] == (testIn & ~testTPMask).sum()
+        assert tileMetrics['nFN'][tile] == (gtIn & ~gtTPMask).sum()
+        assert tileMetrics['nNoiseFP'][tile] == (testIn & testNoiseFPMask).sum()
+        assert np.isclose(tileMetrics['Recall'][tile], (gtIn & gtTPMask).sum() / gtIn.sum())
+
+
+def testSegQualErrorsTiles():
+
+    for matching in ('centroid', 'overlap'):
+        errors, tileMetrics = segQualErrorsTiles(testLabelImageFile, gtLabelImageFile, 4, matching=matching)
+
+        assert errors == segQualErrors(testLabelImageFile, gtLabelImageFile, matching=matching)
+        assert tileMetrics['nGT'].shape == (4, 1, 1)
+        nFP, nTP, nFN, nNoiseFP, nNonNoiseFP = errors
+        assert (tileMetrics['nFP'].sum(), tileMetrics['nTP'].sum(), tileMetrics['nNoiseFP'].sum()) == \
+            (nFP, nTP, nNoiseFP)
+        assert tileMetrics['nGT'].sum() == nTP + nFN
+
+
+def testSaveResultsTestListTiles(tmp_path):
+
+    resDF = saveResultsTestList([testLabelImageFile], gtLabelImageFile, str(tmp_path), ['a'], saveDebugInfo=True,
+                                reportMode='skip', tileGrid=(4, 2, 2))
+
+    tileDF = pd.read_csv(str(tmp_path / 'tileMetrics.csv'))
+    assert len(tileDF) == 16
+    assert set(tileDF['label']) == {'a'}
+    assert tileDF['nTP'].sum() == resDF['nTP'].iloc[0]
+    assert (tmp_path / 'farsight_label_croped_GT_8bit' / 'tileMetrics.csv').is_file()
+
+    # without debug info, from parallel workers, and from the manifest when resumed
+    outputDir = tmp_path / 'noDebugInfo'
+    outputDir.mkdir()
+    for nWorkers, resume in ((2, False), (1, True)):
+        saveResultsTestList([testLabelImageFile, testLabelImageFile], gtLabelImageFile, str(outputDir), ['b', 'c'],
+                            nWorkers=nWorkers, reportMode='skip', resume=resume, tileGrid=(4, 2, 2))
+        otherTileDF = pd.read_csv(str(outputDir / 'tileMetrics.csv'))
+        assert list(otherTileDF['label']) == ['b'] * 16 + ['c'] * 16
+        np.testing.assert_array_equal(otherTileDF['nFN'].values[16:], tileDF['nFN'].values)
+        np.testing.assert_allclose(otherTileDF['Recall'].values[:16], tileDF['Recall'].values)
+        assert not (outputDir / 'farsight_label_croped_GT_8bit').exists()
+
+    assert str(tmp_path / 'tileMetrics.png') in renderReports(str(tmp_path))
+    assert (tmp_path / 'tileMetrics.png').is_file()
+
+
+if __name__ == '__main__':
+
+    testTileIndices()
+    testTileCounts()
+    testSegQualErrorsTiles()
+    testSaveResultsTestListTiles(pathlib.Path(tempfile.mkdtemp()))
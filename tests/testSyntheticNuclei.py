@@ -0,0 +1,23 @@
+import pathlib
+import tempfile
+
+from nuclearSegQualityMetrics.SegmentationQualityMetrics import segQualErrors
+from nuclearSegQualityMetrics.syntheticNuclei import writeSyntheticLabelPair
+
+
+def testSyntheticLabelPairKnownErrors(tmp_path):
+
+    for seed in range(3):
+        gtLabelImageFile, testLabelImageFile, expected = \
+            writeSyntheticLabelPair(str(tmp_path), stem='seed{}'.format(seed), shape=(48, 192, 192),
+                                    nNuclei=150, radiusMean=3.0, radiusStd=0.3, missedRate=0.1, spuriousRate=0.1, displacedRate=0.1, seed=seed)
+
+        nFP, nTP, nFN, nNoiseFP, nNonNoiseFP = segQualErrors(testLabelImageFile, gtLabelImageFile)
+
+        assert (nFP, nTP, nFN, nNoiseFP, nNonNoiseFP) == \
+            (expected['nFP'], expected['nTP'], expected['nFN'], expected['nNoiseFP'], expected['nNonNoiseFP'])
+
+
+if __name__ == '__main__':
+
+    testSyntheticLabelPairKnownErrors(pathlib.Path(tempfile.mkdtemp()))
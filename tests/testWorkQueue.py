@@ -0,0 +1,140 @@
+import os
+import pathlib
+import tempfile
+import time
+
+import tifffile
+
+from nuclearSegQualityMetrics.SegmentationQualityMetrics import segQualErrors
+from nuclearSegQualityMetrics.featureCache import FeatureCache, setDefaultFeatureCache
+from nuclearSegQualityMetrics.workQueue import WorkQueue, aggregateWorkQueue, runWorker, saveResultsWorkQueue
+
+from labelImageFixtures import gtLabelImageFile, expectedErrors, copyTestLabelImageFiles
+
+
+def testClaimReclaim(tmp_path):
+
+    queue = WorkQueue(str(tmp_path / 'queue'))
+    assert queue.submit(copyTestLabelImageFiles(tmp_path, 3), gtLabelImageFile, str(tmp_path / 'output'), ['a', 'b', 'c']) == 3
+    # submitting again with resume queues nothing new
+    assert queue.submit(copyTestLabelImageFiles(tmp_path, 3), gtLabelImageFile, str(tmp_path / 'output'),
+                        ['a', 'b', 'c'], resume=True) == 0
+
+    queue.heartbeat('alive')
+    queue.heartbeat('dead')
+    assert queue.claim('alive')['label'] == 'a'
+    assert queue.claim('dead')['label'] == 'b'
+    assert queue.status() == {'pending': 1, 'claimed': 2, 'results': 0, 'failed': 0}
+
+    # the claim of a worker whose heartbeat is stale goes back to pending
+    staleTime = time.time() - 120
+    os.utime(str(tmp_path / 'queue' / 'workers' / 'dead'), (staleTime, staleTime))
+    assert queue.reclaimAbandoned(heartbeatTimeout=60) == ['000001']
+    assert queue.status() == {'pending': 2, 'claimed': 1, 'results': 0, 'failed': 0}
+
+
+def testWorkerReclaims(tmp_path):
+
+    testLabelImageFiles = copyTestLabelImageFiles(tmp_path, 3)
+    queue = WorkQueue(str(tmp_path / 'queue'))
+    queue.submit(testLabelImageFiles, gtLabelImageFile, str(tmp_path / 'output'), ['a', 'b', 'c'])
+
+    # claimed by a worker that died without ever sending a heartbeat
+    queue.claim('dead')
+
+    assert runWorker(str(tmp_path / 'queue'), workerId='alive', pollInterval=0.1) == 3
+    assert queue.isDone()
+    assert [(x['label'], x['workerId'], tuple(x['errors'])) for x in queue.results()] == \
+        [(x, 'alive', expectedErrors) for x in ('a', 'b', 'c')]
+    assert not os.listdir(str(tmp_path / 'queue' / 'workers'))
+
+
+def testSaveResultsWorkQueue(tmp_path):
+
+    testLabelImageFiles = copyTestLabelImageFiles(tmp_path, 4)
+    outputDir = tmp_path / 'output'
+
+    # the spawned local workers use the feature cache of this process
+    setDefaultFeatureCache(FeatureCache(str(tmp_path / 'cache')))
+    try:
+        resDF = saveResultsWorkQueue(testLabelImageFiles, gtLabelImageFile, str(outputDir), ['a', 'b', 'c', 'd'],
+                                     str(tmp_path / 'queue'), saveDebugInfo=True, reportMode='skip',
+                                     nLocalWorkers=3, pollInterval=0.1, tileGrid=2)
+    finally:
+        setDefaultFeatureCache(None)
+    # the features of the ground truth and of the 4 test files, computed by the workers
+    assert len(list((tmp_path / 'cache').glob('*.npz'))) == 5
+
+    assert list(resDF['label']) == ['a', 'b', 'c', 'd']
+    assert list(resDF['nTP']) == [113] * 4
+    assert (outputDir / 'metrics.csv').is_file()
+    assert (outputDir / 'test3_GT_8bit' / 'testData.csv').is_file()
+    assert len((outputDir / 'runManifest.jsonl').read_text().splitlines()) == 4
+    assert (outputDir / 'tileMetrics.csv').read_text().count('\nd,') == 2
+
+
+def testSaveResultsWorkQueueFailures(tmp_path):
+
+    # a worker of a queue without a job fails before its heartbeat starts
+    try:
+        runWorker(str(tmp_path / 'queue'), workerId='early')
+    except AssertionError:
+        pass
+    else:
+        raise AssertionError('runWorker ran without a job')
+    assert not os.path.exists(str(tmp_path / 'queue' / 'workers' / 'early'))
+
+    testLabelImageFiles = copyTestLabelImageFiles(tmp_path, 2)
+    (tmp_path / 'broken.tif').write_bytes(b'not a tiff')
+    outputDir = tmp_path / 'output'
+
+    try:
+        saveResultsWorkQueue(testLabelImageFiles + [str(tmp_path / 'broken.tif')], gtLabelImageFile,
+                             str(outputDir), ['a', 'b', 'c'], str(tmp_path / 'queue'), reportMode='skip',
+                             nLocalWorkers=2, pollInterval=0.1)
+    except RuntimeError as error:
+        assert '1 of 3 tasks' in str(error) and 'broken.tif' in str(error)
+    else:
+        raise AssertionError('The failed task was not reported')
+
+    # the results of the other tasks are saved
+    assert len((outputDir / 'metrics.csv').read_text().splitlines()) == 3
+
+
+def testResubmitChangedFiles(tmp_path):
+
+    testLabelImageFiles = copyTestLabelImageFiles(tmp_path, 2)
+    outputDir = tmp_path / 'output'
+    saveResultsWorkQueue(testLabelImageFiles, gtLabelImageFile, str(outputDir), ['a', 'b'], str(tmp_path / 'queue'),
+                         reportMode='skip', nLocalWorkers=1, pollInterval=0.1)
+
+    # the second test file is overwritten at the same path, with half of its nuclei gone
+    labelImage = tifffile.imread(testLabelImageFiles[1])
+    labelImage[labelImage % 2 == 1] = 0
+    tifffile.imwrite(testLabelImageFiles[1], labelImage)
+    changedErrors = segQualErrors(testLabelImageFiles[1], gtLabelImageFile)
+    assert changedErrors != expectedErrors
+
+    for resume in (True, False):
+        queue = WorkQueue(str(tmp_path / 'queue'))
+        nQueued = queue.submit(testLabelImageFiles, gtLabelImageFile, str(outputDir), ['a', 'b'], resume=resume)
+        # with resume, only the changed file is computed again
+        assert nQueued == (1 if resume else 2)
+        runWorker(str(tmp_path / 'queue'), workerId='worker', pollInterval=0.1)
+        resDF = aggregateWorkQueue(str(tmp_path / 'queue'), reportMode='skip')
+        assert [tuple(x) for x in resDF[['nFP', 'nTP', 'nFN', 'nNoiseFP', 'nNonNoiseFP']].values] == \
+            [expectedErrors, changedErrors]
+        # the second file changes again, its result is left out until it is computed again
+        labelImage[labelImage == labelImage.max()] = 0
+        tifffile.imwrite(testLabelImageFiles[1], labelImage)
+        changedErrors = segQualErrors(testLabelImageFiles[1], gtLabelImageFile)
+        assert list(aggregateWorkQueue(str(tmp_path / 'queue'), reportMode='skip')['label']) == ['a']
+
+
+if __name__ == '__main__':
+
+    testClaimReclaim(pathlib.Path(tempfile.mkdtemp()))
+    testWorkerReclaims(pathlib.Path(tempfile.mkdtemp()))
+    testSaveResultsWorkQueue(pathlib.Path(tempfile.mkdtemp()))
+    testSaveResultsWorkQueueFailures(pathlib.Path(tempfile.mkdtemp()))
+    testResubmitChangedFiles(pathlib.Path(tempfile.mkdtemp()))